@@ -1,3 +1,4 @@
 from .inference import PianoTranscription
 from .config import sample_rate
-from .utilities import load_audio
\ No newline at end of file
+from .utilities import load_audio
+from .streaming import stream_audio, decode_audio
@@ -0,0 +1,252 @@
+import os
+import json
+import time
+import queue
+import threading
+import traceback
+
+from .streaming import decode_audio
+from . import config
+
+
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.flac', '.ogg', '.m4a', '.aac', '.wma')
+
+
+def find_audio_files(folder, recursive=False):
+    """Audio files in folder, sorted by path."""
+    paths = []
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        paths += [os.path.join(root, name) for name in sorted(files)
+            if os.path.splitext(name)[1].lower() in AUDIO_EXTENSIONS]
+        if not recursive:
+            break
+    return paths
+
+
+class BatchTranscriber(object):
+    def __init__(self, transcriptor, output_dir, queue_size=2, batch_size=None,
+        overlap=None, pitches=None, progress_callback=None, file_callback=None,
+        skip_silence=None):
+        """Transcribe many audio files to MIDI in a three stage pipeline: a
+        decoder thread prefetches the next files while the model infers the
+        current one, and a writer thread post processes and writes the MIDI
+        of the previous one. The queues between the stages hold at most
+        queue_size files, which bounds the memory.
+
+        Finished files are appended to batch_state.jsonl in output_dir, so a
+        restarted batch skips them. Failed files are retried on restart.
+
+        Args:
+          transcriptor: PianoTranscription
+          output_dir: str, MIDI files, the state and the report are written here
+          queue_size: int, decoded / inferred files waiting for the next stage
+          batch_size: None | int | 'auto', see PianoTranscription.transcribe
+          overlap: None | float
+          pitches: None | iterable of MIDI notes
+          skip_silence: None | bool, see PianoTranscription.infer
+          progress_callback: None | callable, progress callback of forward
+          file_callback: None | callable(record), called with the record of
+            each finished or failed file, see run
+        """
+        self.transcriptor = transcriptor
+        self.output_dir = output_dir
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.overlap = overlap
+        self.pitches = pitches
+        self.skip_silence = skip_silence
+        self.progress_callback = progress_callback
+        self.file_callback = file_callback
+        self.state_path = os.path.join(output_dir, 'batch_state.jsonl')
+        self.report_path = os.path.join(output_dir, 'batch_report.json')
+
+    def midi_path(self, audio_path, root=None):
+        """output_dir/<path relative to root>.mid"""
+        relative = os.path.relpath(audio_path, root) if root else os.path.basename(audio_path)
+        return os.path.join(self.output_dir, os.path.splitext(relative)[0] + '.mid')
+
+    def load_state(self):
+        """Returns:
+          done: dict, audio_path -> record of the last successful run
+        """
+        done = {}
+        if not os.path.exists(self.state_path):
+            return done
+        with open(self.state_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Line cut short by an interrupted run
+                    continue
+                if record['status'] == 'done':
+                    done[record['audio_path']] = record
+                else:
+                    done.pop(record['audio_path'], None)
+        return done
+
+    @staticmethod
+    def _signature(audio_path):
+        stat = os.stat(audio_path)
+        return [stat.st_size, stat.st_mtime]
+
+    def _is_done(self, audio_path, record):
+        """The audio is unchanged and its MIDI still exists."""
+        try:
+            return record['signature'] == self._signature(audio_path) and \
+                os.path.exists(record['midi_path'])
+        except OSError:
+            return False
+
+    def run(self, audio_paths, root=None, resume=True):
+        """Transcribe audio_paths.
+
+        Args:
+          audio_paths: list of str
+          root: None | str, MIDI files keep the folders of audio_paths
+            relative to root, None to write them flat into output_dir
+          resume: bool, skip files finished by an earlier run
+
+        Returns:
+          report: dict, also written to batch_report.json, {
+            'files': [record, ...], one per file in this run,
+            'failures': [record, ...],
+            'skipped': [audio_path, ...], finished by an earlier run,
+            'total': {'files', 'done', 'failed', 'skipped', 'audio_seconds',
+              'wall_seconds', 'rtf', 'files_per_minute',
+              'decode_seconds', 'infer_seconds', 'write_seconds'}}
+          A record is {'audio_path', 'midi_path', 'status': 'done' | 'failed',
+            'audio_seconds', 'decode_seconds', 'infer_seconds', 'write_seconds',
+            'notes', 'skipped_fraction', 'error', 'traceback', 'signature'}.
+          rtf is wall_seconds / audio_seconds of the whole run, lower is faster.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        done = self.load_state() if resume else {}
+        skipped = [path for path in audio_paths if path in done and self._is_done(path, done[path])]
+        skipped_set = set(skipped)
+        todo = [path for path in audio_paths if path not in skipped_set]
+
+        decoded = queue.Queue(maxsize=self.queue_size)
+        inferred = queue.Queue(maxsize=self.queue_size)
+        records = []
+        start_time = time.time()
+
+        with open(self.state_path, 'a', encoding='utf-8') as state:
+            decoder = threading.Thread(target=self._decode, args=(todo, decoded), daemon=True)
+            writer = threading.Thread(target=self._write, args=(inferred, records, root, state), 
+                daemon=True)
+            decoder.start()
+            writer.start()
+
+            # Infer in this thread. The model may be shared with the jobs of 
+            # TranscriptionService, hold its lock while forwarding
+            while True:
+                item = decoded.get()
+                if item is None:
+                    break
+                record = item.pop('record')
+                if record['status'] == 'done':
+                    try:
+                        with self.transcriptor.lock:
+                            t = time.time()
+                            item['output_dict'] = self.transcriptor.infer(item.pop('audio'),
+                                gui_callback=self.progress_callback, batch_size=self.batch_size,
+                                overlap=self.overlap, skip_silence=self.skip_silence)
+                            record['infer_seconds'] = time.time() - t
+                            record['skipped_fraction'] = self.transcriptor.skipped_fraction
+                    except Exception as e:
+                        self._fail(record, e)
+                item['record'] = record
+                self._put(inferred, item, writer)
+            self._put(inferred, None, writer)
+            writer.join()
+
+        report = self._report(records, skipped, time.time() - start_time)
+        with open(self.report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        return report
+
+    def _decode(self, audio_paths, decoded):
+        for audio_path in audio_paths:
+            record = {'audio_path': audio_path, 'status': 'done', 'decode_seconds': 0.,
+                'infer_seconds': 0., 'write_seconds': 0., 'audio_seconds': 0.}
+            item = {}
+            try:
+                t = time.time()
+                record['signature'] = self._signature(audio_path)
+                item['audio'] = decode_audio(audio_path, sr=config.sample_rate)
+                record['decode_seconds'] = time.time() - t
+                record['audio_seconds'] = len(item['audio']) / config.sample_rate
+            except Exception as e:
+                self._fail(record, e)
+            item['record'] = record
+            decoded.put(item)
+        decoded.put(None)
+
+    @staticmethod
+    def _put(inferred, item, writer):
+        """Put item for the writer, or raise if the writer has stopped, as 
+        waiting for room in the queue would then block forever."""
+        while writer.is_alive():
+            try:
+                inferred.put(item, timeout=1.)
+                return
+            except queue.Full:
+                pass
+        raise RuntimeError('The writer thread of the batch stopped')
+
+    def _write(self, inferred, records, root, state):
+        """Errors of one file are recorded in its record and never stop the 
+        thread, see _put."""
+        while True:
+            item = inferred.get()
+            if item is None:
+                return
+            record = item['record']
+            record.setdefault('midi_path', None)
+            try:
+                record['midi_path'] = self.midi_path(record['audio_path'], root)
+                if record['status'] == 'done':
+                    t = time.time()
+                    os.makedirs(os.path.dirname(record['midi_path']), exist_ok=True)
+                    transcribed_dict = self.transcriptor.post_process(item['output_dict'],
+                        record['midi_path'], pitches=self.pitches, events=False)
+                    record['notes'] = len(transcribed_dict['est_on_off_note_vels'])
+                    record['write_seconds'] = time.time() - t
+            except Exception as e:
+                self._fail(record, e)
+            records.append(record)
+
+            try:
+                state.write(json.dumps(record, ensure_ascii=False) + '\n')
+                state.flush()
+            except Exception:
+                # The file is transcribed again by a restarted batch
+                traceback.print_exc()
+            if self.file_callback:
+                try:
+                    self.file_callback(record)
+                except Exception:
+                    traceback.print_exc()
+
+    @staticmethod
+    def _fail(record, error):
+        record['status'] = 'failed'
+        record['error'] = '{}: {}'.format(type(error).__name__, error)
+        record['traceback'] = traceback.format_exc()
+
+    @staticmethod
+    def _report(records, skipped, wall_seconds):
+        total = {key: sum(record.get(key, 0.) for record in records) for key in
+            ('audio_seconds', 'decode_seconds', 'infer_seconds', 'write_seconds')}
+        failures = [record for record in records if record['status'] == 'failed']
+        total.update({
+            'files': len(records) + len(skipped),
+            'done': len(records) - len(failures),
+            'failed': len(failures),
+            'skipped': len(skipped),
+            'wall_seconds': wall_seconds,
+            'rtf': wall_seconds / total['audio_seconds'] if total['audio_seconds'] > 0 else 0.,
+            'files_per_minute': len(records) / wall_seconds * 60 if wall_seconds > 0 else 0.})
+        return {'files': records, 'failures': failures, 'skipped': skipped, 'total': total}
@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import numpy as np
+
+from . import config
+from .profiling import traced
+
+
+def file_hash(path, chunk_bytes=1 << 20):
+    """Hash of the content of a file, so that a renamed or copied file hits
+    the same cache entries.
+
+    Returns:
+      hash: str, 32 hex digits
+    """
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_bytes), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class StageCache(object):
+    def __init__(self, cache_dir=None, max_bytes=None):
+        """On-disk cache of intermediate results of the transcription
+        pipeline, e.g. the decoded waveform and the output_dict of the model.
+        An entry is a dict of arrays stored as .npy files under a directory
+        named by the hash of its key, and is loaded memory-mapped.
+
+        Entries are evicted least recently used first once the cache is
+        larger than max_bytes. An entry is only visible after all its files
+        are written, so an interrupted write is never loaded.
+
+        Args:
+          cache_dir: None | str, None for config.stage_cache_dir
+          max_bytes: None | int, None for config.stage_cache_max_bytes
+        """
+        self.cache_dir = cache_dir or config.stage_cache_dir
+        self.max_bytes = max_bytes or config.stage_cache_max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def entry_dir(self, key):
+        """key: tuple of str / int / float, e.g. ('waveform', audio_hash, 16000)"""
+        name = hashlib.blake2b(repr(tuple(key)).encode('utf-8'), digest_size=16).hexdigest()
+        return os.path.join(self.cache_dir, name)
+
+    @traced()
+    def load(self, key):
+        """Returns:
+          arrays: None | dict of memory-mapped read only arrays, None on miss
+        """
+        path = self.entry_dir(key)
+        try:
+            with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta['key'] != repr(tuple(key)):
+                return None
+            arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+                for name in meta['arrays']}
+        except (OSError, ValueError, KeyError):
+            return None
+
+        # Mark as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return arrays
+
+    @traced()
+    def save(self, key, arrays):
+        """Store a dict of arrays under key and evict old entries if the
+        cache is too large. An existing entry of key is kept."""
+        path = self.entry_dir(key)
+        if os.path.exists(os.path.join(path, 'meta.json')):
+            return
+
+        tmp_path = '{}.tmp{}'.format(path, os.getpid())
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for name, value in arrays.items():
+            np.save(os.path.join(tmp_path, name + '.npy'), np.asarray(value))
+        with open(os.path.join(tmp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'key': repr(tuple(key)), 'arrays': list(arrays.keys()),
+                'time': time.time()}, f)
+
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            # Written by another process meanwhile
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return
+
+        self.evict(keep=path)
+
+    def entries(self):
+        """Returns:
+          entries: list of (last_used_time, bytes, path), oldest first
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if not os.path.isdir(path) or '.tmp' in name:
+                continue
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(path))
+                entries.append((os.path.getmtime(path), size, path))
+            except OSError:
+                continue
+        entries.sort()
+        return entries
+
+    def size(self):
+        return sum(size for (_, size, _) in self.entries())
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits in
+        max_bytes. keep is never removed."""
+        entries = self.entries()
+        total = sum(size for (_, size, _) in entries)
+        for (_, size, path) in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        for (_, _, path) in self.entries():
+            shutil.rmtree(path, ignore_errors=True)
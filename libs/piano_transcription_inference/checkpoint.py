@@ -0,0 +1,108 @@
+import os
+import json
+import zipfile
+
+from .cache import file_hash
+
+
+def record_path(checkpoint_path):
+    """The record of the last successful verify_checkpoint, next to the
+    checkpoint."""
+    return checkpoint_path + '.verified.json'
+
+
+def _read_record(checkpoint_path):
+    try:
+        with open(record_path(checkpoint_path), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _is_complete(checkpoint_path):
+    """Read the whole checkpoint once to check that it is not truncated or
+    corrupted. Checkpoints saved by torch.save since PyTorch 1.6 are zip
+    files whose members carry CRCs; older ones are checked by loading them."""
+    with open(checkpoint_path, 'rb') as f:
+        magic = f.read(4)
+
+    if magic == b'PK\x03\x04':
+        try:
+            with zipfile.ZipFile(checkpoint_path) as z:
+                return z.testzip() is None
+        except (zipfile.BadZipFile, OSError, EOFError):
+            # A truncated zip has lost its central directory at the end
+            return False
+
+    import torch
+    try:
+        torch.load(checkpoint_path, map_location='cpu')
+        return True
+    except Exception:
+        return False
+
+
+def verify_checkpoint(checkpoint_path):
+    """Check that a checkpoint is complete. The check reads the whole file,
+    so its result is recorded next to the checkpoint with the size, mtime
+    and content hash, and later calls only compare the size and mtime as
+    long as the file is unchanged.
+
+    Args:
+      checkpoint_path: str
+
+    Returns:
+      hash: None if missing or incomplete, else str, see cache.file_hash
+    """
+    try:
+        stat = os.stat(checkpoint_path)
+    except OSError:
+        return None
+
+    record = _read_record(checkpoint_path)
+    if record and record.get('size') == stat.st_size and \
+        record.get('mtime_ns') == stat.st_mtime_ns:
+        return record['hash']
+
+    if not _is_complete(checkpoint_path):
+        return None
+
+    record = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+        'hash': file_hash(checkpoint_path)}
+    try:
+        with open(record_path(checkpoint_path), 'w', encoding='utf-8') as f:
+            json.dump(record, f)
+    except OSError:
+        # Read-only folder, verify again next time
+        pass
+    return record['hash']
+
+
+def load_state_dict(checkpoint_path, sub_model=None):
+    """Load the weights of a checkpoint memory-mapped, so that only the
+    tensors used are read from disk, e.g. not the pedal weights when
+    sub_model is 'note_model'. Checkpoints in the legacy format, or with
+    PyTorch before 2.1, are read whole.
+
+    Args:
+      checkpoint_path: str
+      sub_model: None | 'note_model' | 'pedal_model', weights of one
+        sub-model of a Note_pedal checkpoint, the others are dropped
+
+    Returns:
+      state_dict: dict, tensors on CPU
+      mmapped: bool, the tensors are backed by the file
+    """
+    import torch
+
+    try:
+        checkpoint = torch.load(checkpoint_path, map_location='cpu', mmap=True)
+        mmapped = True
+    except (TypeError, RuntimeError):
+        checkpoint = torch.load(checkpoint_path, map_location='cpu')
+        mmapped = False
+
+    state_dict = checkpoint['model']
+    if sub_model is not None and sub_model in state_dict:
+        state_dict = state_dict[sub_model]
+    return state_dict, mmapped
@@ -4,4 +4,20 @@ begin_note = 21     # MIDI note of A0, the lowest note of a piano.
 segment_seconds = 10.	# Training segment duration
 hop_seconds = 1.
 frames_per_second = 100
-velocity_scale = 128
\ No newline at end of file
+velocity_scale = 128
+
+# CPU fast mode (PianoTranscription(cpu_fast=True)): torch thread counts,
+# None keeps the torch default (intra-op: number of physical cores)
+intra_op_threads = None
+inter_op_threads = None
+
+# Stage cache (StageCache): decoded waveforms and model outputs by audio
+# content, evicted least recently used first beyond the size limit
+stage_cache_dir = 'cache'
+stage_cache_max_bytes = 2 * 1024 ** 3
+
+# Silence skipping (PianoTranscription(skip_silence=True), off by default):
+# segments whose loudest block of silence_block_samples is below this RMS
+# level in dBFS are not forwarded, their outputs are zeros
+silence_threshold_db = -60.
+silence_block_samples = 1024
@@ -0,0 +1,279 @@
+import os
+import time
+import numpy as np
+
+from . import config
+from .profiling import traced
+
+
+"""Exported graphs return the outputs as a tuple in this order."""
+NOTE_OUTPUT_KEYS = ('reg_onset_output', 'reg_offset_output', 'frame_output',
+    'velocity_output')
+PEDAL_OUTPUT_KEYS = ('reg_pedal_onset_output', 'reg_pedal_offset_output',
+    'pedal_frame_output')
+OUTPUT_KEYS = {
+    'Note_pedal': NOTE_OUTPUT_KEYS + PEDAL_OUTPUT_KEYS,
+    'Regress_onset_offset_frame_velocity_CRNN': NOTE_OUTPUT_KEYS,
+    'Regress_pedal_CRNN': PEDAL_OUTPUT_KEYS}
+
+BACKENDS = ('torch', 'torchscript', 'onnxruntime')
+
+
+def export_path(checkpoint_path, model_type, segment_samples, backend):
+    """Exported graph cached next to the checkpoint, e.g.
+    models/note_F13D0.9186.Note_pedal.160000.onnx"""
+    ext = {'torchscript': '.ts.pt', 'onnxruntime': '.onnx'}[backend]
+    stem = os.path.splitext(checkpoint_path)[0]
+    return '{}.{}.{}{}'.format(stem, model_type, segment_samples, ext)
+
+
+def is_up_to_date(path, checkpoint_path):
+    return os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(checkpoint_path)
+
+
+def _tuple_output_module(model, keys):
+    import torch
+
+    class TupleOutput(torch.nn.Module):
+        """Return the output dict of model as a tuple, for tracing and ONNX."""
+        def __init__(self, model):
+            super(TupleOutput, self).__init__()
+            self.model = model
+
+        def forward(self, waveform):
+            output_dict = self.model(waveform)
+            return tuple(output_dict[key] for key in keys)
+
+    return TupleOutput(model).eval()
+
+
+def export_torchscript(model, model_type, path, segment_samples):
+    """Trace model to TorchScript. The traced graph accepts any batch size.
+
+    Args:
+      model: nn.Module in eval mode, on CPU
+      model_type: str
+      path: str
+      segment_samples: int
+    """
+    import torch
+
+    wrapper = _tuple_output_module(model, OUTPUT_KEYS[model_type])
+    waveform = torch.zeros(1, segment_samples)
+    with torch.no_grad():
+        traced = torch.jit.trace(wrapper, waveform, check_trace=False)
+    traced.save(path)
+
+
+def export_onnx(model, model_type, path, segment_samples, opset_version=17):
+    """Export model to ONNX with a dynamic batch axis. Needs the onnx package.
+
+    Args:
+      model: nn.Module in eval mode, on CPU
+      model_type: str
+      path: str
+      segment_samples: int
+    """
+    import torch
+
+    keys = OUTPUT_KEYS[model_type]
+    wrapper = _tuple_output_module(model, keys)
+    waveform = torch.zeros(1, segment_samples)
+    dynamic_axes = {key: {0: 'batch'} for key in ('waveform',) + keys}
+    with torch.no_grad():
+        torch.onnx.export(wrapper, waveform, path, input_names=['waveform'],
+            output_names=list(keys), dynamic_axes=dynamic_axes,
+            opset_version=opset_version, dynamo=False)
+
+
+def check_against_eager(model, model_type, exported, segment_samples, atol=1e-3,
+    batch_size=2, seed=1234):
+    """Compare an exported graph with the eager model on random audio.
+
+    Args:
+      model: eager nn.Module
+      model_type: str
+      exported: callable, numpy (batch_size, segment_samples) -> output_dict
+        of numpy arrays
+      atol: float
+
+    Returns:
+      max_diffs: dict, key -> max absolute difference
+
+    Raises:
+      RuntimeError if any difference is larger than atol
+    """
+    import torch
+
+    waveform = np.random.RandomState(seed).uniform(-0.1, 0.1,
+        (batch_size, segment_samples)).astype(np.float32)
+    with torch.no_grad():
+        expected = model.eval()(torch.from_numpy(waveform))
+    actual = exported(waveform)
+
+    max_diffs = {key: float(np.max(np.abs(expected[key].numpy() - actual[key])))
+        for key in OUTPUT_KEYS[model_type]}
+    if not all(diff <= atol for diff in max_diffs.values()):
+        raise RuntimeError('Exported model differs from eager: {}'.format(max_diffs))
+    return max_diffs
+
+
+class TorchScriptModel(object):
+    def __init__(self, path, model_type, device='cpu'):
+        """Run an exported TorchScript graph, outputs as a dict."""
+        import torch
+
+        self.keys = OUTPUT_KEYS[model_type]
+        self.module = torch.jit.load(path, map_location=device).eval()
+
+    def parameters(self):
+        return self.module.parameters()
+
+    def eval(self):
+        return self
+
+    def __call__(self, waveform):
+        """waveform: torch.Tensor, returns output_dict of torch.Tensor."""
+        return dict(zip(self.keys, self.module(waveform)))
+
+    def run_numpy(self, waveform):
+        import torch
+
+        with torch.no_grad():
+            output_dict = self(torch.from_numpy(np.ascontiguousarray(waveform, dtype=np.float32)))
+        return {key: value.numpy() for key, value in output_dict.items()}
+
+
+class OnnxRuntimeModel(object):
+    def __init__(self, path, model_type, device='cpu', intra_op_threads=None,
+        inter_op_threads=None):
+        """Run an exported ONNX graph with onnxruntime. Does not import torch.
+
+        Args:
+          path: str
+          model_type: str
+          device: 'cuda' | 'cpu', cuda needs onnxruntime-gpu
+          intra_op_threads: None | int
+          inter_op_threads: None | int
+        """
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError('The onnxruntime backend needs onnxruntime: pip install onnxruntime')
+
+        options = onnxruntime.SessionOptions()
+        if intra_op_threads:
+            options.intra_op_num_threads = int(intra_op_threads)
+        if inter_op_threads:
+            options.inter_op_num_threads = int(inter_op_threads)
+
+        providers = ['CPUExecutionProvider']
+        if 'cuda' in str(device) and \
+            'CUDAExecutionProvider' in onnxruntime.get_available_providers():
+            providers.insert(0, 'CUDAExecutionProvider')
+
+        self.keys = OUTPUT_KEYS[model_type]
+        self.session = onnxruntime.InferenceSession(path, options, providers=providers)
+
+    def run_numpy(self, waveform):
+        """waveform: (batch_size, segment_samples) float32, returns output_dict
+        of numpy arrays."""
+        outputs = self.session.run(list(self.keys),
+            {'waveform': np.ascontiguousarray(waveform, dtype=np.float32)})
+        return dict(zip(self.keys, outputs))
+
+    __call__ = run_numpy
+
+
+@traced()
+def forward_numpy(model, x, batch_size, progress_callback=None):
+    """Same as pytorch_utils.forward for models with a run_numpy method, e.g.
+    OnnxRuntimeModel. Does not import torch.
+
+    Args:
+      model: object with run_numpy(waveform) -> output_dict
+      x: (N, segment_samples)
+      batch_size: int
+      progress_callback: None | callable(processed_segments, total_segments,
+        elapsed_seconds, segments_per_second)
+
+    Returns:
+      output_dict: dict, e.g. {
+        'frame_output': (segments_num, frames_num, classes_num),
+        ...}
+    """
+    output_dict = {}
+    pointer = 0
+    total_segments = len(x)
+    start_time = time.time()
+
+    while pointer < total_segments:
+        batch_output_dict = model.run_numpy(x[pointer : pointer + batch_size])
+
+        for key in batch_output_dict.keys():
+            value = batch_output_dict[key]
+            if key not in output_dict:
+                output_dict[key] = np.empty((total_segments,) + value.shape[1:], dtype=value.dtype)
+            output_dict[key][pointer : pointer + len(value)] = value
+
+        pointer = min(pointer + batch_size, total_segments)
+
+        if progress_callback:
+            elapsed = time.time() - start_time
+            rate = pointer / elapsed if elapsed > 0 else 0
+            progress_callback(pointer, total_segments, elapsed, rate)
+
+    return output_dict
+
+
+def load_exported_model(build_eager_model, checkpoint_path, model_type, segment_samples,
+    backend, device='cpu', gui_callback=None):
+    """Load the exported graph of backend cached next to the checkpoint. It is
+    exported and checked against the eager model first if missing or older
+    than the checkpoint.
+
+    Args:
+      build_eager_model: callable() -> eager nn.Module with the checkpoint
+        loaded on CPU, only called when exporting
+      checkpoint_path: str
+      model_type: str
+      segment_samples: int
+      backend: 'torchscript' | 'onnxruntime'
+      device: 'cuda' | 'cpu'
+
+    Returns:
+      model: TorchScriptModel | OnnxRuntimeModel
+    """
+    path = export_path(checkpoint_path, model_type, segment_samples, backend)
+
+    def load():
+        if backend == 'torchscript':
+            return TorchScriptModel(path, model_type, device=device)
+        return OnnxRuntimeModel(path, model_type, device=device,
+            intra_op_threads=config.intra_op_threads,
+            inter_op_threads=config.inter_op_threads)
+
+    if is_up_to_date(path, checkpoint_path):
+        return load()
+
+    if gui_callback:
+        gui_callback('正在导出 {} 模型（仅首次）...'.format(backend))
+    print('Export {} to {}'.format(backend, path))
+    eager_model = build_eager_model()
+    tmp_path = path + '.tmp'
+    if backend == 'torchscript':
+        export_torchscript(eager_model, model_type, tmp_path, segment_samples)
+    else:
+        export_onnx(eager_model, model_type, tmp_path, segment_samples)
+    os.replace(tmp_path, path)
+
+    model = load()
+    try:
+        max_diffs = check_against_eager(eager_model, model_type, model.run_numpy,
+            segment_samples)
+    except RuntimeError:
+        del model
+        os.remove(path)
+        raise
+    print('Max difference to eager: {}'.format(max_diffs))
+    return model
@@ -1,17 +1,25 @@
 import os
 import numpy as np
 import time
+import threading
 import librosa
 from pathlib import Path
 import urllib.request
-import torch
 
-from .utilities import (create_folder, get_filename, RegressionPostProcessor, write_events_to_midi)
-from .models import Regress_onset_offset_frame_velocity_CRNN, Note_pedal
-from .pytorch_utils import move_data_to_device, forward
+from .utilities import (create_folder, get_filename, RegressionPostProcessor, write_events_to_midi, 
+    get_available_memory)
+from .streaming import SegmentStitcher, StreamingPostProcessor, decode_audio
+from .export import BACKENDS, load_exported_model, forward_numpy
+from .cache import file_hash
+from .checkpoint import verify_checkpoint, record_path, load_state_dict
+from .profiling import traced
 from . import config
 
 
+# Peak activation memory of one 10 s fp32 segment in Note_pedal, measured on CPU
+SEGMENT_MEMORY_BYTES = 160e6
+
+
 
 def download_with_progress(url, filename, progress_callback=None):
     def hook(count, block_size, total_size):
@@ -22,8 +30,34 @@ def download_with_progress(url, filename, progress_callback=None):
     urllib.request.urlretrieve(url, filename, reporthook=hook)
 
 
+"""Sub-models and their weights in a Note_pedal checkpoint."""
+SUB_MODEL_KEYS = {
+    'Regress_onset_offset_frame_velocity_CRNN': 'note_model',
+    'Regress_pedal_CRNN': 'pedal_model'}
+
+
+def build_model(model_type, checkpoint_path, device, frames_per_second, classes_num):
+    """Build the eager PyTorch model and load the checkpoint. A sub-model 
+    can be loaded from a Note_pedal checkpoint, the weights of the other 
+    sub-model are never read.
+
+    The checkpoint is memory-mapped and its tensors become the parameters 
+    without a copy, so startup only maps the file and pages are read on 
+    first use. Sharded worker processes share these pages."""
+    from . import models
+
+    Model = getattr(models, model_type)
+    model = Model(frames_per_second=frames_per_second, classes_num=classes_num)
+
+    (state_dict, mmapped) = load_state_dict(checkpoint_path, SUB_MODEL_KEYS.get(model_type))
+    # assign is only known to PyTorch 2.1 and later, as is mmap
+    kwargs = {'assign': True} if mmapped else {}
+    model.load_state_dict(state_dict, strict=False, **kwargs)
+    return model
+
+
 class PianoTranscription(object):
-    def __init__old(self, model_type='Note_pedal', checkpoint_path=None, segment_samples=16000*10, device=torch.device('cuda')):
+    def __init__old(self, model_type='Note_pedal', checkpoint_path=None, segment_samples=16000*10, device='cuda'):
         """Class for transcribing piano solo recording.
 
         Args:
@@ -32,6 +66,9 @@ class PianoTranscription(object):
           segment_samples: int
           device: 'cuda' | 'cpu'
         """
+        import torch
+        from .models import Regress_onset_offset_frame_velocity_CRNN, Note_pedal
+
         if not checkpoint_path: 
             checkpoint_path='{}/piano_transcription_inference_data/note_F1=0.9677_pedal_F1=0.9186.pth'.format(os.getcwd())
         print('Checkpoint path: {}'.format(checkpoint_path))
@@ -81,7 +118,9 @@ class PianoTranscription(object):
         else:
             print('Using CPU.')
 
-    def __init__(self, model_type='Note_pedal', checkpoint_path=None, segment_samples=16000*10, device=torch.device('cuda'), gui_callback=None):
+    def __init__(self, model_type='Note_pedal', checkpoint_path=None, segment_samples=16000*10, device='cuda', gui_callback=None,
+        batch_size=1, cpu_fast=False, backend='torch', shared_logmel=True, overlap=0.5,
+        pedal=True, skip_silence=False, workers=1):
         """Class for transcribing piano solo recording.
 
         Args:
@@ -89,7 +128,41 @@ class PianoTranscription(object):
           checkpoint_path: str
           segment_samples: int
           device: 'cuda' | 'cpu'
+          batch_size: int | 'auto', segments forwarded at once. 'auto' picks the
+            largest batch that fits in available memory.
+          cpu_fast: bool, CPU only. Quantize GRU and Linear layers to int8 
+            dynamically and set torch thread counts from config. Slightly less 
+            accurate, see tools/bench_cpu_fast.py. Other backends only use the 
+            thread counts.
+          backend: 'torch' | 'torchscript' | 'onnxruntime'. The exported graph 
+            is cached next to the checkpoint on first use and checked against 
+            the eager model. 'onnxruntime' does not import torch once exported.
+          shared_logmel: bool, torch backend only. transcribe computes the log 
+            mel of the whole recording once and slices it for the overlapping 
+            segments and both sub-models, see pytorch_utils.forward_logmel. 
+            Frames near segment borders differ slightly from forwarding each 
+            segment waveform.
+          overlap: float in [0, 1), overlap ratio of adjacent segments. Each 
+            segment keeps the frames up to the middle of its overlaps. A lower 
+            overlap forwards fewer segments, e.g. 0.1 forwards about 45% fewer 
+            than 0.5, but frames near the seams see less context.
+          pedal: bool, False to transcribe notes only. The pedal sub-model of 
+            Note_pedal is neither loaded nor run, and est_pedal_events is None.
+          skip_silence: bool, default of infer. If True, segments whose audio, 
+            including the context of the STFT around them, stays below 
+            config.silence_threshold_db are not forwarded and their outputs 
+            are zeros, see silent_segments. Off by default, as a quiet but 
+            not silent passage below the threshold would lose its notes.
+          workers: int, torch backend on CPU only. With more than one, infer 
+            splits the segments across this many worker processes, each 
+            holding the model once, see sharded.ShardedForward. Call close() 
+            to stop them.
         """
+        assert backend in BACKENDS, backend
+
+        if not pedal and model_type == 'Note_pedal':
+            model_type = 'Regress_onset_offset_frame_velocity_CRNN'
+
         if not checkpoint_path:
             # checkpoint_path = os.path.join(os.getcwd(), 'piano_transcription_inference_data', 'note_F1=0.9677_pedal_F1=0.9186.pth')
             checkpoint_path = os.path.join(os.getcwd(), 'models', 'note_F13D0.9186.pth')
@@ -97,16 +170,27 @@ class PianoTranscription(object):
         # zenodo_path = 'https://zenodo.org/record/4034264/files/CRNN_note_F1%3D0.9677_pedal_F1%3D0.9186.pth?download=1'
         download_path = 'https://mirror-huggingface.nuist666.top/note_F13D0.9186.pth'
 
-        if not os.path.exists(checkpoint_path) or os.path.getsize(checkpoint_path) < 1.6e8:
+        # Missing or incomplete, e.g. an interrupted download. Fully checked 
+        # once per file, then only its size and mtime, see verify_checkpoint
+        self.checkpoint_hash = verify_checkpoint(checkpoint_path)
+        if self.checkpoint_hash is None:
             create_folder(os.path.dirname(checkpoint_path))
             if gui_callback:
                 gui_callback("正在下载模型...")
             try:
+                # Download next to the checkpoint, it only replaces the 
+                # checkpoint once complete
+                part_path = checkpoint_path + '.part'
                 download_with_progress(
-                    download_path, checkpoint_path,
-                    progress_callback=lambda d, t, p: gui_callback(
+                    download_path, part_path,
+                    progress_callback=lambda d, t, p: gui_callback and gui_callback(
                         f"下载模型: {p * 100:.1f}% ({d / 1e6:.1f}/{t / 1e6:.1f} MB)")
                 )
+                if verify_checkpoint(part_path) is None:
+                    raise RuntimeError('Downloaded checkpoint is incomplete: {}'.format(part_path))
+                os.replace(part_path, checkpoint_path)
+                os.replace(record_path(part_path), record_path(checkpoint_path))
+                self.checkpoint_hash = verify_checkpoint(checkpoint_path)
                 if gui_callback:
                     gui_callback("模型下载完成！")
             except Exception as e:
@@ -126,15 +210,46 @@ class PianoTranscription(object):
         self.offset_threshod = 0.3
         self.frame_threshold = 0.1
         self.pedal_offset_threshold = 0.2
-
-        # Build model
-        Model = eval(model_type)
-        self.model = Model(frames_per_second=self.frames_per_second,
-            classes_num=self.classes_num)
-
-        # Load model
-        checkpoint = torch.load(checkpoint_path, map_location=device)
-        self.model.load_state_dict(checkpoint['model'], strict=False)
+        self.device = device
+        self.batch_size = batch_size
+        self.cpu_fast = cpu_fast and 'cuda' not in str(device)
+        self.backend = backend
+        self.shared_logmel = shared_logmel and backend == 'torch'
+        self.overlap = overlap
+        self.model_type = model_type
+        self.checkpoint_path = checkpoint_path
+        self.skip_silence = skip_silence
+        self.silence_threshold_db = config.silence_threshold_db
+        self.skipped_fraction = 0.
+        """Fraction of segments skipped as silent by the last infer or 
+        transcribe_stream."""
+        self.lock = threading.Lock()
+        """Held while a thread drives the model, see TranscriptionService and 
+        BatchTranscriber, so that two threads never forward it at once, which 
+        would also mix the task queues of ShardedForward, or read each other's 
+        skipped_fraction."""
+        self.workers = 1
+        self.sharded = None
+
+        if backend != 'torch':
+            if self.cpu_fast and backend == 'torchscript':
+                from .pytorch_utils import configure_cpu_threads
+                configure_cpu_threads(config.intra_op_threads, config.inter_op_threads)
+
+            self.model = load_exported_model(
+                lambda: build_model(model_type, checkpoint_path, 'cpu', 
+                    self.frames_per_second, self.classes_num), 
+                checkpoint_path, model_type, segment_samples, backend, device=device, 
+                gui_callback=gui_callback)
+            print('Using {} backend.'.format(backend))
+            return
+
+        import torch
+        from .pytorch_utils import quantize_dynamic_int8, configure_cpu_threads
+
+        # Build model and load checkpoint
+        self.model = build_model(model_type, checkpoint_path, device, 
+            self.frames_per_second, self.classes_num)
 
         # Parallel
         if 'cuda' in str(device):
@@ -144,55 +259,354 @@ class PianoTranscription(object):
         else:
             print('Using CPU.')
 
-    def transcribe(self, audio, midi_path, gui_callback=None):
+        if self.cpu_fast:
+            (intra_op_threads, inter_op_threads) = configure_cpu_threads(
+                config.intra_op_threads, config.inter_op_threads)
+            self.model = quantize_dynamic_int8(self.model)
+            print('CPU fast mode: int8 GRU/Linear, {} intra-op / {} inter-op threads.'.format(
+                intra_op_threads, inter_op_threads))
+
+        if workers > 1 and 'cuda' not in str(device):
+            from .sharded import ShardedForward
+            if gui_callback:
+                gui_callback('正在启动 {} 个推理进程...'.format(workers))
+            self.sharded = ShardedForward(model_type, checkpoint_path, workers, 
+                cpu_fast=self.cpu_fast)
+            self.workers = workers
+            print('Sharded inference in {} worker processes.'.format(workers))
+
+    def close(self):
+        """Stop the worker processes of sharded inference, if any."""
+        if self.sharded is not None:
+            self.sharded.close()
+            self.sharded = None
+            self.workers = 1
+
+    def auto_batch_size(self, segments_num, memory_fraction=0.5, max_batch_size=32):
+        """Pick the largest batch size whose activations fit in memory_fraction 
+        of the available memory on self.device.
+
+        Args:
+          segments_num: int, no need for a batch larger than this
+          memory_fraction: float
+          max_batch_size: int
+
+        Returns:
+          batch_size: int
+        """
+        available = get_available_memory(self.device)
+        if not available:
+            return 1
+
+        bits = 32
+        if self.backend != 'onnxruntime':
+            import torch
+            bits = torch.finfo(next(self.model.parameters()).dtype).bits
+        bytes_per_segment = SEGMENT_MEMORY_BYTES * (self.segment_samples / (16000 * 10)) \
+            * (bits / 32)
+
+        batch_size = int(available * memory_fraction // bytes_per_segment)
+        return max(1, min(batch_size, max_batch_size, segments_num))
+
+    def forward(self, segments, batch_size, progress_callback=None):
+        """Forward segments with the model of self.backend, see 
+        pytorch_utils.forward."""
+        if self.backend == 'onnxruntime':
+            return forward_numpy(self.model, segments, batch_size, progress_callback)
+
+        from .pytorch_utils import forward
+        return forward(self.model, segments, batch_size, progress_callback)
+
+    def segment_hop_samples(self, overlap=None):
+        """Hop between adjacent segments for an overlap ratio. The overlap is 
+        rounded to an even number of frames, so that it splits in the middle.
+
+        Args:
+          overlap: None | float, None for self.overlap
+
+        Returns:
+          hop_samples: int
+        """
+        overlap = self.overlap if overlap is None else overlap
+        assert 0 <= overlap < 1, overlap
+        hop_size = config.sample_rate // self.frames_per_second
+        segment_frames = self.segment_samples // hop_size
+        overlap_frames = int(round(segment_frames * overlap / 2)) * 2
+        return (segment_frames - overlap_frames) * hop_size
+
+    def segments_num(self, audio_samples, hop_samples):
+        """Number of segments covering audio_samples, the last one padded."""
+        return int(np.ceil(max(audio_samples - self.segment_samples, 0) / hop_samples)) + 1
+
+    @traced()
+    def silent_segments(self, audio, hop_samples, context_samples=1024):
+        """Find segments that can be skipped. A segment is silent if every block 
+        of config.silence_block_samples overlapping it, or the context_samples 
+        around it, has an RMS below self.silence_threshold_db. The whole 
+        segment is checked, not just the frames it keeps after deframe, so a 
+        note starting or ringing anywhere in the overlaps keeps it.
+
+        Args:
+          audio: (audio_samples,), padded to be covered by whole segments
+          hop_samples: int
+          context_samples: int, n_fft // 2 of the STFT, as forward_logmel 
+            computes the frames at segment borders from the audio around it
+
+        Returns:
+          silent: (segments_num,) bool
+        """
+        block = config.silence_block_samples
+        blocks_num = -(-len(audio) // block)
+        power = np.zeros(blocks_num * block, dtype=np.float32)
+        power[: len(audio)] = audio
+        power = np.square(power, out=power).reshape(blocks_num, block).mean(axis=1)
+        threshold = 10. ** (self.silence_threshold_db / 10.)
+
+        segments_num = (len(audio) - self.segment_samples) // hop_samples + 1
+        bgns = np.maximum(np.arange(segments_num) * hop_samples - context_samples, 0) // block
+        fins = -(-(np.arange(segments_num) * hop_samples + self.segment_samples 
+            + context_samples) // block)
+        loud = np.concatenate(([0], np.cumsum(power >= threshold)))
+        return loud[np.minimum(fins, blocks_num)] - loud[bgns] == 0
+
+    def _forward_active(self, forward, silent, shapes=None):
+        """Run forward on the segments that are not silent and fill the outputs 
+        of the silent ones with zeros.
+
+        Args:
+          forward: callable(active_indexes) -> output_dict of those segments
+          silent: (segments_num,) bool
+          shapes: None | dict, key -> (shape, dtype) of the output of one 
+            segment. Without it at least one segment is forwarded so that the 
+            shapes are known.
+
+        Returns:
+          output_dict: {'reg_onset_output': (segments_num, segment_frames, classes_num), ...}
+          forwarded_num: int
+        """
+        active = np.nonzero(~silent)[0]
+        if len(active) == 0 and shapes is None:
+            active = np.arange(1)
+        output_dict = forward(active) if len(active) else {}
+        if len(active) == len(silent):
+            return output_dict, len(active)
+
+        shapes = shapes or {key: (value.shape[1:], value.dtype) 
+            for key, value in output_dict.items()}
+        full_dict = {}
+        for key, (shape, dtype) in shapes.items():
+            full_dict[key] = np.zeros((len(silent),) + tuple(shape), dtype=dtype)
+            if len(active):
+                full_dict[key][active] = output_dict[key]
+        return full_dict, len(active)
+
+    def transcribe(self, audio, midi_path, gui_callback=None, batch_size=None, overlap=None,
+        pitches=None, events=True, skip_silence=None):
         """Transcribe an audio recording.
 
         Args:
           audio: (audio_samples,)
           midi_path: str, path to write out the transcribed MIDI.
+          gui_callback: None | callable, progress callback of forward
+          batch_size: None | int | 'auto', overrides self.batch_size
+          overlap: None | float, overrides self.overlap
+          pitches: None | iterable of MIDI notes, only post process these 
+            pitches, e.g. utils.midi2lrcp.mappable_pitches(). None for all.
+          events: bool, False to skip building a dict per note and pedal, 
+            only the arrays are returned. MIDI is still written if midi_path.
+          skip_silence: None | bool, overrides self.skip_silence
 
         Returns:
-          transcribed_dict, dict: {'output_dict':, ..., 'est_note_events': ...}
+          transcribed_dict, dict: {'output_dict':, ..., 
+            'est_on_off_note_vels': (notes, 4), 'est_pedal_on_offs': None | (pedals, 2), 
+            'est_note_events': ..., 'est_pedal_events': ...}, the arrays are 
+            described in RegressionPostProcessor.output_dict_to_note_pedal_arrays. 
+            The events are only included if events.
+
+        """
+        output_dict = self.infer(audio, gui_callback=gui_callback, batch_size=batch_size, 
+            overlap=overlap, skip_silence=skip_silence)
+        transcribed_dict = self.post_process(output_dict, midi_path, pitches=pitches, 
+            events=events)
+        transcribed_dict['skipped_fraction'] = self.skipped_fraction
+        return transcribed_dict
+
+    @traced()
+    def infer(self, audio, gui_callback=None, batch_size=None, overlap=None, 
+        skip_silence=None):
+        """Forward an audio recording, see transcribe. skip_silence overrides 
+        self.skip_silence, the fraction of skipped segments is kept in 
+        self.skipped_fraction.
 
+        Returns:
+          output_dict: {
+            'reg_onset_output': (frames_num, classes_num), 
+            'reg_offset_output': (frames_num, classes_num), 
+            'frame_output': (frames_num, classes_num), 
+            'velocity_output': (frames_num, classes_num), 
+            ...}
         """
         audio = audio[None, :]  # (1, audio_samples)
 
-        # Pad audio to be evenly divided by segment_samples
+        # Pad audio to be covered by whole segments
         audio_len = audio.shape[1]
-        pad_len = int(np.ceil(audio_len / self.segment_samples))\
-            * self.segment_samples - audio_len
+        hop_samples = self.segment_hop_samples(overlap)
+        segments_num = self.segments_num(audio_len, hop_samples)
+        pad_len = (segments_num - 1) * hop_samples + self.segment_samples - audio_len
 
-        audio = np.concatenate((audio, np.zeros((1, pad_len))), axis=1)
-
-        # Enframe to segments
-        segments = self.enframe(audio, self.segment_samples)
-        """(N, segment_samples)"""
+        audio = np.concatenate((audio, np.zeros((1, pad_len), dtype=audio.dtype)), axis=1)
 
         # Forward
-        # output_dict = forward(self.model, segments, batch_size=1)
-        output_dict = forward(self.model, segments, batch_size=1, progress_callback=gui_callback)
+        if batch_size is None:
+            batch_size = self.batch_size
+        if batch_size == 'auto':
+            """Each worker process holds its own activations."""
+            batch_size = max(1, self.auto_batch_size(segments_num) // self.workers)
+
+        if skip_silence is None:
+            skip_silence = self.skip_silence
+        silent = np.zeros(segments_num, dtype=bool)
+        if skip_silence:
+            silent = self.silent_segments(audio[0], hop_samples)
+
+        if self.sharded is not None:
+            (output_dict, forwarded_num) = self._forward_active(lambda active: self.sharded(
+                audio[0], self.segment_samples, hop_samples, int(batch_size), 
+                segment_indexes=active, progress_callback=gui_callback, 
+                shared_logmel=self.shared_logmel), silent)
+        elif self.shared_logmel:
+            from .pytorch_utils import forward_logmel
+            (output_dict, forwarded_num) = self._forward_active(lambda active: forward_logmel(
+                self.model, audio[0], self.segment_samples, batch_size=int(batch_size), 
+                progress_callback=gui_callback, hop_samples=hop_samples, 
+                segment_indexes=active), silent)
+        else:
+            # Enframe to segments
+            segments = self.enframe(audio, self.segment_samples, hop_samples)
+            """(N, segment_samples)"""
+
+            (output_dict, forwarded_num) = self._forward_active(lambda active: self.forward(
+                segments if len(active) == segments_num else segments[active], 
+                batch_size=int(batch_size), progress_callback=gui_callback), silent)
+
+        self.skipped_fraction = 1. - forwarded_num / segments_num
+        if forwarded_num < segments_num:
+            print('Skipped {} / {} silent segments ({:.1%} of compute).'.format(
+                segments_num - forwarded_num, segments_num, self.skipped_fraction))
 
         """{'reg_onset_output': (N, segment_frames, classes_num), ...}"""
 
         # Deframe to original length
         for key in output_dict.keys():
-            output_dict[key] = self.deframe(output_dict[key])[0 : audio_len]
-        """output_dict: {
-          'reg_onset_output': (N, segment_frames, classes_num), 
-          'reg_offset_output': (N, segment_frames, classes_num), 
-          'frame_output': (N, segment_frames, classes_num), 
-          'velocity_output': (N, segment_frames, classes_num)}"""
-
-        # Post processor
+            output_dict[key] = self.deframe(output_dict[key], 
+                hop_samples * self.frames_per_second // config.sample_rate)[0 : audio_len]
+
+        return output_dict
+
+    @traced()
+    def post_process(self, output_dict, midi_path, pitches=None, events=True):
+        """Post process output_dict of infer to notes and pedals with the 
+        current thresholds, see transcribe."""
         post_processor = RegressionPostProcessor(self.frames_per_second, 
             classes_num=self.classes_num, onset_threshold=self.onset_threshold, 
             offset_threshold=self.offset_threshod, 
             frame_threshold=self.frame_threshold, 
-            pedal_offset_threshold=self.pedal_offset_threshold)
+            pedal_offset_threshold=self.pedal_offset_threshold, pitches=pitches)
+
+        # Post process output_dict to note and pedal arrays
+        (est_on_off_note_vels, est_pedal_on_offs) = \
+            post_processor.output_dict_to_note_pedal_arrays(output_dict)
 
-        # Post process output_dict to MIDI events
-        (est_note_events, est_pedal_events) = \
-            post_processor.output_dict_to_midi_events(output_dict)
+        transcribed_dict = {
+            'output_dict': output_dict, 
+            'est_on_off_note_vels': est_on_off_note_vels, 
+            'est_pedal_on_offs': est_pedal_on_offs}
+
+        return self._finish_transcription(transcribed_dict, post_processor, midi_path, events)
+
+    def precision(self):
+        """Numeric precision of the model, e.g. 'torch-float32', 
+        'torch-float32-int8' in CPU fast mode, 'onnxruntime-float32'."""
+        dtype = 'float32'
+        if self.backend != 'onnxruntime':
+            dtype = str(next(self.model.parameters()).dtype).replace('torch.', '')
+        int8 = '-int8' if self.cpu_fast and self.backend == 'torch' else ''
+        return '{}-{}{}'.format(self.backend, dtype, int8)
+
+    def cache_key(self, hop_samples, skip_silence=None):
+        """Everything besides the audio that the output_dict of infer depends 
+        on. The checkpoint is identified by its content hash."""
+        if skip_silence is None:
+            skip_silence = self.skip_silence
+        return (self.checkpoint_hash, self.model_type, self.precision(), 
+            self.segment_samples, hop_samples, self.shared_logmel, 
+            skip_silence and self.silence_threshold_db)
+
+    def transcribe_file(self, audio_path, midi_path, cache=None, gui_callback=None, 
+        batch_size=None, overlap=None, pitches=None, events=True, skip_silence=None):
+        """Decode and transcribe an audio file. With a StageCache, the decoded 
+        waveform and the output_dict of infer are cached by the content of the 
+        file, so transcribing it again, e.g. after changing thresholds, only 
+        runs post processing.
+
+        Args:
+          audio_path: str
+          cache: None | StageCache
+          others: see transcribe
+
+        Returns:
+          transcribed_dict: as transcribe, with 'timing': {'decode_seconds', 
+            'infer_seconds', 'post_seconds', 'cached': None | 'waveform' | 
+            'outputs'}, cached is the latest stage found in the cache, and 
+            'skipped_fraction', None if the outputs were cached
+        """
+        timing = {'decode_seconds': 0., 'infer_seconds': 0., 'cached': None}
+        output_dict = None
+        skipped_fraction = None
+
+        if cache is not None:
+            audio_hash = file_hash(audio_path)
+            waveform_key = ('waveform', audio_hash, config.sample_rate)
+            outputs_key = ('outputs', audio_hash) + self.cache_key(
+                self.segment_hop_samples(overlap), skip_silence=skip_silence)
+            output_dict = cache.load(outputs_key)
+            if output_dict is not None:
+                output_dict = dict(output_dict)
+                timing['cached'] = 'outputs'
+
+        if output_dict is None:
+            start_time = time.time()
+            arrays = cache.load(waveform_key) if cache is not None else None
+            if arrays is not None:
+                audio = arrays['waveform']
+                timing['cached'] = 'waveform'
+            else:
+                audio = decode_audio(audio_path, sr=config.sample_rate)
+                if cache is not None:
+                    cache.save(waveform_key, {'waveform': audio})
+            timing['decode_seconds'] = time.time() - start_time
+
+            start_time = time.time()
+            output_dict = self.infer(audio, gui_callback=gui_callback, batch_size=batch_size, 
+                overlap=overlap, skip_silence=skip_silence)
+            skipped_fraction = self.skipped_fraction
+            if cache is not None:
+                cache.save(outputs_key, output_dict)
+            timing['infer_seconds'] = time.time() - start_time
+
+        start_time = time.time()
+        transcribed_dict = self.post_process(output_dict, midi_path, pitches=pitches, 
+            events=events)
+        timing['post_seconds'] = time.time() - start_time
+        transcribed_dict['timing'] = timing
+        transcribed_dict['skipped_fraction'] = skipped_fraction
+        return transcribed_dict
+
+    def _finish_transcription(self, transcribed_dict, post_processor, midi_path, events):
+        """Reformat the arrays to MIDI events if needed, and write out MIDI."""
+        if events or midi_path:
+            (est_note_events, est_pedal_events) = post_processor.note_pedal_arrays_to_events(
+                transcribed_dict['est_on_off_note_vels'], transcribed_dict['est_pedal_on_offs'])
 
         # Write MIDI events to file
         if midi_path:
@@ -200,14 +614,189 @@ class PianoTranscription(object):
                 pedal_events=est_pedal_events, midi_path=midi_path)
             print('Write out to {}'.format(midi_path))
 
-        transcribed_dict = {
-            'output_dict': output_dict, 
-            'est_note_events': est_note_events,
-            'est_pedal_events': est_pedal_events}
+        if events:
+            transcribed_dict['est_note_events'] = est_note_events
+            transcribed_dict['est_pedal_events'] = est_pedal_events
 
         return transcribed_dict
 
-    def enframe(self, x, segment_samples):
+    def transcribe_stream(self, audio_chunks, midi_path=None, note_callback=None, 
+        gui_callback=None, batch_size=None, total_samples=None, overlap=None, pitches=None,
+        events=True, skip_silence=None):
+        """Transcribe audio that arrives in chunks, e.g. from stream_audio. 
+        Each overlapping segment is forwarded as soon as its samples are 
+        available, and notes are emitted once later audio can no longer change 
+        them. The results are the same as transcribe on the whole audio with 
+        shared_logmel=False (up to rounding of the model when segments are 
+        batched differently), while memory does not grow with the length of 
+        the recording.
+
+        Args:
+          audio_chunks: iterable of (chunk_samples,) arrays
+          midi_path: None | str, path to write out the transcribed MIDI.
+          note_callback: None | callable(est_on_off_note_vels, est_pedal_on_offs), 
+            called with newly finalized notes (notes, 4) and pedals (pedals, 2) 
+            in seconds, see RegressionPostProcessor.output_dict_to_note_pedal_arrays
+          gui_callback: None | callable, progress callback of forward. The 
+            total is only known if total_samples is given.
+          batch_size: None | int | 'auto', at most this many ready segments 
+            are forwarded at once, overrides self.batch_size
+          total_samples: None | int, length of the audio for progress
+          overlap: None | float, overrides self.overlap
+          pitches: None | iterable of MIDI notes, see transcribe
+          events: bool, see transcribe
+          skip_silence: None | bool, overrides self.skip_silence. Silent 
+            segments are found in each batch as in infer.
+
+        Returns:
+          transcribed_dict, dict: as transcribe, without 'output_dict'
+        """
+        if batch_size is None:
+            batch_size = self.batch_size
+        if batch_size == 'auto':
+            batch_size = self.auto_batch_size(segments_num=32)
+        batch_size = int(batch_size)
+
+        segment_samples = self.segment_samples
+        hop_samples = self.segment_hop_samples(overlap)
+        total_segments = None
+        if total_samples:
+            total_segments = self.segments_num(total_samples, hop_samples)
+
+        post_processor = RegressionPostProcessor(self.frames_per_second, 
+            classes_num=self.classes_num, onset_threshold=self.onset_threshold, 
+            offset_threshold=self.offset_threshod, 
+            frame_threshold=self.frame_threshold, 
+            pedal_offset_threshold=self.pedal_offset_threshold, pitches=pitches)
+
+        stitcher = SegmentStitcher(hop_samples * self.frames_per_second // config.sample_rate)
+        streaming_processor = StreamingPostProcessor(post_processor)
+        (note_arrays, pedal_arrays) = ([], [])
+        start_time = time.time()
+        if skip_silence is None:
+            skip_silence = self.skip_silence
+        counts = {'segments': 0, 'forwarded': 0, 'shapes': None}
+
+        def emit(frames_dict, final=False):
+            (notes, pedals) = streaming_processor.push(frames_dict, final=final)
+            if len(notes):
+                note_arrays.append(notes)
+            if pedals is not None and len(pedals):
+                pedal_arrays.append(pedals)
+            if note_callback and (len(notes) or (pedals is not None and len(pedals))):
+                note_callback(notes, pedals)
+
+        def run(buffer):
+            """Forward all complete segments in buffer, returns the rest."""
+            segments_num = (len(buffer) - segment_samples) // hop_samples + 1
+            if segments_num <= 0:
+                return buffer
+            silent = np.zeros(segments_num, dtype=bool)
+            if skip_silence:
+                """No context around segments, each one is forwarded on its own."""
+                silent = self.silent_segments(buffer[: (segments_num - 1) * hop_samples 
+                    + segment_samples], hop_samples, context_samples=0)
+            for pointer in range(0, segments_num, batch_size):
+                n = min(batch_size, segments_num - pointer)
+                segments = np.stack([buffer[(pointer + i) * hop_samples : 
+                    (pointer + i) * hop_samples + segment_samples] for i in range(n)])
+                (output_dict, forwarded_num) = self._forward_active(
+                    lambda active: self.forward(segments[active], batch_size=n), 
+                    silent[pointer : pointer + n], shapes=counts['shapes'])
+                counts['shapes'] = {key: (value.shape[1:], value.dtype) 
+                    for key, value in output_dict.items()}
+                counts['segments'] += n
+                counts['forwarded'] += forwarded_num
+                emit(stitcher.push(output_dict))
+
+                if gui_callback:
+                    elapsed = time.time() - start_time
+                    processed = stitcher.segments_num
+                    gui_callback(processed, total_segments or processed, elapsed, 
+                        processed / elapsed if elapsed > 0 else 0)
+            return buffer[segments_num * hop_samples :]
+
+        buffer = np.zeros(0, dtype=np.float32)
+        audio_len = 0
+        for chunk in audio_chunks:
+            audio_len += len(chunk)
+            buffer = run(np.concatenate((buffer, chunk)))
+
+        # Pad audio to be covered by whole segments, as transcribe
+        pad_len = (self.segments_num(audio_len, hop_samples) - 1) * hop_samples \
+            + segment_samples - audio_len
+        buffer = run(np.concatenate((buffer, np.zeros(pad_len, dtype=np.float32))))
+        emit(stitcher.finish(), final=True)
+        self.skipped_fraction = 1. - counts['forwarded'] / max(counts['segments'], 1)
+
+        est_on_off_note_vels = np.concatenate(note_arrays) if note_arrays else np.array([])
+        if len(est_on_off_note_vels):
+            """Same order as RegressionPostProcessor: by piano note, then onset."""
+            est_on_off_note_vels = est_on_off_note_vels[
+                np.argsort(est_on_off_note_vels[:, 2], kind='stable')]
+
+        if streaming_processor.pedal_buffers:
+            est_pedal_on_offs = np.concatenate(pedal_arrays) if pedal_arrays else np.array([])
+        else:
+            est_pedal_on_offs = None
+
+        transcribed_dict = {
+            'est_on_off_note_vels': est_on_off_note_vels, 
+            'est_pedal_on_offs': est_pedal_on_offs, 
+            'skipped_fraction': self.skipped_fraction}
+
+        return self._finish_transcription(transcribed_dict, post_processor, midi_path, events)
+
+    @traced()
+    def enframe(self, x, segment_samples, hop_samples=None):
+        """Enframe long sequence to short segments. The segments are a strided 
+        view of x, no audio is copied.
+
+        Args:
+          x: (1, audio_samples)
+          segment_samples: int
+          hop_samples: None | int, None for 50% overlap
+
+        Returns:
+          batch: (N, segment_samples), read only
+        """
+        hop_samples = hop_samples or segment_samples // 2
+        assert (x.shape[1] - segment_samples) % hop_samples == 0
+        return np.lib.stride_tricks.sliding_window_view(x[0], segment_samples)[::hop_samples]
+
+    @traced()
+    def deframe(self, x, hop_frames=None):
+        """Deframe predicted segments to original sequence. Each segment gives 
+        the frames up to the middle of its overlaps with the neighbours, 
+        written into one preallocated array.
+
+        Args:
+          x: (N, segment_frames, classes_num)
+          hop_frames: None | int, None for 50% overlap
+
+        Returns:
+          y: (audio_frames, classes_num)
+        """
+        if x.shape[0] == 1:
+            return x[0]
+
+        x = x[:, 0 : -1, :]
+        """Remove an extra frame in the end of each segment caused by the
+        'center=True' argument when calculating spectrogram."""
+        (N, segment_frames, classes_num) = x.shape
+        hop_frames = hop_frames or segment_frames // 2
+        overlap_frames = segment_frames - hop_frames
+        assert overlap_frames % 2 == 0
+        (bgn, fin) = (overlap_frames // 2, segment_frames - overlap_frames // 2)
+
+        y = np.empty(((N - 1) * hop_frames + segment_frames, classes_num), dtype=x.dtype)
+        y[0 : fin] = x[0, 0 : fin]
+        y[hop_frames + bgn : (N - 1) * hop_frames + bgn].reshape(
+            (N - 2, hop_frames, classes_num))[:] = x[1 : -1, bgn : fin]
+        y[(N - 1) * hop_frames + bgn :] = x[-1, bgn :]
+        return y
+
+    def enframe_old(self, x, segment_samples):
         """Enframe long sequence to short segments.
 
         Args:
@@ -228,7 +817,7 @@ class PianoTranscription(object):
         batch = np.concatenate(batch, axis=0)
         return batch
 
-    def deframe(self, x):
+    def deframe_old(self, x):
         """Deframe predicted segments to original sequence.
 
         Args:
@@ -207,10 +207,22 @@ class Regress_onset_offset_frame_velocity_CRNN(nn.Module):
         init_layer(self.reg_onset_fc)
         init_layer(self.frame_fc)
  
-    def forward(self, input):
+    def logmel(self, input):
         """
         Args:
           input: (batch_size, data_length)
+        Outputs:
+          x: (batch_size, 1, time_steps, mel_bins)
+        """
+        x = self.spectrogram_extractor(input)   # (batch_size, 1, time_steps, freq_bins)
+        x = self.logmel_extractor(x)    # (batch_size, 1, time_steps, mel_bins)
+        return x
+
+    def forward(self, input):
+        """
+        Args:
+          input: (batch_size, data_length), or the log mel of it
+            (batch_size, 1, time_steps, mel_bins) from self.logmel
         Outputs:
           output_dict: dict, {
             'reg_onset_output': (batch_size, time_steps, classes_num),
@@ -220,8 +232,7 @@ class Regress_onset_offset_frame_velocity_CRNN(nn.Module):
           }
         """
 
-        x = self.spectrogram_extractor(input)   # (batch_size, 1, time_steps, freq_bins)
-        x = self.logmel_extractor(x)    # (batch_size, 1, time_steps, mel_bins)
+        x = self.logmel(input) if input.dim() == 2 else input
 
         x = x.transpose(1, 3)
         x = self.bn0(x)
@@ -297,10 +308,16 @@ class Regress_pedal_CRNN(nn.Module):
     def init_weight(self):
         init_bn(self.bn0)
         
+    def logmel(self, input):
+        x = self.spectrogram_extractor(input)   # (batch_size, 1, time_steps, freq_bins)
+        x = self.logmel_extractor(x)    # (batch_size, 1, time_steps, mel_bins)
+        return x
+
     def forward(self, input):
         """
         Args:
-          input: (batch_size, data_length)
+          input: (batch_size, data_length), or the log mel of it
+            (batch_size, 1, time_steps, mel_bins) from self.logmel
         Outputs:
           output_dict: dict, {
             'reg_onset_output': (batch_size, time_steps, classes_num),
@@ -310,8 +327,7 @@ class Regress_pedal_CRNN(nn.Module):
           }
         """
 
-        x = self.spectrogram_extractor(input)   # (batch_size, 1, time_steps, freq_bins)
-        x = self.logmel_extractor(x)    # (batch_size, 1, time_steps, mel_bins)
+        x = self.logmel(input) if input.dim() == 2 else input
 
         x = x.transpose(1, 3)
         x = self.bn0(x)
@@ -339,11 +355,20 @@ class Note_pedal(nn.Module):
         self.note_model = Regress_onset_offset_frame_velocity_CRNN(frames_per_second, classes_num)
         self.pedal_model = Regress_pedal_CRNN(frames_per_second, classes_num)
 
-    def load_state_dict(self, m, strict=False):
-        self.note_model.load_state_dict(m['note_model'], strict=strict)
-        self.pedal_model.load_state_dict(m['pedal_model'], strict=strict)
+    def load_state_dict(self, m, strict=False, **kwargs):
+        self.note_model.load_state_dict(m['note_model'], strict=strict, **kwargs)
+        self.pedal_model.load_state_dict(m['pedal_model'], strict=strict, **kwargs)
+
+    def logmel(self, input):
+        """The note and pedal models extract the same log mel."""
+        return self.note_model.logmel(input)
 
     def forward(self, input):
+        """input: waveform or log mel, see Regress_onset_offset_frame_velocity_CRNN.
+        The log mel is computed once for both models."""
+        if input.dim() == 2:
+            input = self.logmel(input)
+
         note_output_dict = self.note_model(input)
         pedal_output_dict = self.pedal_model(input)
 
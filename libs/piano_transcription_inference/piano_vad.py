@@ -1,4 +1,5 @@
 import numpy as np
+from bisect import bisect_right
 
 
 def note_detection_with_onset_offset_regress(frame_output, onset_output, 
@@ -127,4 +128,235 @@ def pedal_detection_with_onset_offset_regress(frame_output, offset_output,
     # Sort pairs by onsets
     output_tuples.sort(key=lambda pair: pair[0])
 
-    return output_tuples
\ No newline at end of file
+    return output_tuples
+
+
+def _first_after(idxes, i):
+    """First value in sorted list idxes that is larger than i, or None."""
+    k = bisect_right(idxes, i)
+    return idxes[k] if k < len(idxes) else None
+
+
+def _run_starts(mask, axis=0):
+    """Mark the first frame of every run of True values along axis."""
+    starts = mask.copy()
+    if axis == 0:
+        starts[1:] &= ~mask[:-1]
+    else:
+        starts[:, 1:] &= ~mask[:, :-1]
+    return starts
+
+
+def _note_events_sparse(onsets, disappear_mask, disappear_starts, offsets, frames_num, 
+    after=0, mask_offset=0):
+    """Run the state machine of note_detection_with_onset_offset_regress only 
+    over sparse events instead of every frame.
+
+    Args:
+      onsets: sorted list, frames with onset_output == 1
+      disappear_mask: (frames_num - mask_offset,), frame_output <= frame_threshold
+      disappear_starts: sorted list, first frames of runs in disappear_mask. 
+        The first disappear frame after bgn is bgn + 1 or one of them.
+      offsets: sorted list, frames with offset_output == 1
+      frames_num: int
+      after: int, no note is active at this frame, only later onsets are 
+        searched. Used to resume detection on a stream.
+      mask_offset: int, frame index of disappear_mask[0]
+
+    Returns:
+      events: list of (bgn, fin, consecutive, close), consecutive is True if the 
+        note is closed by the next onset (offset shift is then 0). Resuming 
+        with after=close gives the same following events.
+    """
+    events = []
+    last = frames_num - 1
+
+    # An onset at frame 0 is never searched by the reference (bgn = 0 is falsy)
+    k = bisect_right(onsets, max(after, 0))
+
+    while k < len(onsets):
+        bgn = onsets[k]
+        next_onset = onsets[k + 1] if k + 1 < len(onsets) else None
+        if bgn + 1 < frames_num and disappear_mask[bgn + 1 - mask_offset]:
+            frame_disappear = bgn + 1
+        else:
+            frame_disappear = _first_after(disappear_starts, bgn)
+        timeout = min(bgn + 600, last)
+
+        if bgn == last:
+            """Onset at the last frame is never closed."""
+            break
+
+        # Close frame if no new onset comes first
+        if frame_disappear is not None and frame_disappear <= timeout:
+            close = frame_disappear
+        else:
+            close = timeout
+
+        if next_onset is not None and next_onset <= close:
+            """Consecutive onsets. E.g., pedal is not released, but two 
+            consecutive notes being played."""
+            events.append((bgn, max(next_onset - 1, 0), True, next_onset - 1))
+            k += 1
+            continue
+
+        if close == frame_disappear:
+            offset_occur = _first_after(offsets, bgn)
+            if offset_occur is not None and offset_occur <= frame_disappear and \
+                offset_occur - bgn > frame_disappear - offset_occur:
+                """bgn --------- offset_occur --- frame_disappear"""
+                fin = offset_occur
+            else:
+                """bgn --- offset_occur --------- frame_disappear"""
+                fin = frame_disappear
+        else:
+            """Offset not detected"""
+            fin = close
+        events.append((bgn, fin, False, close))
+
+        # The next note starts from the first onset after the close frame
+        k = bisect_right(onsets, close, lo=k + 1)
+
+    return events
+
+
+def note_detection_with_onset_offset_regress_fast(frame_output, onset_output, 
+    onset_shift_output, offset_output, offset_shift_output, velocity_output,
+    frame_threshold):
+    """Same as note_detection_with_onset_offset_regress, but candidate onset, 
+    offset and frame-disappear indexes are found with NumPy and the state 
+    machine only visits those events.
+
+    Args and Returns: see note_detection_with_onset_offset_regress.
+    """
+    disappear_mask = frame_output <= frame_threshold
+    events = _note_events_sparse(
+        onsets=np.flatnonzero(onset_output == 1).tolist(), 
+        disappear_mask=disappear_mask, 
+        disappear_starts=np.flatnonzero(_run_starts(disappear_mask)).tolist(), 
+        offsets=np.flatnonzero(offset_output == 1).tolist(), 
+        frames_num=onset_output.shape[0])
+
+    return [[bgn, fin, onset_shift_output[bgn], 0 if consecutive else offset_shift_output[fin], 
+        velocity_output[bgn]] for (bgn, fin, consecutive, _) in events]
+
+
+def _split_by_class(class_idxes, frame_idxes, classes_num):
+    """Split nonzero indexes of a (classes_num, frames_num) array to per class 
+    sorted lists."""
+    bounds = np.searchsorted(class_idxes, np.arange(classes_num + 1))
+    frame_idxes = frame_idxes.tolist()
+    return [frame_idxes[bounds[k] : bounds[k + 1]] for k in range(classes_num)]
+
+
+def notes_detection_with_onset_offset_regress_fast(frame_output, onset_output, 
+    onset_shift_output, offset_output, offset_shift_output, velocity_output,
+    frame_threshold):
+    """Detect notes of all classes at once. Candidate events of every class are 
+    found with one NumPy pass over the (frames_num, classes_num) matrices.
+
+    Args:
+      frame_output: (frames_num, classes_num)
+      onset_output: (frames_num, classes_num)
+      onset_shift_output: (frames_num, classes_num)
+      offset_output: (frames_num, classes_num)
+      offset_shift_output: (frames_num, classes_num)
+      velocity_output: (frames_num, classes_num)
+      frame_threshold: float
+
+    Returns:
+      output_tuples_per_class: list (classes_num) of output_tuples, see 
+        note_detection_with_onset_offset_regress.
+    """
+    (frames_num, classes_num) = frame_output.shape
+    disappear_mask = (frame_output <= frame_threshold).T
+    onsets = _split_by_class(*np.nonzero(onset_output.T == 1), classes_num)
+    disappear_starts = _split_by_class(*np.nonzero(_run_starts(disappear_mask, axis=1)), classes_num)
+    offsets = _split_by_class(*np.nonzero(offset_output.T == 1), classes_num)
+
+    output_tuples_per_class = []
+    for k in range(classes_num):
+        events = _note_events_sparse(onsets[k], disappear_mask[k], disappear_starts[k], 
+            offsets[k], frames_num)
+        output_tuples_per_class.append([[bgn, fin, onset_shift_output[bgn, k], 
+            0 if consecutive else offset_shift_output[fin, k], velocity_output[bgn, k]] 
+            for (bgn, fin, consecutive, _) in events])
+
+    return output_tuples_per_class
+
+
+def _pedal_events_sparse(onsets, disappear_mask, disappear_starts, offsets, frames_num, 
+    after=0, mask_offset=0, held=None):
+    """Run the state machine of pedal_detection_with_onset_offset_regress only 
+    over sparse events. Args are the same as _note_events_sparse, and
+
+      held: None | (bgn, frame_disappear), pending of the previous call that 
+        searched up to frame after. The frames of this pedal before after 
+        are not needed, so a stream need not keep them while it is held.
+
+    Returns:
+      events: list of (bgn, fin, close)
+      pending: None | (bgn, frame_disappear), the pedal not released before 
+        the end, frame_disappear is None if its frames have not disappeared
+    """
+    events = []
+    k = bisect_right(onsets, after)
+
+    while held is not None or k < len(onsets):
+        if held is not None:
+            """No offset was found up to after, and neither was a disappear 
+            frame if it is None. Frame after is held, so a disappear run 
+            after it starts after it."""
+            (bgn, frame_disappear) = held
+            held = None
+            offset_occur = _first_after(offsets, after)
+            if frame_disappear is None:
+                frame_disappear = _first_after(disappear_starts, after)
+        else:
+            bgn = onsets[k]
+            offset_occur = _first_after(offsets, bgn)
+            if bgn + 1 < frames_num and disappear_mask[bgn + 1 - mask_offset]:
+                frame_disappear = bgn + 1
+            else:
+                frame_disappear = _first_after(disappear_starts, bgn)
+
+        if offset_occur is not None and (frame_disappear is None or offset_occur <= frame_disappear + 10):
+            fin = close = offset_occur
+        elif frame_disappear is not None and frame_disappear + 10 < frames_num:
+            """offset not detected but frame disappear"""
+            fin = frame_disappear
+            close = frame_disappear + 10
+        else:
+            """Pedal is not released before the end"""
+            return events, (bgn, frame_disappear)
+
+        events.append((bgn, fin, close))
+        k = bisect_right(onsets, close, lo=k)
+
+    return events, None
+
+
+def pedal_onset_mask(frame_output, frame_threshold):
+    """Frames where pedal_detection_with_onset_offset_regress detects a pedal 
+    onset candidate. Frame 0 is never a candidate."""
+    onset_mask = np.zeros(frame_output.shape[0], dtype=bool)
+    onset_mask[1:] = (frame_output[1:] >= frame_threshold) & (frame_output[1:] > frame_output[:-1])
+    return onset_mask
+
+
+def pedal_detection_with_onset_offset_regress_fast(frame_output, offset_output, 
+    offset_shift_output, frame_threshold):
+    """Same as pedal_detection_with_onset_offset_regress, but only visits 
+    candidate pedal onsets, offsets and frame disappears found with NumPy.
+
+    Args and Returns: see pedal_detection_with_onset_offset_regress.
+    """
+    disappear_mask = frame_output <= frame_threshold
+    (events, _) = _pedal_events_sparse(
+        onsets=np.flatnonzero(pedal_onset_mask(frame_output, frame_threshold)).tolist(), 
+        disappear_mask=disappear_mask, 
+        disappear_starts=np.flatnonzero(_run_starts(disappear_mask)).tolist(), 
+        offsets=np.flatnonzero(offset_output == 1).tolist(), 
+        frames_num=frame_output.shape[0])
+
+    return [[bgn, fin, 0., offset_shift_output[fin]] for (bgn, fin, _) in events]
@@ -0,0 +1,232 @@
+import os
+import json
+import time
+import threading
+import functools
+
+
+"""The Profiler recording spans, None when profiling is off. span() and
+traced functions only check this while it is None."""
+_active = None
+
+
+class _Span(object):
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.depth = self.profiler._enter()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        self.profiler._exit()
+        self.profiler.record(self.name, self.start, end, self.depth, self.args)
+        return False
+
+
+class _NoSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name, **args):
+    """Context manager timing a stage as a span of the active Profiler, does
+    nothing if none is active, e.g.
+
+        with span('deframe'):
+            ...
+    """
+    if _active is None:
+        return _NO_SPAN
+    return _Span(_active, name, args)
+
+
+def traced(name=None):
+    """Decorator timing each call of a function as a span named name, or the
+    qualified name of the function."""
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _active is None:
+                return func(*args, **kwargs)
+            with _Span(_active, span_name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class Profiler(object):
+    def __init__(self, model=None, module_depth=3, cuda_sync=False):
+        """Record hierarchical timing spans of the transcription pipeline, e.g.
+        decode_audio, enframe, forward, deframe, post processing and MIDI
+        writing, while active:
+
+            with Profiler(transcriptor.model) as profiler:
+                transcriptor.transcribe_file(audio_path, midi_path)
+            profiler.save('trace.json')
+
+        Spans of all threads are recorded, so jobs of TranscriptionService and
+        the stages of BatchTranscriber are included, but not the worker
+        processes of sharded inference. Only one Profiler can be active at a
+        time.
+
+        Args:
+          model: None | nn.Module, e.g. Note_pedal. Forward hooks time each
+            sub-module down to module_depth, e.g. note_model.frame_model.gru
+          module_depth: int
+          cuda_sync: bool, synchronize CUDA around each hooked module, so that
+            spans measure the GPU work instead of the kernel launches
+        """
+        self.model = model
+        self.module_depth = module_depth
+        self.cuda_sync = cuda_sync
+        self.spans = []
+        self._local = threading.local()
+        self._hooks = []
+        self._origin = time.perf_counter()
+
+    def start(self):
+        global _active
+        if _active is not None:
+            raise RuntimeError('Another Profiler is active')
+        self._origin = time.perf_counter()
+        # Depths and module stacks left by an earlier run are not carried over
+        self._local = threading.local()
+        if self.model is not None:
+            self.attach(self.model)
+        _active = self
+        return self
+
+    def stop(self):
+        global _active
+        if _active is self:
+            _active = None
+        self.detach()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def _enter(self):
+        depth = getattr(self._local, 'depth', 0)
+        self._local.depth = depth + 1
+        return depth
+
+    def _exit(self):
+        self._local.depth -= 1
+
+    def record(self, name, start, end, depth, args=None):
+        self.spans.append({'name': name, 'start': start - self._origin,
+            'duration': end - start, 'depth': depth, 'thread': threading.get_ident(),
+            'args': args or {}})
+
+    def attach(self, model):
+        """Time the forward of each sub-module of model with hooks. Models of
+        exported backends have no sub-modules and are skipped."""
+        named_modules = getattr(model, 'named_modules', None)
+        if named_modules is None:
+            return
+
+        sync = None
+        if self.cuda_sync:
+            import torch
+            if torch.cuda.is_available():
+                sync = torch.cuda.synchronize
+
+        for name, module in named_modules():
+            if not name or name.count('.') >= self.module_depth:
+                continue
+
+            def pre_hook(module, input, name=name):
+                if sync:
+                    sync()
+                stack = self._local.__dict__.setdefault('modules', [])
+                stack.append((name, self._enter(), time.perf_counter()))
+
+            def hook(module, input, output):
+                if sync:
+                    sync()
+                end = time.perf_counter()
+                (name, depth, start) = self._local.modules.pop()
+                self._exit()
+                self.record(name, start, end, depth, {'module': type(module).__name__})
+
+            self._hooks.append(module.register_forward_pre_hook(pre_hook))
+            try:
+                # Also called if forward raises, e.g. out of memory, so that the 
+                # stack and depth of the pre hook are popped
+                self._hooks.append(module.register_forward_hook(hook, always_call=True))
+            except TypeError:
+                # PyTorch before 2.0
+                self._hooks.append(module.register_forward_hook(hook))
+
+    def detach(self):
+        for handle in self._hooks:
+            handle.remove()
+        self._hooks = []
+
+    def summary(self):
+        """Total time per span name, most first.
+
+        Returns:
+          list of {'name', 'calls', 'total_seconds', 'mean_seconds', 'depth'},
+            depth is the smallest depth the span was seen at
+        """
+        totals = {}
+        for s in self.spans:
+            entry = totals.setdefault(s['name'], {'name': s['name'], 'calls': 0,
+                'total_seconds': 0., 'depth': s['depth']})
+            entry['calls'] += 1
+            entry['total_seconds'] += s['duration']
+            entry['depth'] = min(entry['depth'], s['depth'])
+        for entry in totals.values():
+            entry['mean_seconds'] = entry['total_seconds'] / entry['calls']
+        return sorted(totals.values(), key=lambda entry: -entry['total_seconds'])
+
+    def chrome_trace(self):
+        """Spans as Chrome trace events, open in chrome://tracing or Perfetto."""
+        pid = os.getpid()
+        events = [{'name': s['name'], 'ph': 'X', 'ts': s['start'] * 1e6,
+            'dur': s['duration'] * 1e6, 'pid': pid, 'tid': s['thread'], 'args': s['args']}
+            for s in self.spans]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save(self, path, format='chrome'):
+        """Write the spans to path.
+
+        Args:
+          path: str
+          format: 'chrome' | 'json'. 'json' writes {'spans': [...], 'summary': [...]}
+        """
+        if format == 'chrome':
+            data = self.chrome_trace()
+        elif format == 'json':
+            data = {'spans': self.spans, 'summary': self.summary()}
+        else:
+            raise ValueError('Unknown profile format: {}'.format(format))
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+
+    def format_summary(self, top=30):
+        """Summary as a text table, indented by depth."""
+        lines = ['{:<64}{:>8}{:>12}{:>12}'.format('span', 'calls', 'total s', 'mean ms')]
+        for entry in self.summary()[: top]:
+            lines.append('{:<64}{:>8}{:>12.3f}{:>12.2f}'.format(
+                ('  ' * entry['depth'] + entry['name'])[: 63], entry['calls'],
+                entry['total_seconds'], entry['mean_seconds'] * 1e3))
+        return '\n'.join(lines)
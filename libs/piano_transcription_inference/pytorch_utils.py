@@ -3,6 +3,8 @@ import time
 import numpy as np
 from tqdm import tqdm
 
+from .profiling import traced, span
+
 
 def move_data_to_device(x, device):
     if 'float' in str(x.dtype):
@@ -99,42 +101,177 @@ def forward_old(model, x, batch_size, progress_callback=None):
     return output_dict
 
 
+@traced()
 def forward(model, x, batch_size, progress_callback=None):
+    """Forward data to model in mini-batch. Outputs are written into 
+    preallocated arrays instead of being concatenated at the end.
+
+    Args:
+      model: object
+      x: (N, segment_samples)
+      batch_size: int
+      progress_callback: None | callable(processed_segments, total_segments, 
+        elapsed_seconds, segments_per_second)
+
+    Returns:
+      output_dict: dict, e.g. {
+        'frame_output': (segments_num, frames_num, classes_num),
+        'onset_output': (segments_num, frames_num, classes_num),
+        ...}
+    """
     output_dict = {}
     device = next(model.parameters()).device
     param_dtype = next(model.parameters()).dtype
 
     pointer = 0
-    total_segments = int(np.ceil(len(x) / batch_size))
+    total_segments = len(x)
 
     start_time = time.time()
-    processed_segments = 0
 
     with torch.no_grad():
         model.eval()
-        with tqdm(total=total_segments, desc="Processing", unit="seg", disable=True) as pbar:
-            while pointer < len(x):
-                # 转换为 Tensor 并匹配 dtype
-                batch_waveform = torch.tensor(x[pointer: pointer + batch_size], dtype=param_dtype).to(device)
-
-                pointer += batch_size
+        while pointer < total_segments:
+            # 转换为 Tensor 并匹配 dtype
+            batch_waveform = torch.tensor(x[pointer: pointer + batch_size], dtype=param_dtype).to(device)
+            with span('model', batch_size=len(batch_waveform)):
                 batch_output_dict = model(batch_waveform)
 
-                for key in batch_output_dict.keys():
-                    if key not in output_dict:
-                        output_dict[key] = []
-                    output_dict[key].append(batch_output_dict[key].cpu().numpy())
+            for key in batch_output_dict.keys():
+                value = batch_output_dict[key].cpu().numpy()
+                if key not in output_dict:
+                    output_dict[key] = np.empty((total_segments,) + value.shape[1:], dtype=value.dtype)
+                output_dict[key][pointer: pointer + len(value)] = value
 
-                pbar.update(1)
-                processed_segments += 1
+            pointer = min(pointer + batch_size, total_segments)
 
-                if progress_callback:
-                    current_time = time.time()
-                    elapsed = current_time - start_time
-                    rate = processed_segments / elapsed if elapsed > 0 else 0
-                    progress_callback(pointer, total_segments, elapsed, rate)
+            if progress_callback:
+                elapsed = time.time() - start_time
+                rate = pointer / elapsed if elapsed > 0 else 0
+                progress_callback(pointer, total_segments, elapsed, rate)
+
+    return output_dict
 
-    for key in output_dict.keys():
-        output_dict[key] = np.concatenate(output_dict[key], axis=0)
+
+@traced()
+def forward_logmel(model, audio, segment_samples, batch_size, progress_callback=None,
+    hop_samples=None, segment_indexes=None):
+    """Forward overlapping segments of audio to model in mini-batch, like
+    forward on PianoTranscription.enframe(audio). The log mel of the whole
+    recording is computed once, frame by frame as the batches need it, and
+    the log mel of each segment is sliced from it, instead of computing it
+    for every segment and every sub-model.
+
+    Each frame is computed with its whole window of real audio, so the first
+    and last few frames of a segment differ slightly from forward, where the
+    STFT pads each segment by reflection. Only the ends of the recording are
+    padded by reflection here.
+
+    Args:
+      model: Note_pedal | Regress_onset_offset_frame_velocity_CRNN |
+        Regress_pedal_CRNN, may be wrapped in DataParallel
+      audio: (audio_samples,), padded to be covered by whole segments
+      segment_samples: int
+      batch_size: int
+      progress_callback: None | callable, see forward
+      hop_samples: None | int, hop between segments, None for 50% overlap
+      segment_indexes: None | sorted (n,) int array, only forward these 
+        segments, e.g. those that are not silent. None for all. Only 
+        consecutive segments are batched together, so no log mel is computed 
+        for the audio between them.
+
+    Returns:
+      output_dict: dict, as forward, in the order of segment_indexes
+    """
+    module = getattr(model, 'module', model)
+    stft = getattr(module, 'note_model', module).spectrogram_extractor.stft
+    device = next(model.parameters()).device
+    param_dtype = next(model.parameters()).dtype
+
+    hop_size = stft.hop_length
+    hop_samples = hop_samples or segment_samples // 2
+    assert (len(audio) - segment_samples) % hop_samples == 0 and hop_samples % hop_size == 0
+    segment_frames = segment_samples // hop_size + 1
+    hop_frames = hop_samples // hop_size
+    if segment_indexes is None:
+        segment_indexes = np.arange((len(audio) - segment_samples) // hop_samples + 1)
+    total_segments = len(segment_indexes)
+
+    """Frames computed from a chunk of audio are exact after 'context' frames
+    from both ends of the chunk. The padding of the recording is the same as
+    'center=True' of the STFT."""
+    context = -(-(stft.n_fft // 2) // hop_size)
+    pad = context * hop_size
+    audio = np.pad(audio, pad, mode='reflect')
+
+    output_dict = {}
+    (features, features_bgn) = (None, 0)
+    pointer = 0
+    start_time = time.time()
+
+    with torch.no_grad():
+        model.eval()
+        while pointer < total_segments:
+            indexes = segment_indexes[pointer : pointer + batch_size]
+            gaps = np.nonzero(np.diff(indexes) != 1)[0]
+            n = int(gaps[0]) + 1 if len(gaps) else len(indexes)
+            first = int(indexes[0])
+            (bgn, fin) = (first * hop_frames, (first + n - 1) * hop_frames + segment_frames)
+
+            # Drop frames before this batch and compute the missing ones
+            if features is not None:
+                features = features[:, :, bgn - features_bgn :]
+            computed = features.shape[2] if features is not None else 0
+            new_bgn = bgn + computed
+            chunk = torch.tensor(audio[None, new_bgn * hop_size : (fin - 1) * hop_size + 2 * pad],
+                dtype=param_dtype).to(device)
+            with span('logmel'):
+                new_features = module.logmel(chunk)[:, :, context : context + fin - new_bgn]
+            features = new_features if features is None else torch.cat((features, new_features), dim=2)
+            features_bgn = bgn
+
+            batch_logmel = torch.cat([features[:, :, i * hop_frames : i * hop_frames + segment_frames]
+                for i in range(n)], dim=0)
+            with span('model', batch_size=n):
+                batch_output_dict = model(batch_logmel)
+
+            for key in batch_output_dict.keys():
+                value = batch_output_dict[key].cpu().numpy()
+                if key not in output_dict:
+                    output_dict[key] = np.empty((total_segments,) + value.shape[1:], dtype=value.dtype)
+                output_dict[key][pointer: pointer + len(value)] = value
+
+            pointer += n
+
+            if progress_callback:
+                elapsed = time.time() - start_time
+                rate = pointer / elapsed if elapsed > 0 else 0
+                progress_callback(pointer, total_segments, elapsed, rate)
 
     return output_dict
+
+
+def quantize_dynamic_int8(model):
+    """Dynamic int8 quantization of GRU and Linear layers for CPU inference. 
+    Weights are stored in int8, activations are quantized on the fly. 
+    Convolutions and batch norms stay in fp32."""
+    import warnings
+
+    with warnings.catch_warnings():
+        # Eager mode quantization is deprecated in favour of torchao, but 
+        # still works and needs no extra dependency.
+        warnings.simplefilter('ignore')
+        return torch.ao.quantization.quantize_dynamic(model.cpu().eval(), 
+            {torch.nn.GRU, torch.nn.Linear}, dtype=torch.qint8)
+
+
+def configure_cpu_threads(intra_op_threads=None, inter_op_threads=None):
+    """Set torch CPU thread counts, None keeps the default. The inter-op 
+    thread count can only be set before any parallel work has started."""
+    if intra_op_threads:
+        torch.set_num_threads(int(intra_op_threads))
+    if inter_op_threads:
+        try:
+            torch.set_num_interop_threads(int(inter_op_threads))
+        except RuntimeError:
+            pass
+    return torch.get_num_threads(), torch.get_num_interop_threads()
@@ -0,0 +1,250 @@
+import time
+import queue
+import threading
+import traceback
+
+from .inference import PianoTranscription
+from . import config
+
+
+class TranscriptionJob(object):
+    def __init__(self, audio_path, midi_path, device, model_type, dtype, batch_size,
+        stream, progress_callback, status_callback, backend='torch', overlap=None,
+        pedal=True, pitches=None, cache=None, workers=1, skip_silence=None):
+        """A transcription job submitted to TranscriptionService. Wait for it
+        with result(). Timing in seconds is filled in as the job runs:
+
+          wait_seconds: time in the queue
+          load_seconds: model loading, 0 if the model was already loaded
+          decode_seconds: audio decoding, included in infer_seconds if streamed
+          infer_seconds: forward and post processing
+          cached: None | 'waveform' | 'outputs', stage found in the cache
+          skipped_fraction: fraction of segments skipped as silent, None if
+            the outputs were cached
+          total_seconds: from submit to done
+        """
+        self.audio_path = audio_path
+        self.midi_path = midi_path
+        self.device = device
+        self.model_type = model_type
+        self.dtype = dtype
+        self.backend = backend
+        self.batch_size = batch_size
+        self.stream = stream
+        self.overlap = overlap
+        self.pedal = pedal
+        self.pitches = pitches
+        self.cache = cache
+        self.workers = workers
+        self.skip_silence = skip_silence
+        self.progress_callback = progress_callback
+        self.status_callback = status_callback
+
+        self.submit_time = time.time()
+        self.wait_seconds = None
+        self.load_seconds = None
+        self.decode_seconds = None
+        self.infer_seconds = None
+        self.total_seconds = None
+        self.cached = None
+        self.skipped_fraction = None
+
+        self.transcribed_dict = None
+        self.error = None
+        self.traceback = None
+        self._done = threading.Event()
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """Block until the job is done, returns transcribed_dict or raises the
+        error of the job."""
+        if not self._done.wait(timeout):
+            raise TimeoutError('Transcription of {} is not done'.format(self.audio_path))
+        if self.error is not None:
+            raise self.error
+        return self.transcribed_dict
+
+    def timing(self):
+        return {'wait_seconds': self.wait_seconds, 'load_seconds': self.load_seconds,
+            'decode_seconds': self.decode_seconds, 'infer_seconds': self.infer_seconds,
+            'total_seconds': self.total_seconds, 'cached': self.cached,
+            'skipped_fraction': self.skipped_fraction}
+
+
+class TranscriptionService(object):
+    def __init__(self):
+        """Keep loaded PianoTranscription models resident, one per (device,
+        model_type, dtype, backend, workers), and run submitted jobs one by one in a worker
+        thread. Only the first job of each key pays for checkpoint checking,
+        model building and torch.load."""
+        self._models = {}
+        self._models_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._running = None
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    def get_model(self, device='cpu', model_type='Note_pedal', dtype='float32',
+        status_callback=None, backend='torch', pedal=True, workers=1):
+        """Return the cached PianoTranscription of (device, model_type, dtype,
+        backend, workers), load it on first use. pedal=False loads the note 
+        model only. workers > 1 starts sharded inference processes.
+
+        Returns:
+          (transcriptor, load_seconds), load_seconds is 0 if cached
+        """
+        if not pedal and model_type == 'Note_pedal':
+            model_type = 'Regress_onset_offset_frame_velocity_CRNN'
+        key = (str(device), model_type, str(dtype), backend, int(workers))
+        with self._models_lock:
+            if key in self._models:
+                return self._models[key], 0.
+
+            start_time = time.time()
+            transcriptor = PianoTranscription(model_type=model_type, device=device,
+                gui_callback=status_callback, cpu_fast=(str(dtype) == 'int8'), backend=backend,
+                workers=int(workers))
+            if str(dtype) not in ('float32', 'int8') and backend == 'torch':
+                import torch
+                transcriptor.model.to(getattr(torch, str(dtype)))
+            self._models[key] = transcriptor
+            return transcriptor, time.time() - start_time
+
+    def loaded_models(self):
+        with self._models_lock:
+            return list(self._models.keys())
+
+    def unload(self, device=None):
+        """Release cached models, all of them or those on device."""
+        with self._models_lock:
+            for key in list(self._models.keys()):
+                if device is None or key[0] == str(device):
+                    self._models.pop(key).close()
+
+    def _evict(self, transcriptor):
+        with self._models_lock:
+            for key in [key for key, value in self._models.items() if value is transcriptor]:
+                self._models.pop(key)
+        transcriptor.close()
+
+    def queue_depth(self):
+        """Number of jobs waiting or running."""
+        return self._queue.qsize() + (1 if self._running is not None else 0)
+
+    def submit(self, audio_path, midi_path, device='cpu', model_type='Note_pedal',
+        dtype='float32', batch_size='auto', stream=False, progress_callback=None,
+        status_callback=None, backend='torch', overlap=None, pedal=True, pitches=None,
+        cache=None, workers=1, skip_silence=None):
+        """Queue a transcription job.
+
+        Args:
+          audio_path: str
+          midi_path: str, path to write out the transcribed MIDI
+          device: 'cuda' | 'cpu'
+          model_type: str
+          dtype: 'float32' | 'float16' | 'bfloat16' | 'int8', 'int8' is the CPU 
+            fast mode of PianoTranscription. Only float32 for exported backends.
+          batch_size: int | 'auto'
+          stream: bool, use PianoTranscription.transcribe_stream
+          backend: 'torch' | 'torchscript' | 'onnxruntime'
+          overlap: None | float, overlap ratio of segments, None for the 
+            default of PianoTranscription
+          pedal: bool, False to skip the pedal sub-model
+          pitches: None | iterable of MIDI notes, only post process these
+          cache: None | StageCache, reuse the decoded waveform and model outputs
+            of the same audio file, not used if stream
+          workers: int, CPU worker processes of sharded inference, not used if
+            stream
+          skip_silence: None | bool, skip silent segments, None for the 
+            default of PianoTranscription
+          progress_callback: None | callable, progress callback of forward
+          status_callback: None | callable(str), status messages
+
+        Returns:
+          job: TranscriptionJob
+        """
+        job = TranscriptionJob(audio_path, midi_path, device, model_type, dtype,
+            batch_size, stream, progress_callback, status_callback, backend=backend, 
+            overlap=overlap, pedal=pedal, pitches=pitches, cache=cache,
+            workers=workers, skip_silence=skip_silence)
+        self._queue.put(job)
+        self._ensure_worker()
+        return job
+
+    def _ensure_worker(self):
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._work, daemon=True)
+                self._worker.start()
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            self._running = job
+            try:
+                self._run(job)
+            except Exception as e:
+                job.traceback = traceback.format_exc()
+                job.error = e
+            finally:
+                job.total_seconds = time.time() - job.submit_time
+                self._running = None
+                job._done.set()
+                self._queue.task_done()
+
+    def _run(self, job):
+        job.wait_seconds = time.time() - job.submit_time
+        (transcriptor, job.load_seconds) = self.get_model(job.device, job.model_type,
+            job.dtype, status_callback=job.status_callback, backend=job.backend, 
+            pedal=job.pedal, workers=job.workers)
+
+        with transcriptor.lock:
+            try:
+                self._transcribe(job, transcriptor)
+            except Exception:
+                if transcriptor.sharded is not None and not transcriptor.sharded.is_alive():
+                    # The sharded workers died and could not be restarted, 
+                    # load the model again for the next job
+                    self._evict(transcriptor)
+                raise
+
+    def _transcribe(self, job, transcriptor):
+        import librosa
+        from .streaming import stream_audio
+
+        if job.stream:
+            job.decode_seconds = 0.
+            total_samples = int(librosa.get_duration(path=job.audio_path) * config.sample_rate)
+            start_time = time.time()
+            job.transcribed_dict = transcriptor.transcribe_stream(
+                stream_audio(job.audio_path, sr=config.sample_rate), job.midi_path,
+                gui_callback=job.progress_callback, batch_size=job.batch_size,
+                total_samples=total_samples, overlap=job.overlap, pitches=job.pitches,
+                skip_silence=job.skip_silence)
+            job.infer_seconds = time.time() - start_time
+            job.skipped_fraction = job.transcribed_dict['skipped_fraction']
+        else:
+            job.transcribed_dict = transcriptor.transcribe_file(job.audio_path, 
+                job.midi_path, cache=job.cache, gui_callback=job.progress_callback, 
+                batch_size=job.batch_size, overlap=job.overlap, pitches=job.pitches,
+                skip_silence=job.skip_silence)
+            timing = job.transcribed_dict['timing']
+            job.decode_seconds = timing['decode_seconds']
+            job.infer_seconds = timing['infer_seconds'] + timing['post_seconds']
+            job.cached = timing['cached']
+            job.skipped_fraction = job.transcribed_dict['skipped_fraction']
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_service():
+    """The process-wide TranscriptionService."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = TranscriptionService()
+        return _service
@@ -0,0 +1,253 @@
+import os
+import sys
+import time
+import queue
+import traceback
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .export import OUTPUT_KEYS, PEDAL_OUTPUT_KEYS
+from .profiling import traced
+from . import config
+
+
+def _attach(name):
+    """Attach to a shared memory block created by the parent, which unlinks 
+    it. Spawned workers share the resource tracker of the parent, so the 
+    block is tracked once either way."""
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    return shared_memory.SharedMemory(name=name)
+
+
+def _worker(model_type, checkpoint_path, cpu_fast, threads, tasks, results):
+    """Hold one model and forward shards of segments until None is received.
+
+    A task is (audio_name, audio_samples, output_specs, segment_samples,
+    hop_samples, shard_indexes, output_offset, batch_size, shared_logmel).
+    The outputs of the shard are written into the shared output buffers from
+    output_offset on, then ('done', shard_len) is put to results.
+    """
+    try:
+        import torch
+        from .inference import build_model
+        from .pytorch_utils import quantize_dynamic_int8
+
+        torch.set_num_threads(threads)
+        model = build_model(model_type, checkpoint_path, 'cpu', config.frames_per_second,
+            config.classes_num)
+        if cpu_fast:
+            model = quantize_dynamic_int8(model)
+        results.put(('ready', os.getpid()))
+    except Exception:
+        results.put(('error', traceback.format_exc()))
+        return
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        blocks = []
+        try:
+            results.put(('done', _forward_shard(model, task, blocks)))
+        except Exception:
+            results.put(('error', traceback.format_exc()))
+        finally:
+            for block in blocks:
+                block.close()
+
+
+def _forward_shard(model, task, blocks):
+    """Forward one shard in a worker, see _worker. Views of the shared memory 
+    are released on return, before the blocks are closed."""
+    from .pytorch_utils import forward, forward_logmel
+
+    (audio_name, audio_samples, output_specs, segment_samples, hop_samples,
+        shard_indexes, output_offset, batch_size, shared_logmel) = task
+    blocks.append(_attach(audio_name))
+    audio = np.ndarray((audio_samples,), dtype=np.float32, buffer=blocks[-1].buf)
+
+    if shared_logmel:
+        output_dict = forward_logmel(model, audio, segment_samples, batch_size,
+            hop_samples=hop_samples, segment_indexes=shard_indexes)
+    else:
+        segments = np.lib.stride_tricks.sliding_window_view(audio,
+            segment_samples)[::hop_samples][shard_indexes]
+        output_dict = forward(model, segments, batch_size)
+
+    for key, (name, shape) in output_specs.items():
+        blocks.append(_attach(name))
+        y = np.ndarray(shape, dtype=np.float32, buffer=blocks[-1].buf)
+        y[output_offset : output_offset + len(shard_indexes)] = output_dict[key]
+    return len(shard_indexes)
+
+
+class ShardedForward(object):
+    def __init__(self, model_type, checkpoint_path, workers, cpu_fast=False,
+        threads_per_worker=None):
+        """Forward segments in several CPU worker processes, each holding the
+        model once. GRUs at a small batch size gain little from intra-op
+        threads, so separate processes with a few threads each scale better
+        on many-core CPUs.
+
+        The audio is passed to the workers in shared memory, and each worker
+        writes the outputs of its shards into shared output buffers, so
+        neither is pickled.
+
+        Args:
+          model_type: str
+          checkpoint_path: str
+          workers: int, number of processes, up to the number of physical cores
+          cpu_fast: bool, int8 dynamic quantization in each worker
+          threads_per_worker: None | int, None to share the CPUs evenly
+        """
+        self.model_type = model_type
+        self.checkpoint_path = checkpoint_path
+        self.workers = workers
+        self.cpu_fast = cpu_fast
+        self.threads = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+        self.processes = []
+        self._start()
+
+    def _start(self):
+        """Start the worker processes with new queues and wait until each has 
+        loaded the model."""
+        context = multiprocessing.get_context('spawn')
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        self.processes = [context.Process(target=_worker, args=(self.model_type,
+            self.checkpoint_path, self.cpu_fast, self.threads, self.tasks, self.results), 
+            daemon=True) for _ in range(self.workers)]
+        for process in self.processes:
+            process.start()
+
+        for _ in range(self.workers):
+            try:
+                (status, value) = self._get_result()
+            except RuntimeError:
+                self.close()
+                raise
+            if status == 'error':
+                self.close()
+                raise RuntimeError('Sharded worker failed to load the model:\n' + value)
+
+    def output_shapes(self, segments_num, segment_samples):
+        """Output shapes are known from the model type without running it."""
+        frames = segment_samples // (config.sample_rate // config.frames_per_second) + 1
+        return {key: (segments_num, frames, 1 if key in PEDAL_OUTPUT_KEYS else config.classes_num)
+            for key in OUTPUT_KEYS[self.model_type]}
+
+    @traced()
+    def __call__(self, audio, segment_samples, hop_samples, batch_size,
+        segment_indexes=None, progress_callback=None, shared_logmel=True,
+        shards_per_worker=4):
+        """Forward segments of audio, as forward_logmel if shared_logmel, else
+        as forward on PianoTranscription.enframe(audio).
+
+        Args:
+          audio: (audio_samples,), padded to be covered by whole segments
+          segment_samples: int
+          hop_samples: int
+          batch_size: int, batch size in each worker
+          segment_indexes: None | sorted (n,) int array, only forward these
+          progress_callback: None | callable, see pytorch_utils.forward
+          shared_logmel: bool
+          shards_per_worker: int, segments are split into this many contiguous
+            shards per worker and handed out as workers get free, so that a
+            slower worker does not hold up the others
+
+        Returns:
+          output_dict: {'reg_onset_output': (n, segment_frames, classes_num), ...}
+        """
+        if not self.is_alive():
+            raise RuntimeError('The sharded workers are closed')
+        if segment_indexes is None:
+            segment_indexes = np.arange((len(audio) - segment_samples) // hop_samples + 1)
+        segment_indexes = np.asarray(segment_indexes)
+        total_segments = len(segment_indexes)
+
+        blocks = []
+        outputs = {}
+        outstanding = 0
+        try:
+            blocks.append(shared_memory.SharedMemory(create=True, size=audio.size * 4))
+            np.ndarray(audio.shape, dtype=np.float32, buffer=blocks[-1].buf)[:] = audio
+            audio_name = blocks[-1].name
+
+            output_specs = {}
+            for key, shape in self.output_shapes(total_segments, segment_samples).items():
+                blocks.append(shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * 4))
+                outputs[key] = np.ndarray(shape, dtype=np.float32, buffer=blocks[-1].buf)
+                output_specs[key] = (blocks[-1].name, shape)
+
+            shards = [shard for shard in np.array_split(np.arange(total_segments),
+                min(total_segments, self.workers * shards_per_worker)) if len(shard)]
+            for shard in shards:
+                self.tasks.put((audio_name, len(audio), output_specs, segment_samples,
+                    hop_samples, segment_indexes[shard], int(shard[0]), batch_size,
+                    shared_logmel))
+                outstanding += 1
+
+            (done, errors) = (0, [])
+            start_time = time.time()
+            for _ in range(len(shards)):
+                (status, value) = self._get_result()
+                outstanding -= 1
+                if status == 'error':
+                    errors.append(value)
+                    continue
+                done += value
+                if progress_callback:
+                    elapsed = time.time() - start_time
+                    progress_callback(done, total_segments, elapsed,
+                        done / elapsed if elapsed > 0 else 0)
+            if errors:
+                raise RuntimeError('Sharded forward failed:\n' + errors[0])
+
+            return {key: np.array(value) for key, value in outputs.items()}
+        finally:
+            outputs = None
+            for block in blocks:
+                block.close()
+                block.unlink()
+            if outstanding:
+                # A worker died or the progress callback raised. The tasks 
+                # still queued refer to the blocks unlinked above and their 
+                # results would be taken for those of the next call, so start 
+                # over with new processes and queues
+                self.restart()
+
+    def _get_result(self, poll_seconds=1.):
+        """Next message of the workers. Raises instead of waiting forever if 
+        a worker died, e.g. killed for running out of memory."""
+        while True:
+            try:
+                return self.results.get(timeout=poll_seconds)
+            except queue.Empty:
+                if not all(process.is_alive() for process in self.processes):
+                    raise RuntimeError('A sharded worker exited unexpectedly')
+
+    def is_alive(self):
+        """All worker processes are running."""
+        return bool(self.processes) and all(process.is_alive() for process in self.processes)
+
+    def restart(self):
+        """Terminate the workers, dropping their queued tasks, and start new 
+        ones. If they fail to load the model the pool stays closed."""
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join(timeout=5)
+        self.processes = []
+        self._start()
+
+    def close(self):
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
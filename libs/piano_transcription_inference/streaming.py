@@ -0,0 +1,462 @@
+import os
+import numpy as np
+from bisect import bisect_right
+import librosa
+
+from .piano_vad import (_note_events_sparse, _pedal_events_sparse, _run_starts,
+    _split_by_class, pedal_onset_mask)
+from .profiling import traced
+
+
+NOTE_KEYS = ('reg_onset_output', 'reg_offset_output', 'frame_output', 'velocity_output')
+PEDAL_KEYS = ('reg_pedal_offset_output', 'pedal_frame_output')
+
+
+def stream_audio(path, sr=16000, chunk_seconds=10., dtype=np.float32):
+    """Decode an audio file chunk by chunk to mono waveform at sr. Memory does
+    not grow with the length of the file.
+
+    Args:
+      path: str
+      sr: int, target sample rate
+      chunk_seconds: float, duration of decoded chunks before resampling
+
+    Returns:
+      generator of (chunk_samples,) arrays
+    """
+    import soxr
+
+    resampler = None
+
+    for (block, sr_native) in _decode_blocks(path, chunk_seconds, dtype):
+        if block.ndim > 1:
+            block = _downmix(block, np.empty(len(block), dtype=dtype))
+        if sr_native == sr:
+            yield np.ascontiguousarray(block, dtype=dtype)
+            continue
+        if resampler is None:
+            resampler = soxr.ResampleStream(sr_native, sr, 1, dtype=np.dtype(dtype).name,
+                quality='HQ')
+        y = resampler.resample_chunk(np.ascontiguousarray(block, dtype=dtype))
+        if len(y):
+            yield y
+
+    if resampler is not None:
+        y = resampler.resample_chunk(np.zeros(0, dtype=dtype), last=True)
+        if len(y):
+            yield y
+
+
+def _decode_blocks(path, chunk_seconds, dtype):
+    """Yield (block, sr_native), block is (samples,) or (samples, channels).
+    soundfile is used if it can open the file, otherwise audioread."""
+    import soundfile
+
+    try:
+        f = soundfile.SoundFile(path)
+    except Exception:
+        f = None
+
+    if f is not None:
+        with f:
+            sr_native = f.samplerate
+            for block in f.blocks(blocksize=int(sr_native * chunk_seconds),
+                dtype=np.dtype(dtype).name):
+                yield block, sr_native
+        return
+
+    import audioread
+
+    with audioread.audio_open(os.path.realpath(path)) as input_file:
+        sr_native = input_file.samplerate
+        n_channels = input_file.channels
+        block_samples = int(sr_native * chunk_seconds) * n_channels
+        (buf, buffered) = ([], 0)
+
+        for frame in input_file:
+            buf.append(librosa.util.buf_to_float(frame, dtype=dtype))
+            buffered += len(buf[-1])
+            if buffered >= block_samples:
+                y = np.concatenate(buf)
+                usable = len(y) - len(y) % n_channels
+                (buf, buffered) = ([y[usable :]], len(y) - usable)
+                yield y[: usable].reshape((-1, n_channels)), sr_native
+
+        if buffered:
+            y = np.concatenate(buf)
+            yield y[: len(y) - len(y) % n_channels].reshape((-1, n_channels)), sr_native
+
+
+@traced()
+def decode_audio(path, sr=16000, dtype=np.float32, quality='HQ'):
+    """Decode a whole audio file to mono waveform at sr, a faster librosa.load. 
+    Files soundfile can open are decoded block by block into a preallocated 
+    mono buffer and resampled once with soxr. Other files are decoded by 
+    ffmpeg, which downmixes and resamples to sr itself, or by audioread if 
+    ffmpeg is not on PATH.
+
+    Args:
+      path: str
+      sr: int, target sample rate
+      quality: str, soxr quality, 'HQ' as stream_audio, 'MQ' | 'LQ' are faster
+
+    Returns:
+      (audio_samples,) array
+    """
+    import shutil
+    import soundfile
+    import soxr
+
+    try:
+        f = soundfile.SoundFile(path)
+    except Exception:
+        f = None
+
+    if f is not None:
+        with f:
+            (y, sr_native) = (_decode_soundfile(f, dtype), f.samplerate)
+    elif shutil.which('ffmpeg'):
+        return _decode_ffmpeg(shutil.which('ffmpeg'), path, sr, dtype)
+    else:
+        (y, sr_native) = _decode_audioread(path, dtype)
+
+    if sr_native != sr:
+        # Same length as librosa.resample
+        samples = int(np.ceil(len(y) * sr / sr_native))
+        y = librosa.util.fix_length(soxr.resample(y, sr_native, sr, quality=quality), 
+            size=samples)
+    return np.ascontiguousarray(y, dtype=dtype)
+
+
+def _grow(buf, samples):
+    """Return buf, or a copy at least twice as long if it holds fewer than
+    samples."""
+    if len(buf) >= samples:
+        return buf
+    new_buf = np.empty(max(samples, 2 * len(buf)), dtype=buf.dtype)
+    new_buf[: len(buf)] = buf
+    return new_buf
+
+
+def _downmix(block, out):
+    """Mean of the channels of block (samples, channels) written into out, 
+    several times faster than block.mean(axis=1) on interleaved samples."""
+    np.copyto(out, block[:, 0])
+    for c in range(1, block.shape[1]):
+        out += block[:, c]
+    if block.shape[1] > 1:
+        out *= 1. / block.shape[1]
+    return out
+
+
+def _decode_soundfile(f, dtype, chunk_seconds=10.):
+    """soundfile.SoundFile -> (samples,) mono. f.frames may be an estimate for
+    compressed formats, so the buffer still grows if needed."""
+    y = np.empty(f.frames, dtype=dtype)
+    n = 0
+    for block in f.blocks(blocksize=int(f.samplerate * chunk_seconds),
+        dtype=np.dtype(dtype).name, always_2d=True):
+        y = _grow(y, n + len(block))
+        _downmix(block, y[n : n + len(block)])
+        n += len(block)
+    return y[: n]
+
+
+def _decode_ffmpeg(ffmpeg, path, sr, dtype, initial_seconds=300.):
+    """Let ffmpeg decode, downmix and resample, and read its raw float32 output
+    straight into a preallocated buffer."""
+    import subprocess
+
+    cmd = [ffmpeg, '-nostdin', '-v', 'error', '-i', path, '-f', 'f32le', '-ac', '1',
+        '-ar', str(sr), '-']
+    y = np.empty(int(sr * initial_seconds), dtype=np.float32)
+    n_bytes = 0
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as proc:
+        while True:
+            if n_bytes == y.nbytes:
+                y = _grow(y, len(y) + 1)
+            read = proc.stdout.readinto(memoryview(y.view(np.uint8))[n_bytes :])
+            if not read:
+                break
+            n_bytes += read
+    if proc.returncode != 0:
+        raise RuntimeError('ffmpeg failed to decode {}'.format(path))
+    return np.ascontiguousarray(y[: n_bytes // 4], dtype=dtype)
+
+
+def _decode_audioread(path, dtype):
+    """audioread -> ((samples,) mono, sr_native), the interleaved samples are
+    written into a buffer preallocated from the duration of the file."""
+    import audioread
+
+    with audioread.audio_open(os.path.realpath(path)) as input_file:
+        sr_native = input_file.samplerate
+        n_channels = input_file.channels
+        y = np.empty(int((input_file.duration + 1) * sr_native) * n_channels, dtype=dtype)
+        n = 0
+        for frame in input_file:
+            frame = librosa.util.buf_to_float(frame, dtype=dtype)
+            y = _grow(y, n + len(frame))
+            y[n : n + len(frame)] = frame
+            n += len(frame)
+
+    y = y[: n - n % n_channels]
+    if n_channels > 1:
+        y = _downmix(y.reshape((-1, n_channels)), np.empty(len(y) // n_channels, dtype=dtype))
+    return y, sr_native
+
+
+class SegmentStitcher(object):
+    def __init__(self, hop_frames=None):
+        """Stitch segment outputs to a sequence as segments arrive, with the
+        same rule as PianoTranscription.deframe: each segment gives the frames
+        up to the middle of its overlaps, e.g. with 50% overlap the first
+        segment gives its first 75%, middle segments their middle 50% and the
+        last segment its last 75%.
+
+        Args:
+          hop_frames: None | int, hop between segments, None for 50% overlap
+        """
+        self.hop_frames = hop_frames
+        self.segments_num = 0
+        self.tail = None
+
+    def push(self, output_dict):
+        """Add outputs of the next segments.
+
+        Args:
+          output_dict: {'frame_output': (N, segment_frames + 1, classes_num), ...}
+
+        Returns:
+          frames_dict: {'frame_output': (frames, classes_num), ...}, frames
+            that later segments do not overwrite.
+        """
+        frames_dict = {}
+        for key in output_dict.keys():
+            x = output_dict[key]
+            segment_frames = x.shape[1] - 1
+            """The extra frame in the end of each segment is caused by the
+            'center=True' argument when calculating spectrogram."""
+            overlap_frames = segment_frames - (self.hop_frames or segment_frames // 2)
+            assert overlap_frames % 2 == 0
+            (bgn, fin) = (overlap_frames // 2, segment_frames - overlap_frames // 2)
+
+            y = []
+            for i in range(x.shape[0]):
+                if self.segments_num + i == 0:
+                    y.append(x[i, 0 : fin])
+                else:
+                    y.append(x[i, bgn : fin])
+            frames_dict[key] = np.concatenate(y, axis=0)
+            self.tail = dict(self.tail or {}, **{key: x[-1, fin :]})
+
+        self.segments_num += len(next(iter(output_dict.values())))
+        return frames_dict
+
+    def finish(self):
+        """Returns the rest of the last segment. A single segment is kept
+        whole, including the extra frame."""
+        if self.tail is None:
+            return {}
+        if self.segments_num == 1:
+            return dict(self.tail)
+        return {key: self.tail[key][0 : -1] for key in self.tail.keys()}
+
+
+class StreamingPostProcessor(object):
+    def __init__(self, post_processor):
+        """Post process frame outputs that arrive in order, and emit every note
+        as soon as later frames can no longer change it. The emitted notes are
+        the same as RegressionPostProcessor on the whole output_dict.
+
+        Only the frames after the earliest undecided note are kept. A note is
+        decided at most 600 frames after its onset, so memory is bounded.
+        A pedal has no such limit, so a held pedal is carried as its onset
+        and first disappear frame and only the last frames are kept. The
+        onsets and offsets are binarized once for each new frame, plus the
+        frames whose neighbours just arrived.
+
+        Args:
+          post_processor: RegressionPostProcessor
+        """
+        self.post_processor = post_processor
+        self.classes_num = len(post_processor.midi_notes)
+        self.frames_num = 0
+        self.note_buffers = {}
+        self.note_binarized = {}
+        self.note_start = 0
+        self.note_after = [0] * self.classes_num
+        self.pedal_buffers = {}
+        self.pedal_binarized = {}
+        self.pedal_start = 0
+        self.pedal_after = 0
+        self.pedal_held = None
+        self.binarized_frames = 0
+        """Frames before this are binarized for good: their neighbours have 
+        all arrived."""
+
+    def push(self, frames_dict, final=False):
+        """Add next frames and detect notes and pedals that are decided.
+
+        Args:
+          frames_dict: {'frame_output': (frames, classes_num), ...}, keys as
+            output_dict of the model
+          final: bool, no more frames will come
+
+        Returns:
+          est_on_off_note_vels: (notes, 4), see
+            RegressionPostProcessor.output_dict_to_detected_notes
+          est_pedal_on_offs: None | (pedals, 2), None if there are no pedal
+            outputs
+        """
+        frames_num = len(frames_dict['frame_output']) if frames_dict else 0
+        self.frames_num += frames_num
+        for key in NOTE_KEYS:
+            if key in frames_dict:
+                self.note_buffers[key] = _append(self.note_buffers.get(key), 
+                    self.post_processor.select_note_classes(frames_dict[key]))
+        with_pedal = 'reg_pedal_onset_output' in frames_dict or bool(self.pedal_buffers)
+        if with_pedal:
+            for key in PEDAL_KEYS:
+                if key in frames_dict:
+                    self.pedal_buffers[key] = _append(self.pedal_buffers.get(key), frames_dict[key])
+
+        """Binarized onsets and offsets are final up to 4 frames before the
+        newest frame. 'last' is the last frame to be searched."""
+        last = self.frames_num - 1 if final else self.frames_num - 5
+
+        pp = self.post_processor
+        self._binarize(self.note_buffers, self.note_binarized, self.note_start, 
+            {'reg_onset_output': (pp.onset_threshold, 2), 
+            'reg_offset_output': (pp.offset_threshold, 4)})
+        if with_pedal:
+            self._binarize(self.pedal_buffers, self.pedal_binarized, self.pedal_start, 
+                {'reg_pedal_offset_output': (pp.pedal_offset_threshold, 4)})
+        self.binarized_frames = max(self.frames_num - 4, 0)
+
+        est_on_off_note_vels = self._detect_notes(last, final)
+        est_pedal_on_offs = self._detect_pedals(last, final) if with_pedal else None
+
+        return est_on_off_note_vels, est_pedal_on_offs
+
+    def _binarize(self, buffers, binarized, start, specs):
+        """Update the binarized outputs of buffers from self.binarized_frames 
+        on. The binarized output of a frame depends on the neighbour frames 
+        on each side, so these are binarized again with the new frames and 
+        the outputs of the frames before are kept.
+
+        Args:
+          buffers: dict, key -> (frames, classes_num) from frame start
+          binarized: dict, key -> (binary_output, shift_output), updated
+          start: int
+          specs: dict, key -> (threshold, neighbour)
+        """
+        done = self.binarized_frames - start
+        for (key, (threshold, neighbour)) in specs.items():
+            if key not in buffers:
+                continue
+            bgn = max(done - neighbour, 0)
+            outputs = self.post_processor.get_binarized_output_from_regression(
+                reg_output=buffers[key][bgn :], threshold=threshold, neighbour=neighbour)
+            if key in binarized:
+                outputs = tuple(np.concatenate((previous[: done], output[done - bgn :]), axis=0)
+                    for (previous, output) in zip(binarized[key], outputs))
+            binarized[key] = outputs
+
+    def _detect_notes(self, last, final):
+        pp = self.post_processor
+        start = self.note_start
+        if last < start or not self.note_buffers:
+            return np.array([])
+
+        (onset_output, onset_shift_output) = self.note_binarized['reg_onset_output']
+        (offset_output, offset_shift_output) = self.note_binarized['reg_offset_output']
+        frame_output = self.note_buffers['frame_output']
+        velocity_output = self.note_buffers['velocity_output']
+
+        n = last + 1 - start
+        disappear_mask = (frame_output[0 : n] <= pp.frame_threshold).T
+        onsets = _split_by_class_from(onset_output[0 : n].T == 1, start, self.classes_num)
+        disappear_starts = _split_by_class_from(_run_starts(disappear_mask, axis=1),
+            start, self.classes_num)
+        offsets = _split_by_class_from(offset_output[0 : n].T == 1, start, self.classes_num)
+
+        est_tuples = []
+        est_midi_notes = []
+        for k in range(self.classes_num):
+            events = _note_events_sparse(onsets[k], disappear_mask[k], disappear_starts[k],
+                offsets[k], frames_num=last + 1, after=self.note_after[k], mask_offset=start)
+            decided = [e for e in events if final or e[3] < last]
+
+            est_tuples += [[bgn, fin, onset_shift_output[bgn - start, k],
+                0 if consecutive else offset_shift_output[fin - start, k],
+                velocity_output[bgn - start, k]]
+                for (bgn, fin, consecutive, _) in decided]
+            est_midi_notes += [int(pp.midi_notes[k])] * len(decided)
+
+            """Resume before the first undecided onset, or after the last
+            searched frame if there is none."""
+            after = decided[-1][3] if decided else self.note_after[k]
+            i = bisect_right(onsets[k], max(after, 0))
+            self.note_after[k] = onsets[k][i] - 1 if i < len(onsets[k]) else last
+
+        self._trim_notes(min(self.note_after) - 4)
+        return pp.note_tuples_to_array(est_tuples, est_midi_notes)
+
+    def _detect_pedals(self, last, final):
+        pp = self.post_processor
+        start = self.pedal_start
+        if last < start or not self.pedal_buffers:
+            return np.array([])
+
+        (offset_output, offset_shift_output) = self.pedal_binarized['reg_pedal_offset_output']
+        frame_output = self.pedal_buffers['pedal_frame_output'][:, 0]
+        offset_output = offset_output[:, 0]
+        offset_shift_output = offset_shift_output[:, 0]
+
+        n = last + 1 - start
+        disappear_mask = frame_output[0 : n] <= 0.5
+        onset_mask = pedal_onset_mask(frame_output[0 : n], 0.5)
+        onset_mask[0] = False   # The previous frame is not kept
+        (events, self.pedal_held) = _pedal_events_sparse(
+            onsets=(np.flatnonzero(onset_mask) + start).tolist(),
+            disappear_mask=disappear_mask,
+            disappear_starts=(np.flatnonzero(_run_starts(disappear_mask)) + start).tolist(),
+            offsets=(np.flatnonzero(offset_output[0 : n] == 1) + start).tolist(),
+            frames_num=last + 1, after=self.pedal_after, mask_offset=start, 
+            held=self.pedal_held)
+
+        est_tuples = [[bgn, fin, 0., offset_shift_output[fin - start]] for (bgn, fin, _) in events]
+        self.pedal_after = last
+
+        self._trim_pedals(self.pedal_after - 4)
+        return pp.pedal_tuples_to_array(est_tuples)
+
+    def _trim_notes(self, start):
+        if start > self.note_start:
+            _trim(self.note_buffers, self.note_binarized, start - self.note_start)
+            self.note_start = start
+
+    def _trim_pedals(self, start):
+        if start > self.pedal_start:
+            _trim(self.pedal_buffers, self.pedal_binarized, start - self.pedal_start)
+            self.pedal_start = start
+
+
+def _trim(buffers, binarized, frames):
+    """Drop the first frames of buffers and their binarized outputs."""
+    for key in buffers.keys():
+        buffers[key] = buffers[key][frames :]
+    for key in binarized.keys():
+        binarized[key] = tuple(output[frames :] for output in binarized[key])
+
+
+def _append(buffer, x):
+    return x.copy() if buffer is None else np.concatenate((buffer, x), axis=0)
+
+
+def _split_by_class_from(mask_T, offset, classes_num):
+    """Per class sorted lists of True frames of a (classes_num, frames) mask,
+    frame indexes start from offset."""
+    (class_idxes, frame_idxes) = np.nonzero(mask_T)
+    return _split_by_class(class_idxes, frame_idxes + offset, classes_num)
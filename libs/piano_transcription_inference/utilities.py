@@ -4,7 +4,9 @@ import audioread
 import librosa
 from mido import MidiFile
 
-from .piano_vad import (note_detection_with_onset_offset_regress, pedal_detection_with_onset_offset_regress)
+from .piano_vad import (note_detection_with_onset_offset_regress, pedal_detection_with_onset_offset_regress, 
+    notes_detection_with_onset_offset_regress_fast, pedal_detection_with_onset_offset_regress_fast)
+from .profiling import traced
 from . import config
 
 
@@ -84,6 +86,7 @@ def read_midi(midi_path):
     return midi_dict
 
 
+@traced()
 def write_events_to_midi(start_time, note_events, pedal_events, midi_path):
     """Write out note events to MIDI file.
 
@@ -158,7 +161,7 @@ def write_events_to_midi(start_time, note_events, pedal_events, midi_path):
 
 class RegressionPostProcessor(object):
     def __init__(self, frames_per_second, classes_num, onset_threshold, 
-        offset_threshold, frame_threshold, pedal_offset_threshold):
+        offset_threshold, frame_threshold, pedal_offset_threshold, pitches=None):
         """Postprocess the output probabilities of a transription model to MIDI 
         events.
 
@@ -169,6 +172,9 @@ class RegressionPostProcessor(object):
           offset_threshold: float
           frame_threshold: float
           pedal_offset_threshold: float
+          pitches: None | iterable of MIDI notes. Only detect notes of these 
+            pitches, the columns of other pitches are not binarized nor 
+            searched. None for all pitches.
         """
         self.frames_per_second = frames_per_second
         self.classes_num = classes_num
@@ -179,6 +185,27 @@ class RegressionPostProcessor(object):
         self.begin_note = config.begin_note
         self.velocity_scale = config.velocity_scale
 
+        if pitches is None:
+            self.note_classes = None
+            self.midi_notes = np.arange(classes_num) + self.begin_note
+        else:
+            self.note_classes = np.array(sorted(set(int(pitch) - self.begin_note 
+                for pitch in pitches if 0 <= int(pitch) - self.begin_note < classes_num)), 
+                dtype=np.int64)
+            self.midi_notes = self.note_classes + self.begin_note
+        """MIDI note of each searched class."""
+
+    def select_note_classes(self, x):
+        """Columns of the requested pitches.
+
+        Args:
+          x: (frames_num, classes_num)
+
+        Returns:
+          (frames_num, len(self.midi_notes))
+        """
+        return x if self.note_classes is None else x[:, self.note_classes]
+
     def output_dict_to_midi_events(self, output_dict):
         """Main function. Post process model outputs to MIDI events.
 
@@ -208,7 +235,12 @@ class RegressionPostProcessor(object):
         """est_on_off_note_vels: (events_num, 4), the four columns are: [onset_time, offset_time, piano_note, velocity], 
         est_pedal_on_offs: (pedal_events_num, 2), the two columns are: [onset_time, offset_time]"""
 
-        # Reformat notes to MIDI events
+        return self.note_pedal_arrays_to_events(est_on_off_note_vels, est_pedal_on_offs)
+
+    @traced()
+    def note_pedal_arrays_to_events(self, est_on_off_note_vels, est_pedal_on_offs):
+        """Reformat arrays of output_dict_to_note_pedal_arrays to MIDI events, 
+        see output_dict_to_midi_events."""
         est_note_events = self.detected_notes_to_events(est_on_off_note_vels)
 
         if est_pedal_on_offs is None:
@@ -218,9 +250,11 @@ class RegressionPostProcessor(object):
 
         return est_note_events, est_pedal_events
 
+    @traced()
     def output_dict_to_note_pedal_arrays(self, output_dict):
         """Postprocess the output probabilities of a transription model to MIDI 
-        events.
+        events. With pitches, the binarized outputs added to output_dict only 
+        have the columns of the requested pitches.
 
         Args:
           output_dict: dict, {
@@ -251,7 +285,7 @@ class RegressionPostProcessor(object):
         # Calculate binarized onset output from regression output
         (onset_output, onset_shift_output) = \
             self.get_binarized_output_from_regression(
-                reg_output=output_dict['reg_onset_output'], 
+                reg_output=self.select_note_classes(output_dict['reg_onset_output']), 
                 threshold=self.onset_threshold, neighbour=2)
 
         output_dict['onset_output'] = onset_output  # Values are 0 or 1
@@ -260,7 +294,7 @@ class RegressionPostProcessor(object):
         # Calculate binarized offset output from regression output
         (offset_output, offset_shift_output) = \
             self.get_binarized_output_from_regression(
-                reg_output=output_dict['reg_offset_output'], 
+                reg_output=self.select_note_classes(output_dict['reg_offset_output']), 
                 threshold=self.offset_threshold, neighbour=4)
 
         output_dict['offset_output'] = offset_output  # Values are 0 or 1
@@ -297,7 +331,57 @@ class RegressionPostProcessor(object):
 
     def get_binarized_output_from_regression(self, reg_output, threshold, neighbour):
         """Calculate binarized output and shifts of onsets or offsets from the
-        regression results.
+        regression results. Vectorized version of
+        get_binarized_output_from_regression_loop, the outputs are bit-identical.
+
+        Args:
+          reg_output: (frames_num, classes_num)
+          threshold: float
+          neighbour: int
+
+        Returns:
+          binary_output: (frames_num, classes_num)
+          shift_output: (frames_num, classes_num)
+        """
+        binary_output = np.zeros_like(reg_output)
+        shift_output = np.zeros_like(reg_output)
+        frames_num = reg_output.shape[0]
+        
+        if frames_num <= 2 * neighbour:
+            return binary_output, shift_output
+
+        x = reg_output
+        (bgn, fin) = (neighbour, frames_num - neighbour)
+        """Candidate frames are n in [bgn, fin), x[bgn + d : fin + d] is x[n + d]."""
+
+        mask = x[bgn : fin] > threshold
+
+        # Monotonic neighbour: written as ~(a < b) to match the loop version on NaNs
+        for i in range(neighbour):
+            mask &= ~(x[bgn - i : fin - i] < x[bgn - i - 1 : fin - i - 1])
+            mask &= ~(x[bgn + i : fin + i] < x[bgn + i + 1 : fin + i + 1])
+
+        (frame_idxes, class_idxes) = np.nonzero(mask)
+        frame_idxes += bgn
+
+        binary_output[frame_idxes, class_idxes] = 1
+
+        """See Section III-D in [1] for deduction.
+        [1] Q. Kong, et al., High-resolution Piano Transcription 
+        with Pedals by Regressing Onsets and Offsets Times, 2020."""
+        x_prev = x[frame_idxes - 1, class_idxes]
+        x_curr = x[frame_idxes, class_idxes]
+        x_next = x[frame_idxes + 1, class_idxes]
+        denominator = np.where(x_prev > x_next, x_curr - x_next, x_curr - x_prev)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            shift = (x_next - x_prev) / denominator / 2
+        # A flat peak, e.g. outputs saturated at 1, is 0 / 0: the onset is at the frame
+        shift_output[frame_idxes, class_idxes] = np.where(denominator == 0, 0, shift)
+
+        return binary_output, shift_output
+
+    def get_binarized_output_from_regression_loop(self, reg_output, threshold, neighbour):
+        """Reference loop implementation of get_binarized_output_from_regression.
 
         Args:
           reg_output: (frames_num, classes_num)
@@ -321,7 +405,9 @@ class RegressionPostProcessor(object):
                     """See Section III-D in [1] for deduction.
                     [1] Q. Kong, et al., High-resolution Piano Transcription 
                     with Pedals by Regressing Onsets and Offsets Times, 2020."""
-                    if x[n - 1] > x[n + 1]:
+                    if x[n - 1] == x[n] == x[n + 1]:
+                        shift = 0
+                    elif x[n - 1] > x[n + 1]:
                         shift = (x[n + 1] - x[n - 1]) / (x[n] - x[n + 1]) / 2
                     else:
                         shift = (x[n + 1] - x[n - 1]) / (x[n] - x[n - 1]) / 2
@@ -349,6 +435,7 @@ class RegressionPostProcessor(object):
 
         return monotonic
 
+    @traced()
     def output_dict_to_detected_notes(self, output_dict):
         """Postprocess output_dict to piano notes.
 
@@ -360,7 +447,8 @@ class RegressionPostProcessor(object):
             'offset_shift_output': (frames_num, classes_num),
             'frame_output': (frames_num, classes_num),
             'onset_output': (frames_num, classes_num),
-            ...}
+            ...}, with pitches the binarized outputs only have the columns 
+            of the requested pitches, see select_note_classes
 
         Returns:
           est_on_off_note_vels: (notes, 4), the four columns are onsets, offsets, 
@@ -371,22 +459,36 @@ class RegressionPostProcessor(object):
         """
         est_tuples = []
         est_midi_notes = []
-        classes_num = output_dict['frame_output'].shape[-1]
+
+        """Detect piano notes of all classes. Candidate events are found with 
+        NumPy, the result is the same as calling 
+        note_detection_with_onset_offset_regress for each class."""
+        est_tuples_per_class = notes_detection_with_onset_offset_regress_fast(
+            frame_output=self.select_note_classes(output_dict['frame_output']), 
+            onset_output=output_dict['onset_output'], 
+            onset_shift_output=output_dict['onset_shift_output'], 
+            offset_output=output_dict['offset_output'], 
+            offset_shift_output=output_dict['offset_shift_output'], 
+            velocity_output=self.select_note_classes(output_dict['velocity_output']), 
+            frame_threshold=self.frame_threshold)
  
-        for piano_note in range(classes_num):
-            """Detect piano notes"""
-            est_tuples_per_note = note_detection_with_onset_offset_regress(
-                frame_output=output_dict['frame_output'][:, piano_note], 
-                onset_output=output_dict['onset_output'][:, piano_note], 
-                onset_shift_output=output_dict['onset_shift_output'][:, piano_note], 
-                offset_output=output_dict['offset_output'][:, piano_note], 
-                offset_shift_output=output_dict['offset_shift_output'][:, piano_note], 
-                velocity_output=output_dict['velocity_output'][:, piano_note], 
-                frame_threshold=self.frame_threshold)
-            
+        for k in range(len(est_tuples_per_class)):
+            est_tuples_per_note = est_tuples_per_class[k]
             est_tuples += est_tuples_per_note
-            est_midi_notes += [piano_note + self.begin_note] * len(est_tuples_per_note)
+            est_midi_notes += [int(self.midi_notes[k])] * len(est_tuples_per_note)
+
+        return self.note_tuples_to_array(est_tuples, est_midi_notes)
 
+    def note_tuples_to_array(self, est_tuples, est_midi_notes):
+        """Convert note tuples of the detection state machine to time.
+
+        Args:
+          est_tuples: list of [bgn, fin, onset_shift, offset_shift, normalized_velocity]
+          est_midi_notes: list of int
+
+        Returns:
+          est_on_off_note_vels: (notes, 4), see output_dict_to_detected_notes.
+        """
         est_tuples = np.array(est_tuples)   # (notes, 5)
         """(notes, 5), the five columns are onset, offset, onset_shift, 
         offset_shift and normalized_velocity"""
@@ -408,6 +510,7 @@ class RegressionPostProcessor(object):
 
             return est_on_off_note_vels
 
+    @traced()
     def output_dict_to_detected_pedals(self, output_dict):
         """Postprocess output_dict to piano pedals.
 
@@ -427,12 +530,23 @@ class RegressionPostProcessor(object):
         """
         frames_num = output_dict['pedal_frame_output'].shape[0]
         
-        est_tuples = pedal_detection_with_onset_offset_regress(
+        est_tuples = pedal_detection_with_onset_offset_regress_fast(
             frame_output=output_dict['pedal_frame_output'][:, 0], 
             offset_output=output_dict['pedal_offset_output'][:, 0], 
             offset_shift_output=output_dict['pedal_offset_shift_output'][:, 0], 
             frame_threshold=0.5)
 
+        return self.pedal_tuples_to_array(est_tuples)
+
+    def pedal_tuples_to_array(self, est_tuples):
+        """Convert pedal tuples of the detection state machine to time.
+
+        Args:
+          est_tuples: list of [bgn, fin, onset_shift, offset_shift]
+
+        Returns:
+          est_on_off: (notes, 2), see output_dict_to_detected_pedals.
+        """
         est_tuples = np.array(est_tuples)
         """(notes, 2), the two columns are pedal onsets and pedal offsets"""
         
@@ -497,11 +611,51 @@ class RegressionPostProcessor(object):
         return pedal_events
 
 
+def get_available_memory(device):
+    """Available memory in bytes on device, or None if it can not be probed."""
+    if 'cuda' in str(device):
+        try:
+            import torch
+            (free, _total) = torch.cuda.mem_get_info(torch.device(device))
+            return free
+        except Exception:
+            return None
+
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+
+    if os.name == 'nt':
+        import ctypes
+
+        class MEMORYSTATUSEX(ctypes.Structure):
+            _fields_ = [('dwLength', ctypes.c_ulong), ('dwMemoryLoad', ctypes.c_ulong),
+                        ('ullTotalPhys', ctypes.c_ulonglong), ('ullAvailPhys', ctypes.c_ulonglong),
+                        ('ullTotalPageFile', ctypes.c_ulonglong), ('ullAvailPageFile', ctypes.c_ulonglong),
+                        ('ullTotalVirtual', ctypes.c_ulonglong), ('ullAvailVirtual', ctypes.c_ulonglong),
+                        ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+
+        status = MEMORYSTATUSEX()
+        status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullAvailPhys
+        return None
+
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+@traced()
 def load_audio(path, sr=22050, mono=True, offset=0.0, duration=None,
-    dtype=np.float32, res_type='kaiser_best', 
+    dtype=np.float32, res_type='soxr_hq', 
     backends=[audioread.ffdec.FFmpegAudioFile]):
     """Load audio. Copied from librosa.core.load() except that ffmpeg backend is 
-    always used in this function."""
+    always used in this function. See streaming.decode_audio for a faster 
+    loader."""
 
     y = []
     with audioread.audio_open(os.path.realpath(path), backends=backends) as input_file:
@@ -552,7 +706,7 @@ def load_audio(path, sr=22050, mono=True, offset=0.0, duration=None,
                 y = librosa.core.audio.to_mono(y)
 
         if sr is not None:
-            y = librosa.core.audio.resample(y, sr_native, sr, res_type=res_type)
+            y = librosa.core.audio.resample(y, orig_sr=sr_native, target_sr=sr, res_type=res_type)
 
         else:
             sr = sr_native
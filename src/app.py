@@ -120,6 +120,7 @@ class BaseApp:
     def _create_params_frame(self):
         params = ttk.LabelFrame(self.frm, text="参数")
         params.pack(fill="x", pady=8)
+        self.params_frame = params  # 子类在此追加各自的参数控件
         ttk.Label(params, text="速度比例(1.0为原速)：").grid(row=0, column=0, sticky="e")
         self.ent_speed = ttk.Combobox(params, width=8, state="readonly",
                                       values=["0.5", "0.75", "1.0", "1.25", "1.5", "1.75", "2.0", "2.25", "2.5"])
@@ -476,12 +477,24 @@ class BaseApp:
         # MIDI -> 文本
         if ext in (".mid", ".midi"):
             try:
+                import mido
+                from utils.midi_reader import index_midi_tracks, default_parts
+                mid = mido.MidiFile(path)
+                index = index_midi_tracks(path, mid=mid)
+                parts = default_parts(index, drum=(ins == 'drum'))
+                # 多轨/多通道时让用户选择要转换的部分
+                if len(index) > 1:
+                    parts = self._select_midi_parts(index, parts)
+                    if parts is None:
+                        return
                 if ins == 'piano':
                     from utils.midi2lrcp import midi_to_lrcp_text
-                    self.score_text = midi_to_lrcp_text(path)
+                    chords_var = getattr(self, 'var_chords', None)
+                    self.score_text = midi_to_lrcp_text(path, chords=bool(chords_var and chords_var.get()),
+                                                        parts=parts, mid=mid)
                 else:
                     from utils.midi2lrcd import midi_to_lrcd_text
-                    self.score_text = midi_to_lrcd_text(path)
+                    self.score_text = midi_to_lrcd_text(path, parts=parts, mid=mid)
                 events = self._parse_score(self.score_text)
                 if not events:
                     raise ValueError("未解析出任何事件，请检查格式。")
@@ -502,6 +515,42 @@ class BaseApp:
         except Exception as e:
             messagebox.showerror("载入失败", str(e))
 
+    def _select_midi_parts(self, index: List[dict], preselected: set) -> Optional[set]:
+        """弹出 MIDI 轨道/通道选择窗口，返回选中的 (轨, 通道) 集合；取消返回 None。"""
+        from utils.midi_reader import GM_DRUM_CHANNEL, pitch_name
+
+        win = tk.Toplevel(self.root)
+        win.title("选择 MIDI 轨道/通道")
+        win.transient(self.root)
+        win.grab_set()
+
+        ttk.Label(win, text="勾选需要转换的部分（通道 10 为 GM 打击乐）：").grid(
+            row=0, column=0, columnspan=2, sticky="w", padx=10, pady=(10, 4))
+        vars_by_part = {}
+        for row, part in enumerate(index, start=1):
+            key = (part['track'], part['channel'])
+            var = tk.BooleanVar(value=key in preselected)
+            vars_by_part[key] = var
+            name = part['name'] or "未命名"
+            kind = "打击乐" if part['channel'] == GM_DRUM_CHANNEL else f"音色 {part['program'] or 0}"
+            text = (f"轨 {part['track']} · 通道 {part['channel'] + 1} · {name} · {kind} · "
+                    f"{part['notes']} 音 · {pitch_name(part['min_pitch'])}~{pitch_name(part['max_pitch'])}")
+            ttk.Checkbutton(win, text=text, variable=var).grid(row=row, column=0, columnspan=2, sticky="w", padx=10)
+
+        result = {"parts": None}
+
+        def on_ok():
+            result["parts"] = {k for k, v in vars_by_part.items() if v.get()}
+            win.destroy()
+
+        btns = ttk.Frame(win)
+        btns.grid(row=len(index) + 1, column=0, columnspan=2, pady=10)
+        ttk.Button(btns, text="确认", command=on_ok).pack(side="left", padx=8)
+        ttk.Button(btns, text="取消", command=win.destroy).pack(side="left", padx=8)
+
+        self.root.wait_window(win)
+        return result["parts"]
+
     def _parse_score(self, score_text: str) -> List[Event]:
         """子类实现具体的解析逻辑"""
         raise NotImplementedError
@@ -32,7 +32,7 @@ class MultiApp(BaseApp):
         self._create_key_display_frame()
 
         # 添加多人模式特有的参数 - 使用正确的行数
-        params = self.frm.winfo_children()[2]  # 注意：加了乐器框后，params位序为第3个
+        params = self.params_frame
         ttk.Label(params, text="多音偏移(ms):").grid(row=2, column=0, sticky="e")
         self.ent_offsets = ttk.Entry(params, width=11)
         self.ent_offsets.insert(0, "-15,0,15")
@@ -15,6 +15,13 @@ class SingleApp(BaseApp):
         super().__init__(root, "Windows 自动演奏 (钢琴/架子鼓)")
         self.events: List[Event] = []
 
+        # MIDI 载入选项：钢琴伴奏和弦识别（多人模式会去和弦，故仅单人模式提供）
+        params = self.params_frame
+        self.var_chords = tk.BooleanVar(value=False)
+        self.chk_chords = ttk.Checkbutton(params, text="MIDI和弦识别(伴奏->C/Dm/Em/F/G/Am/G7)", variable=self.var_chords)
+        self.chk_chords.grid(row=2, column=0, columnspan=4, sticky="w", padx=4)
+        self.param_widgets.append(self.chk_chords)
+
         # 键位映射提示（根据乐器切换刷新）
         self.mapping_frame = ttk.LabelFrame(self.frm, text="键位映射（请确保与游戏一致）")
         self.mapping_frame.pack(fill="x", pady=8)
@@ -0,0 +1,45 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from libs.piano_transcription_inference.utilities import RegressionPostProcessor
+
+
+def make_post_processor():
+    return RegressionPostProcessor(frames_per_second=100, classes_num=2, onset_threshold=0.3,
+        offset_threshold=0.3, frame_threshold=0.1, pedal_offset_threshold=0.2)
+
+
+def test_flat_peak_has_zero_shift():
+    """x[n - 1] == x[n] == x[n + 1] above the threshold used to give 0 / 0 = NaN."""
+    reg_output = np.zeros((12, 2), dtype=np.float32)
+    reg_output[:, 0] = [0, 0, 0.2, 0.5, 0.8, 0.8, 0.8, 0.5, 0.2, 0, 0, 0]
+    reg_output[:, 1] = [0, 0, 0.2, 0.5, 1.0, 0.6, 0.2, 0, 0, 0, 0, 0]
+    post_processor = make_post_processor()
+
+    for binarize in (post_processor.get_binarized_output_from_regression,
+        post_processor.get_binarized_output_from_regression_loop):
+        (binary_output, shift_output) = binarize(reg_output, threshold=0.3, neighbour=2)
+        assert not np.isnan(shift_output).any()
+        assert binary_output[5, 0] == 1
+        assert shift_output[5, 0] == 0
+        # An ordinary peak keeps its sub-frame shift
+        assert binary_output[4, 1] == 1
+        assert np.isclose(shift_output[4, 1], (0.6 - 0.5) / (1.0 - 0.5) / 2)
+
+
+def test_vectorized_matches_loop_on_plateaus():
+    rng = np.random.RandomState(0)
+    reg_output = rng.rand(300, 2).astype(np.float32)
+    reg_output[40:60] = 1.0
+    reg_output[100:140] = np.round(reg_output[100:140], 1)
+    post_processor = make_post_processor()
+
+    (binary, shift) = post_processor.get_binarized_output_from_regression(reg_output, 0.3, 2)
+    (binary_loop, shift_loop) = post_processor.get_binarized_output_from_regression_loop(
+        reg_output, 0.3, 2)
+    assert np.array_equal(binary, binary_loop)
+    assert np.array_equal(shift, shift_loop)
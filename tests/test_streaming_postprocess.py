@@ -0,0 +1,65 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from libs.piano_transcription_inference.utilities import RegressionPostProcessor
+from libs.piano_transcription_inference.streaming import StreamingPostProcessor
+
+
+def make_post_processor():
+    return RegressionPostProcessor(frames_per_second=100, classes_num=88, onset_threshold=0.3,
+        offset_threshold=0.3, frame_threshold=0.1, pedal_offset_threshold=0.2)
+
+
+def make_output_dict(frames_num, seed):
+    """Random outputs with short notes and pedals held for up to 30 s."""
+    rng = np.random.RandomState(seed)
+    output_dict = {key: (rng.rand(frames_num, 88) ** 6).astype(np.float32) for key in
+        ('reg_onset_output', 'reg_offset_output', 'velocity_output')}
+    output_dict['frame_output'] = (rng.rand(frames_num, 88) > 0.3).astype(np.float32) * 0.9
+    output_dict['reg_pedal_onset_output'] = np.zeros((frames_num, 1), dtype=np.float32)
+    output_dict['reg_pedal_offset_output'] = (rng.rand(frames_num, 1) ** 40).astype(np.float32)
+    pedal = np.zeros((frames_num, 1), dtype=np.float32)
+    t = 5
+    while t < frames_num:
+        held = rng.randint(50, 3000)
+        pedal[t : t + held] = 0.6 + 0.3 * rng.rand(len(pedal[t : t + held]), 1)
+        t += held + rng.randint(1, 40)
+    output_dict['pedal_frame_output'] = pedal
+    return output_dict
+
+
+def stream(output_dict, chunk):
+    streaming_processor = StreamingPostProcessor(make_post_processor())
+    frames_num = len(output_dict['frame_output'])
+    (notes, pedals, buffered) = ([], [], 0)
+    for i in range(0, frames_num, chunk):
+        (est_notes, est_pedals) = streaming_processor.push(
+            {key: value[i : i + chunk] for key, value in output_dict.items()},
+            final=i + chunk >= frames_num)
+        notes += [est_notes] if len(est_notes) else []
+        pedals += [est_pedals] if len(est_pedals) else []
+        buffered = max(buffered, len(streaming_processor.pedal_buffers['pedal_frame_output']))
+    notes = np.concatenate(notes)
+    pedals = np.concatenate(pedals) if pedals else np.array([])
+    return notes[np.argsort(notes[:, 2], kind='stable')], pedals, buffered
+
+
+def test_streaming_matches_whole_output_dict():
+    for seed in range(2):
+        output_dict = make_output_dict(6000, seed)
+        (est_notes, est_pedals) = make_post_processor().output_dict_to_note_pedal_arrays(output_dict)
+        for chunk in (1, 37, 1000):
+            (notes, pedals, _) = stream(output_dict, chunk)
+            assert np.array_equal(notes, est_notes)
+            assert np.array_equal(pedals, est_pedals)
+
+
+def test_held_pedal_does_not_grow_the_buffer():
+    output_dict = make_output_dict(6000, 0)
+    output_dict['pedal_frame_output'][5:] = 0.9
+    (_, _, buffered) = stream(output_dict, 100)
+    assert buffered < 200
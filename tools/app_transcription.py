@@ -1,7 +1,5 @@
 import os
-import time
 import torch
-import librosa
 import threading
 import traceback
 import tkinter as tk
@@ -11,16 +9,23 @@ import sys
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from libs.piano_transcription_inference import PianoTranscription, sample_rate
+from libs.piano_transcription_inference.service import get_service
+from libs.piano_transcription_inference.batch import BatchTranscriber, find_audio_files
 
 
 class PianoTranscriptionApp:
     def __init__(self, root):
         self.root = root
         self.root.title("MP3转录MID")
-        self.root.geometry("500x300")
+        self.root.geometry("500x432")
 
         self.var_cuda = tk.BooleanVar()
+        self.var_batch = tk.StringVar(value="auto")
+        self.var_backend = tk.StringVar(value="torch")
+        self.var_stream = tk.BooleanVar()
+        self.var_cpu_fast = tk.BooleanVar()
+        self.var_skip_silence = tk.BooleanVar()
+        self.service = get_service()
         self._create_widgets()
 
     def _create_widgets(self):
@@ -42,6 +47,23 @@ class PianoTranscriptionApp:
 
         # CUDA 选项
         ttk.Checkbutton(self.root, text="尝试使用CUDA加速", variable=self.var_cuda).pack()
+        # CPU 快速模式：GRU/Linear 动态 int8 量化（精度略降，见 tools/bench_cpu_fast.py）
+        ttk.Checkbutton(self.root, text="CPU快速模式（int8量化）", variable=self.var_cpu_fast).pack()
+        # 流式：边解码边推理，内存不随音频时长增长（适合长录音）
+        ttk.Checkbutton(self.root, text="流式转录（长音频低内存）", variable=self.var_stream).pack()
+        # 跳过静音：整段低于 -60 dBFS 的分段不运行模型（片头片尾、曲间静音多时更快）
+        ttk.Checkbutton(self.root, text="跳过静音段", variable=self.var_skip_silence).pack()
+
+        # 批大小（auto 按可用内存自动选择）
+        frame_batch = ttk.Frame(self.root)
+        frame_batch.pack(pady=2)
+        ttk.Label(frame_batch, text="批大小:").pack(side=tk.LEFT)
+        ttk.Combobox(frame_batch, width=6, state="readonly", textvariable=self.var_batch,
+                     values=["auto", "1", "2", "4", "8", "16"]).pack(side=tk.LEFT, padx=2)
+        # 推理后端：torchscript / onnxruntime 首次使用时导出并缓存到模型旁
+        ttk.Label(frame_batch, text="后端:").pack(side=tk.LEFT, padx=(8, 0))
+        ttk.Combobox(frame_batch, width=11, state="readonly", textvariable=self.var_backend,
+                     values=["torch", "torchscript", "onnxruntime"]).pack(side=tk.LEFT, padx=2)
         self.label_device = ttk.Label(self.root, text="当前设备：未检测")
         self.label_device.pack(pady=2)
 
@@ -51,7 +73,10 @@ class PianoTranscriptionApp:
 
         # 开始按钮
         self.btn_start = ttk.Button(self.root, text="开始转录", command=self.start_transcription)
-        self.btn_start.pack(pady=10)
+        self.btn_start.pack(pady=(10, 2))
+        # 批量：解码/推理/写出流水线并行，可断点续跑（输出到所选文件夹）
+        self.btn_batch = ttk.Button(self.root, text="批量转录文件夹", command=self.start_batch)
+        self.btn_batch.pack(pady=2)
 
     def open_file(self):
         path = filedialog.askopenfilename(filetypes=[("Audio Files", "*.mp3 *.wav")])
@@ -75,6 +100,12 @@ class PianoTranscriptionApp:
         audio_path = self.entry_audio.get()
         midi_path = self.entry_midi.get()
         use_cuda = self.var_cuda.get()
+        batch_size = self.var_batch.get()
+        batch_size = batch_size if batch_size == "auto" else int(batch_size)
+        stream = self.var_stream.get()
+        cpu_fast = self.var_cpu_fast.get()
+        backend = self.var_backend.get()
+        skip_silence = self.var_skip_silence.get()
 
         if not audio_path or not os.path.exists(audio_path):
             messagebox.showerror("错误", "请选择一个有效的音频文件")
@@ -85,49 +116,112 @@ class PianoTranscriptionApp:
 
         # 检测设备
         device = 'cuda' if use_cuda and torch.cuda.is_available() else 'cpu'
-        self.label_device.config(text=f"当前设备：{'GPU (CUDA)' if device == 'cuda' else 'CPU'}")
+        # int8 动态量化只用于 torch 后端
+        dtype = 'int8' if cpu_fast and device == 'cpu' and backend == 'torch' else 'float32'
+        self.label_device.config(text=f"当前设备：{'GPU (CUDA)' if device == 'cuda' else 'CPU'}"
+                                      f"{'（int8 快速模式）' if dtype == 'int8' else ''}")
 
-        # 禁用按钮并更新状态
+        # 禁用按钮并更新状态（转录期间也不能开始批量任务）
         self.btn_start.config(state=tk.DISABLED)
+        self.btn_batch.config(state=tk.DISABLED)
         self.label_status.config(text="正在转录，请稍候...")
 
         # 使用线程避免 UI 卡死
         threading.Thread(target=self.run_inference,
-                         args=(audio_path, midi_path, device),
+                         args=(audio_path, midi_path, device, batch_size, stream, dtype, backend, skip_silence),
                          daemon=True).start()
 
-    def run_inference(self, audio_path, output_midi_path, device):
-        try:
-            self.root.after(0, lambda: self.label_status.config(text="正在加载音频..."))
-            audio, _ = librosa.load(path=audio_path, sr=sample_rate, mono=True)
+    def start_batch(self):
+        folder = filedialog.askdirectory(title="选择音频文件夹")
+        if not folder:
+            return
+        audio_paths = find_audio_files(folder)
+        if not audio_paths:
+            messagebox.showerror("错误", "文件夹中没有音频文件")
+            return
 
-            self.root.after(0, lambda: self.label_status.config(text="正在推理..."))
-            transcriptor = PianoTranscription(
-                device=device,
-                gui_callback=lambda msg: self.root.after(0, lambda: self.label_status.config(text=msg))
-            )
+        batch_size = self.var_batch.get()
+        batch_size = batch_size if batch_size == "auto" else int(batch_size)
+        device = 'cuda' if self.var_cuda.get() and torch.cuda.is_available() else 'cpu'
+        backend = self.var_backend.get()
+        dtype = 'int8' if self.var_cpu_fast.get() and device == 'cpu' and backend == 'torch' else 'float32'
+
+        self.btn_start.config(state=tk.DISABLED)
+        self.btn_batch.config(state=tk.DISABLED)
+        self.label_status.config(text=f"批量转录 {len(audio_paths)} 个文件...")
+        threading.Thread(target=self.run_batch,
+                         args=(folder, audio_paths, device, batch_size, dtype, backend, self.var_skip_silence.get()),
+                         daemon=True).start()
+
+    def run_batch(self, folder, audio_paths, device, batch_size, dtype, backend, skip_silence=False):
+        finished = []
 
-            start_time = time.time()
-            transcriptor.transcribe(audio, output_midi_path, gui_callback=self.update_progress)
-            elapsed_time = time.time() - start_time
+        def on_file(record):
+            finished.append(record)
+            name = os.path.basename(record['audio_path'])
+            state = "完成" if record['status'] == 'done' else "失败"
+            self.root.after(0, lambda: self.label_status.config(
+                text=f"[{len(finished)}/{len(audio_paths)}] {state}：{name}"))
 
-            self.root.after(0, lambda: self.on_inference_done(elapsed_time, output_midi_path))
+        try:
+            transcriptor, _ = self.service.get_model(
+                device, dtype=dtype, backend=backend,
+                status_callback=lambda msg: self.root.after(0, lambda: self.label_status.config(text=msg)))
+            batch = BatchTranscriber(transcriptor, folder, batch_size=batch_size, file_callback=on_file,
+                                     skip_silence=skip_silence)
+            report = batch.run(audio_paths, root=folder)
+            self.root.after(0, lambda: self.on_batch_done(report, batch.report_path))
+        except Exception:
+            self.root.after(0, lambda err=traceback.format_exc(): self.on_inference_error(err))
+
+    def on_batch_done(self, report, report_path):
+        self.label_status.config(text="批量转录完成！")
+        self.btn_start.config(state=tk.NORMAL)
+        self.btn_batch.config(state=tk.NORMAL)
+        t = report['total']
+        failures = "".join(f"\n{os.path.basename(r['audio_path'])}: {r['error']}" for r in report['failures'][:10])
+        messagebox.showinfo("完成", f"完成 {t['done']}，失败 {t['failed']}，跳过（已完成）{t['skipped']}\n"
+                                    f"音频 {t['audio_seconds']:.1f} 秒，用时 {t['wall_seconds']:.1f} 秒，"
+                                    f"RTF {t['rtf']:.3f}\n报告: {report_path}{failures}")
+
+    def run_inference(self, audio_path, output_midi_path, device, batch_size="auto", stream=False, dtype='float32',
+                      backend='torch', skip_silence=False):
+        job = None
+        try:
+            # 模型常驻在服务中：同一 (设备, 模型, 精度, 后端) 只在第一次转录时加载
+            job = self.service.submit(
+                audio_path, output_midi_path, device=device, dtype=dtype, backend=backend, batch_size=batch_size,
+                stream=stream, skip_silence=skip_silence,
+                progress_callback=self.update_progress,
+                status_callback=lambda msg: self.root.after(0, lambda: self.label_status.config(text=msg))
+            )
+            depth = self.service.queue_depth()
+            if depth > 1:
+                self.root.after(0, lambda: self.label_status.config(text=f"排队中，前面还有 {depth - 1} 个任务..."))
+            job.result()
+            self.root.after(0, lambda: self.on_inference_done(job.timing(), output_midi_path))
         except Exception as e:
-            # 捕获完整异常信息
-            tb_str = traceback.format_exc()
+            # 捕获完整异常信息（优先使用工作线程中的堆栈）
+            tb_str = job.traceback if job is not None and job.traceback else traceback.format_exc()
             self.root.after(0, lambda err=tb_str: self.on_inference_error(err))
 
-    def on_inference_done(self, elapsed_time, output_path):
+    def on_inference_done(self, timing, output_path):
         self.label_status.config(text="转录完成！")
         self.btn_start.config(state=tk.NORMAL)
-        messagebox.showinfo("完成", f"转录完成！耗时 {elapsed_time:.2f} 秒\n输出: {output_path}")
+        self.btn_batch.config(state=tk.NORMAL)
+        load = f"{timing['load_seconds']:.2f} 秒" if timing['load_seconds'] else "已缓存"
+        messagebox.showinfo("完成", f"转录完成！耗时 {timing['total_seconds']:.2f} 秒"
+                                    f"（模型加载 {load}，解码 {timing['decode_seconds']:.2f} 秒，"
+                                    f"推理 {timing['infer_seconds']:.2f} 秒）\n输出: {output_path}")
 
     def on_inference_error(self, error):
         self.label_status.config(text="发生错误")
         self.btn_start.config(state=tk.NORMAL)
+        self.btn_batch.config(state=tk.NORMAL)
         messagebox.showerror("错误", f"推理时出错:\n{error}")
 
     def update_progress(self, current, total, elapsed, rate):
+        current = min(current, total)  # 流式模式下总段数由估计时长得出
         percent = int((current / total) * 100)
         eta = (total - current) / rate if rate else 0
         self.root.after(0, lambda: self._update_progress_ui(percent, elapsed, eta))
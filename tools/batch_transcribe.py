@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""批量转录文件夹中的音频为 MIDI：解码、推理、后处理写出三段流水线并行。
+
+解码线程预取后续文件，模型推理当前文件的同时，写出线程对上一个文件做后处理并写出 MIDI。
+完成的文件记录在输出目录的 batch_state.jsonl 中，中断后重新运行会跳过已完成的文件、
+重试失败的文件；每次运行结束写出 batch_report.json（逐文件耗时、总吞吐与失败列表）。
+
+用法：
+    python tools/batch_transcribe.py songs/ --output_dir out/
+    python tools/batch_transcribe.py songs/ --recursive --cuda --no_pedal
+"""
+import os
+import sys
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from libs.piano_transcription_inference.service import get_service
+from libs.piano_transcription_inference.batch import BatchTranscriber, find_audio_files
+from utils.midi2lrcp import mappable_pitches
+
+
+def print_record(record):
+    if record['status'] == 'done':
+        print(f"[完成] {record['audio_path']} -> {record['midi_path']}：{record['notes']} 个音符，"
+              f"音频 {record['audio_seconds']:.1f}s；解码 {record['decode_seconds']:.2f}s，"
+              f"推理 {record['infer_seconds']:.2f}s，写出 {record['write_seconds']:.2f}s")
+    else:
+        print(f"[失败] {record['audio_path']}: {record['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量音频 -> MIDI 转录（解码/推理/写出流水线，可断点续跑）")
+    parser.add_argument('folder', help='音频文件夹')
+    parser.add_argument('--output_dir', type=str, default=None, help='输出目录（默认与输入文件夹相同）')
+    parser.add_argument('--recursive', action='store_true', help='包含子文件夹（输出保持相同的目录结构）')
+    parser.add_argument('--no_resume', action='store_true', help='不跳过之前已完成的文件')
+    parser.add_argument('--queue_size', type=int, default=2, help='各阶段之间最多排队的文件数（限制内存）')
+    parser.add_argument('--cuda', action='store_true', help='可用时使用 CUDA')
+    parser.add_argument('--dtype', choices=['float32', 'float16', 'bfloat16', 'int8'], default='float32',
+                        help='模型精度；int8 为 CPU 快速模式（GRU/Linear 动态量化）')
+    parser.add_argument('--backend', choices=['torch', 'torchscript', 'onnxruntime'], default='torch')
+    parser.add_argument('--batch_size', type=str, default='auto', help='批大小，整数或 auto')
+    parser.add_argument('--overlap', type=float, default=None, help='相邻分段重叠比例（默认 0.5）')
+    parser.add_argument('--skip_silence', action='store_true', help='整段低于静音阈值的分段不运行模型，输出置零')
+    parser.add_argument('--no_pedal', action='store_true', help='只转录音符，不加载、不运行踏板模型')
+    parser.add_argument('--pitch_margin', type=int, default=None,
+                        help='只后处理 NOTE_MAP 中可演奏的音高及上下各 N 个半音（默认处理全部 88 键）')
+    parser.add_argument('--workers', type=int, default=1, help='CPU 多进程分片推理的进程数')
+    args = parser.parse_args()
+
+    device = 'cpu'
+    if args.cuda:
+        import torch
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    batch_size = args.batch_size if args.batch_size == 'auto' else int(args.batch_size)
+
+    audio_paths = find_audio_files(args.folder, recursive=args.recursive)
+    if not audio_paths:
+        print(f"{args.folder} 中没有音频文件")
+        sys.exit(1)
+
+    transcriptor, load_seconds = get_service().get_model(device, dtype=args.dtype, backend=args.backend,
+                                                         pedal=not args.no_pedal, workers=args.workers,
+                                                         status_callback=print)
+    print(f"模型加载 {load_seconds:.2f}s，共 {len(audio_paths)} 个音频文件")
+
+    batch = BatchTranscriber(transcriptor, args.output_dir or args.folder, queue_size=args.queue_size,
+                             batch_size=batch_size, overlap=args.overlap,
+                             pitches=None if args.pitch_margin is None else mappable_pitches(args.pitch_margin),
+                             file_callback=print_record, skip_silence=args.skip_silence)
+    report = batch.run(audio_paths, root=args.folder, resume=not args.no_resume)
+    get_service().unload()
+
+    t = report['total']
+    print(f"合计：完成 {t['done']}，失败 {t['failed']}，跳过（已完成）{t['skipped']}；"
+          f"音频 {t['audio_seconds']:.1f}s，用时 {t['wall_seconds']:.1f}s，RTF {t['rtf']:.3f}，"
+          f"{t['files_per_minute']:.1f} 个文件/分钟；"
+          f"各阶段累计 解码 {t['decode_seconds']:.1f}s / 推理 {t['infer_seconds']:.1f}s / 写出 {t['write_seconds']:.1f}s")
+    if report['failures']:
+        print(f"失败列表见 {batch.report_path}：")
+        for record in report['failures']:
+            print(f"  {record['audio_path']}: {record['error']}")
+    sys.exit(2 if report['failures'] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""CPU 快速模式基准：fp32 与 int8 动态量化（PianoTranscription(cpu_fast=True)）对比。
+
+输出两种模式的实时率（RTF = 推理耗时 / 音频时长，越小越快），以及 int8 相对 fp32
+结果的音符级 P/R/F1（起音容差 50ms，音高一致）。未指定 --audio 时，用 example/mid
+中的 MIDI 合成一段简单的钢琴音色作为固定测试样本。
+
+用法：
+    python tools/bench_cpu_fast.py                          # 默认：卡农.mid 前 30 秒
+    python tools/bench_cpu_fast.py --audio song.mp3 --seconds 60
+    python tools/bench_cpu_fast.py --threads 4              # 覆盖 config.intra_op_threads
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from libs.piano_transcription_inference import config
+
+DEFAULT_MIDI = os.path.join(os.path.dirname(__file__), "..", "example", "mid", "卡农.mid")
+
+
+def synthesize_piano(notes, sr, seconds):
+    """把 (start, end, pitch, velocity) 合成为类钢琴音色：前 6 个谐波 + 指数衰减 + 释音。"""
+    audio = np.zeros(int(seconds * sr), dtype=np.float32)
+    for start, end, pitch, velocity in notes:
+        if start >= seconds:
+            continue
+        freq = 440.0 * 2 ** ((pitch - 69) / 12)
+        length = int((min(end, seconds) - start + 0.3) * sr)
+        t = np.arange(length) / sr
+        wave = sum(np.sin(2 * np.pi * freq * h * t) / h ** 1.5 for h in range(1, 7) if freq * h < sr / 2)
+        env = np.exp(-t * 2.5)
+        env[int((end - start) * sr):] *= np.exp(-np.arange(length - int((end - start) * sr)) / (0.05 * sr))
+        bgn = int(start * sr)
+        seg = (wave * env * (velocity / 127) * 0.1).astype(np.float32)
+        seg = seg[:len(audio) - bgn]
+        audio[bgn:bgn + len(seg)] += seg
+    peak = np.abs(audio).max()
+    return audio / peak * 0.5 if peak > 0 else audio
+
+
+def note_prf(ref_events, est_events, onset_tolerance=0.05):
+    """音符级 precision / recall / F1：同音高、起音差 <= onset_tolerance 的一对一贪心匹配。"""
+    by_pitch = {}
+    for e in ref_events:
+        by_pitch.setdefault(e['midi_note'], []).append(e['onset_time'])
+    for onsets in by_pitch.values():
+        onsets.sort()
+    used = {p: [False] * len(v) for p, v in by_pitch.items()}
+
+    matched = 0
+    for e in sorted(est_events, key=lambda e: e['onset_time']):
+        onsets = by_pitch.get(e['midi_note'], [])
+        best = None
+        for i, onset in enumerate(onsets):
+            if not used[e['midi_note']][i] and abs(onset - e['onset_time']) <= onset_tolerance:
+                if best is None or abs(onset - e['onset_time']) < abs(onsets[best] - e['onset_time']):
+                    best = i
+        if best is not None:
+            used[e['midi_note']][best] = True
+            matched += 1
+
+    precision = matched / len(est_events) if est_events else 0.0
+    recall = matched / len(ref_events) if ref_events else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f1
+
+
+def load_fixture(args):
+    if args.audio:
+        import librosa
+        audio, _ = librosa.load(args.audio, sr=config.sample_rate, mono=True, duration=args.seconds)
+        return audio, os.path.basename(args.audio)
+
+    from utils.midi_reader import read_instrument_notes
+    notes = read_instrument_notes(args.midi)
+    notes = list(zip(notes['start'].tolist(), notes['end'].tolist(), notes['pitch'].tolist(),
+                     notes['velocity'].tolist()))
+    return synthesize_piano(notes, config.sample_rate, args.seconds), f"{os.path.basename(args.midi)}（合成）"
+
+
+def run(audio, cpu_fast, checkpoint_path, batch_size):
+    from libs.piano_transcription_inference import PianoTranscription
+    transcriptor = PianoTranscription(checkpoint_path=checkpoint_path, device='cpu', batch_size=batch_size,
+                                      cpu_fast=cpu_fast)
+    t0 = time.perf_counter()
+    transcribed = transcriptor.transcribe(audio, None)
+    return time.perf_counter() - t0, transcribed['est_note_events']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--audio', type=str, default=None, help='测试音频（默认由 --midi 合成）')
+    parser.add_argument('--midi', type=str, default=DEFAULT_MIDI, help='合成测试音频用的 MIDI')
+    parser.add_argument('--seconds', type=float, default=30., help='测试时长（秒）')
+    parser.add_argument('--checkpoint', type=str, default=None, help='模型路径（默认 models/ 下，缺失时自动下载）')
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=None, help='intra-op 线程数（覆盖 config）')
+    parser.add_argument('--interop_threads', type=int, default=None, help='inter-op 线程数（覆盖 config）')
+    args = parser.parse_args()
+
+    if args.threads:
+        config.intra_op_threads = args.threads
+    if args.interop_threads:
+        config.inter_op_threads = args.interop_threads
+    # fp32 与 int8 使用相同线程数，只比较量化本身
+    from libs.piano_transcription_inference.pytorch_utils import configure_cpu_threads
+    intra, inter = configure_cpu_threads(config.intra_op_threads, config.inter_op_threads)
+    print(f"线程: intra-op {intra}，inter-op {inter}")
+
+    audio, name = load_fixture(args)
+    duration = len(audio) / config.sample_rate
+    print(f"样本: {name}，{duration:.1f}s")
+
+    t_fp32, fp32_events = run(audio, False, args.checkpoint, args.batch_size)
+    t_int8, int8_events = run(audio, True, args.checkpoint, args.batch_size)
+
+    print(f"fp32: {t_fp32:.2f}s，RTF {t_fp32 / duration:.3f}，音符 {len(fp32_events)}")
+    print(f"int8: {t_int8:.2f}s，RTF {t_int8 / duration:.3f}，音符 {len(int8_events)}，加速 {t_fp32 / t_int8:.2f}x")
+    precision, recall, f1 = note_prf(fp32_events, int8_events)
+    print(f"int8 相对 fp32：P {precision:.4f}  R {recall:.4f}  F1 {f1:.4f}")
+
+
+if __name__ == "__main__":
+    main()
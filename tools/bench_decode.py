@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""对比转录输入的解码 + 重采样到 16 kHz 单声道的耗时（按每分钟音频计）。
+
+对比项：librosa.load、librosa.load(res_type='kaiser_best')（需安装 resampy）、
+decode_audio（预分配缓冲 + soxr 一次重采样 / ffmpeg 直接输出 16 kHz）及其 MQ 质量、
+流式 stream_audio。同时给出与 librosa.load 结果的最大差值。
+
+用法：
+    python tools/bench_decode.py                      # 自动生成 60 秒 44.1 kHz 立体声 wav/flac/mp3 测试
+    python tools/bench_decode.py song.mp3 --repeat 5
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import librosa
+from libs.piano_transcription_inference import config
+from libs.piano_transcription_inference.streaming import decode_audio, stream_audio
+
+
+def synthesize_files(folder, seconds=60., sr=44100):
+    """生成立体声测试音频（wav/flac，及 libsndfile 支持时的 mp3）。"""
+    import soundfile
+
+    t = np.arange(int(seconds * sr)) / sr
+    y = 0.2 * np.stack([np.sin(2 * np.pi * 440 * t), np.sin(2 * np.pi * 660 * t)], axis=1)
+    y += 0.01 * np.random.RandomState(0).randn(*y.shape)
+    paths = []
+    for ext in ('wav', 'flac', 'mp3'):
+        if ext.upper() == 'MP3' and 'MP3' not in soundfile.available_formats():
+            continue
+        path = os.path.join(folder, 'bench.' + ext)
+        soundfile.write(path, y.astype(np.float32), sr)
+        paths.append(path)
+    return paths
+
+
+def best_time(fn, repeat):
+    """返回 (最快一次耗时秒, 结果)。"""
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', nargs='*', help='音频文件（默认自动生成测试音频）')
+    parser.add_argument('--repeat', type=int, default=3, help='每项重复次数，取最快一次')
+    args = parser.parse_args()
+
+    sr = config.sample_rate
+    methods = [
+        ('librosa.load', lambda p: librosa.load(p, sr=sr, mono=True)[0]),
+        ('decode_audio', lambda p: decode_audio(p, sr=sr)),
+        ('decode_audio MQ', lambda p: decode_audio(p, sr=sr, quality='MQ')),
+        ('stream_audio', lambda p: np.concatenate(list(stream_audio(p, sr=sr)))),
+    ]
+    try:
+        import resampy  # noqa: F401
+        methods.insert(1, ('librosa kaiser_best',
+                           lambda p: librosa.load(p, sr=sr, mono=True, res_type='kaiser_best')[0]))
+    except ImportError:
+        print('未安装 resampy，跳过 kaiser_best')
+
+    with tempfile.TemporaryDirectory() as folder:
+        files = args.files or synthesize_files(folder)
+        # 预热 librosa / soxr 的导入与初始化
+        librosa.load(files[0], sr=sr, mono=True, duration=1.)
+
+        print(f"{'文件':<20}{'方法':<22}{'耗时/分钟音频':>14}{'加速':>8}{'最大差值':>12}")
+        for path in files:
+            reference = None
+            for name, fn in methods:
+                seconds, y = best_time(lambda: fn(path), args.repeat)
+                per_minute = seconds / (len(y) / sr / 60)
+                if reference is None:
+                    (reference, reference_per_minute) = (y, per_minute)
+                n = min(len(y), len(reference))
+                diff = float(np.max(np.abs(y[: n] - reference[: n]))) if n else 0.
+                print(f"{os.path.basename(path)[:18]:<20}{name:<22}{per_minute * 1e3:>12.1f}ms"
+                      f"{reference_per_minute / per_minute:>7.2f}x{diff:>12.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""对比 utils.midi_reader.read_midi_notes 与 pretty_midi.PrettyMIDI 的加载耗时与内存峰值。
+
+用法：
+    python tools/bench_midi_reader.py                 # 默认测试 example/mid 下全部 MIDI
+    python tools/bench_midi_reader.py a.mid b.mid --repeat 10
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+import tracemalloc
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import pretty_midi
+from utils.midi_reader import read_midi_notes
+from utils.midi2lrcp import midi_to_note_blocks
+
+
+def measure(fn, repeat):
+    """返回 (最快一次耗时秒, tracemalloc 内存峰值字节, 结果)。"""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, result
+
+
+def main():
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', nargs='*', help='MIDI 文件（默认 example/mid/*.mid）')
+    parser.add_argument('--repeat', type=int, default=5, help='每个文件重复次数，取最快一次')
+    args = parser.parse_args()
+    files = args.files or sorted(glob.glob(os.path.join(root, 'example', 'mid', '*.mid')))
+
+    print(f"{'文件':<28}{'音符':>7}{'pretty_midi':>14}{'mido reader':>14}{'加速':>8}{'内存(PM/reader)':>20}  结果一致")
+    for path in files:
+        t_pm, m_pm, pm = measure(lambda: pretty_midi.PrettyMIDI(path), args.repeat)
+        t_rd, m_rd, notes = measure(lambda: read_midi_notes(path), args.repeat)
+        same = sorted(midi_to_note_blocks(pm)) == sorted(midi_to_note_blocks(notes))
+        name = os.path.basename(path)
+        print(f"{name[:26]:<28}{len(notes):>7}{t_pm * 1e3:>12.1f}ms{t_rd * 1e3:>12.1f}ms{t_pm / t_rd:>7.2f}x"
+              f"{m_pm / 1e6:>10.2f}/{m_rd / 1e6:.2f} MB  {'是' if same else '否'}")
+
+
+if __name__ == "__main__":
+    main()
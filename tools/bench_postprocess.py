@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""转录后处理基准：对比 RegressionPostProcessor 向量化实现与逐帧循环参考实现，
+以及稀疏事件的音符/踏板检测与 piano_vad 中的逐帧参考实现。
+
+用法：
+    python tools/bench_postprocess.py                 # 默认 5 分钟、100 帧/秒
+    python tools/bench_postprocess.py --minutes 1 --seed 1
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from libs.piano_transcription_inference import config
+from libs.piano_transcription_inference.utilities import RegressionPostProcessor
+from libs.piano_transcription_inference.piano_vad import (note_detection_with_onset_offset_regress,
+    pedal_detection_with_onset_offset_regress, notes_detection_with_onset_offset_regress_fast,
+    pedal_detection_with_onset_offset_regress_fast)
+
+
+def synthetic_regression(frames_num, classes_num, notes_per_class, rng):
+    """生成类似模型回归输出的曲线：随机位置的三角形峰 + 少量噪声（float32）。"""
+    x = rng.random((frames_num, classes_num), dtype=np.float32) * 0.05
+    width = 5
+    ramp = np.concatenate((np.linspace(0.2, 1., width), np.linspace(1., 0.2, width)[1:])).astype(np.float32)
+    for k in range(classes_num):
+        for center in rng.integers(width, frames_num - width, notes_per_class):
+            peak = rng.uniform(0.2, 1.)
+            seg = slice(center - width + 1, center + width)
+            x[seg, k] = np.maximum(x[seg, k], ramp * peak)
+    return x
+
+
+def synthetic_frame(onset_output, offset_output, rng):
+    """由二值化起止生成帧级激活：起音后保持到下一个止音附近。"""
+    active = np.cumsum(onset_output, axis=0) - np.cumsum(offset_output, axis=0)
+    frame = (active > 0).astype(np.float32) * 0.9
+    return frame + rng.random(frame.shape, dtype=np.float32) * 0.05
+
+
+def tuples_equal(a, b):
+    return len(a) == len(b) and all(
+        len(x) == len(y) and all(u == v or (u != u and v != v) for u, v in zip(x, y)) for x, y in zip(a, b))
+
+
+def array_equal(a, b):
+    return a.dtype == b.dtype and np.array_equal(a, b, equal_nan=True)
+
+
+def timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return time.perf_counter() - t0, out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--minutes', type=float, default=5., help='模拟音频时长（分钟）')
+    parser.add_argument('--notes_per_class', type=int, default=40, help='每个音高的峰值个数')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    frames_num = int(args.minutes * 60 * config.frames_per_second)
+    reg_output = synthetic_regression(frames_num, config.classes_num, args.notes_per_class, rng)
+
+    processor = RegressionPostProcessor(config.frames_per_second, classes_num=config.classes_num,
+        onset_threshold=0.3, offset_threshold=0.3, frame_threshold=0.1, pedal_offset_threshold=0.2)
+
+    print(f"帧数 {frames_num} x {config.classes_num} 类")
+    for neighbour in (2, 4):
+        t_loop, (b_loop, s_loop) = timed(processor.get_binarized_output_from_regression_loop,
+                                         reg_output, 0.3, neighbour)
+        t_vec, (b_vec, s_vec) = timed(processor.get_binarized_output_from_regression,
+                                      reg_output, 0.3, neighbour)
+        same = array_equal(b_loop, b_vec) and array_equal(s_loop, s_vec)
+        print(f"binarize neighbour={neighbour}: 循环 {t_loop:.3f}s，向量化 {t_vec:.4f}s，"
+              f"加速 {t_loop / t_vec:.0f}x，逐位一致: {'是' if same else '否'}")
+
+    # ------ 音符检测 ------
+    (onset_output, onset_shift_output) = processor.get_binarized_output_from_regression(reg_output, 0.3, 2)
+    offset_reg = np.roll(reg_output, 30, axis=0)
+    (offset_output, offset_shift_output) = processor.get_binarized_output_from_regression(offset_reg, 0.3, 4)
+    frame_output = synthetic_frame(onset_output, offset_output, rng)
+    velocity_output = rng.random(frame_output.shape, dtype=np.float32)
+    args_2d = (frame_output, onset_output, onset_shift_output, offset_output, offset_shift_output, velocity_output)
+
+    def reference_notes():
+        return [note_detection_with_onset_offset_regress(*[a[:, k] for a in args_2d], frame_threshold=0.1)
+                for k in range(config.classes_num)]
+
+    t_ref, ref = timed(reference_notes)
+    t_fast, fast = timed(notes_detection_with_onset_offset_regress_fast, *args_2d, frame_threshold=0.1)
+    same = all(tuples_equal(r, f) for r, f in zip(ref, fast))
+    print(f"音符检测: 逐帧 {t_ref:.3f}s，稀疏事件 {t_fast:.4f}s，加速 {t_ref / t_fast:.0f}x，"
+          f"音符 {sum(map(len, ref))}，结果一致: {'是' if same else '否'}")
+
+    # ------ 踏板检测 ------
+    pedal_frame = np.clip(np.cumsum(rng.normal(0, 0.1, frames_num)), 0, 1).astype(np.float32)
+    pedal_offset = (rng.random(frames_num) < 0.01).astype(np.float32)
+    pedal_args = (pedal_frame, pedal_offset, offset_shift_output[:, 0])
+    t_ref, ref = timed(pedal_detection_with_onset_offset_regress, *pedal_args, frame_threshold=0.5)
+    t_fast, fast = timed(pedal_detection_with_onset_offset_regress_fast, *pedal_args, frame_threshold=0.5)
+    print(f"踏板检测: 逐帧 {t_ref:.4f}s，稀疏事件 {t_fast:.4f}s，加速 {t_ref / t_fast:.0f}x，"
+          f"踏板 {len(ref)}，结果一致: {'是' if tuples_equal(ref, fast) else '否'}")
+
+
+if __name__ == "__main__":
+    main()
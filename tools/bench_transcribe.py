@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""转录基准套件：用 NumPy 从已知音符列表合成类钢琴音频（无需下载），按多个时长
+测量各阶段耗时与实时率，并计算相对真值的音符级 P/R/F1。
+
+各阶段：解码重采样（decode_audio）、log-mel、模型前向、推理合计、后处理（含 MIDI 写出）、
+MIDI 写出；耗时由 Profiler 记录（见 libs/piano_transcription_inference/profiling.py）。
+RTF = 端到端耗时 / 音频时长，越小越快。音符匹配：同音高、起音差 <= 50ms。
+
+未指定 --checkpoint 时使用固定随机种子初始化的模型：耗时有效，P/R 没有绝对意义，但结果
+可复现，配合 --baseline 可发现性能改动导致的输出变化；指定真实模型时 P/R 即为准确率。
+
+用法：
+    python tools/bench_transcribe.py                                   # 随机模型，10/30/60 秒
+    python tools/bench_transcribe.py --checkpoint models/note_F13D0.9186.pth --durations 30 120
+    python tools/bench_transcribe.py --output before.json              # 保存结果
+    python tools/bench_transcribe.py --baseline before.json            # 与之前结果对比，退化时返回 1
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from libs.piano_transcription_inference import config
+from libs.piano_transcription_inference.profiling import Profiler
+from tools.bench_cpu_fast import synthesize_piano, note_prf
+
+# (报告中的列名, Profiler 中的 span 名)
+STAGES = [
+    ('decode', 'decode_audio'),
+    ('logmel', 'logmel'),
+    ('model', 'model'),
+    ('infer', 'PianoTranscription.infer'),
+    ('post', 'PianoTranscription.post_process'),
+    ('midi', 'write_events_to_midi'),
+]
+
+
+def random_notes(seconds, seed=0, notes_per_second=4.):
+    """生成可复现的音符列表 (start, end, pitch, velocity)：单音与三和弦混合，
+    音高集中在 36~96，时值 0.1~1.2 秒，结尾留 0.5 秒释音。"""
+    rng = np.random.RandomState(seed)
+    notes = []
+    t = 0.2
+    while t < seconds - 1.:
+        pitch = int(rng.randint(36, 97))
+        pitches = [pitch, pitch + 4, pitch + 7] if rng.rand() < 0.2 else [pitch]
+        duration = float(rng.uniform(0.1, 1.2))
+        velocity = int(rng.randint(40, 111))
+        for p in pitches:
+            if p <= 108:
+                notes.append((t, min(t + duration, seconds - 0.5), p, velocity))
+        t += float(rng.exponential(1. / notes_per_second)) + 0.05
+    return notes
+
+
+def random_checkpoint(folder, seed=0):
+    """保存随机初始化（固定种子）的 Note_pedal 模型，返回路径。未训练的模型各输出都在 0.5
+    附近、几乎每帧超过阈值，因此把输出层（各 sigmoid 之前的 Linear）的 bias 设为 -1，
+    使多数帧低于阈值，后处理与 MIDI 写出有一定工作量但不至于每帧都是音符。"""
+    import torch
+    from libs.piano_transcription_inference import models
+
+    torch.manual_seed(seed)
+    model = models.Note_pedal(frames_per_second=config.frames_per_second, classes_num=config.classes_num)
+    for module in model.modules():
+        if isinstance(module, torch.nn.Linear) and module.out_features in (config.classes_num, 1):
+            torch.nn.init.constant_(module.bias, -1.)
+    path = os.path.join(folder, f'random_seed{seed}.pth')
+    torch.save({'model': {'note_model': model.note_model.state_dict(),
+                          'pedal_model': model.pedal_model.state_dict()}}, path)
+    return path
+
+
+def write_fixture(folder, seconds, sr, seed):
+    """合成测试音频写为 wav，返回 (路径, 真值音符事件)。"""
+    import soundfile
+
+    notes = random_notes(seconds, seed=seed)
+    path = os.path.join(folder, f'fixture_{seconds:g}s.wav')
+    soundfile.write(path, synthesize_piano(notes, sr, seconds), sr)
+    events = [{'onset_time': start, 'offset_time': end, 'midi_note': pitch, 'velocity': velocity}
+              for start, end, pitch, velocity in notes]
+    return path, events
+
+
+def bench_one(transcriptor, audio_path, ref_events, seconds, midi_path, repeat):
+    """转录 repeat 次取端到端最快的一次，返回结果字典。"""
+    best = None
+    for _ in range(repeat):
+        with Profiler(transcriptor.model, module_depth=1) as profiler:
+            transcribed = transcriptor.transcribe_file(audio_path, midi_path)
+        totals = {entry['name']: entry['total_seconds'] for entry in profiler.summary()}
+        wall = sum(s['duration'] for s in profiler.spans
+                   if s['name'] in ('decode_audio', 'PianoTranscription.infer',
+                                    'PianoTranscription.post_process') and s['depth'] == 0)
+        if best is None or wall < best['wall_seconds']:
+            est_events = transcribed['est_note_events']
+            best = {'seconds': seconds, 'wall_seconds': wall, 'rtf': wall / seconds,
+                    'stages': {column: totals.get(name, 0.) for column, name in STAGES},
+                    'notes_ref': len(ref_events), 'notes_est': len(est_events),
+                    'skipped_fraction': transcribed['skipped_fraction']}
+    precision, recall, f1 = note_prf(ref_events, est_events)
+    best.update({'precision': precision, 'recall': recall, 'f1': f1})
+    return best
+
+
+def compare(results, baseline, max_f1_drop, max_slowdown):
+    """与基线逐时长对比，返回退化说明列表。"""
+    previous = {r['seconds']: r for r in baseline['results']}
+    problems = []
+    for r in results:
+        b = previous.get(r['seconds'])
+        if b is None:
+            continue
+        if b['f1'] - r['f1'] > max_f1_drop:
+            problems.append(f"{r['seconds']:g}s F1 {b['f1']:.4f} -> {r['f1']:.4f}")
+        if max_slowdown and r['rtf'] > b['rtf'] * max_slowdown:
+            problems.append(f"{r['seconds']:g}s RTF {b['rtf']:.3f} -> {r['rtf']:.3f}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--durations', type=float, nargs='+', default=[10., 30., 60.], help='测试音频时长（秒）')
+    parser.add_argument('--checkpoint', type=str, default=None, help='模型路径（默认随机初始化）')
+    parser.add_argument('--seed', type=int, default=0, help='音符与随机模型的种子')
+    parser.add_argument('--sr', type=int, default=44100, help='合成音频的采样率（含重采样耗时）')
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--cpu_fast', action='store_true', help='int8 动态量化')
+    parser.add_argument('--backend', choices=['torch', 'torchscript', 'onnxruntime'], default='torch')
+    parser.add_argument('--repeat', type=int, default=1, help='每个时长重复次数，取最快一次')
+    parser.add_argument('--output', type=str, default=None, help='把结果写入 JSON')
+    parser.add_argument('--baseline', type=str, default=None, help='与之前 --output 的结果对比')
+    parser.add_argument('--max_f1_drop', type=float, default=0.01, help='F1 下降超过该值视为退化')
+    parser.add_argument('--max_slowdown', type=float, default=None, help='RTF 变为基线的该倍数以上视为退化')
+    args = parser.parse_args()
+
+    from libs.piano_transcription_inference import PianoTranscription
+
+    with tempfile.TemporaryDirectory() as folder:
+        checkpoint_path = args.checkpoint or random_checkpoint(folder, args.seed)
+        transcriptor = PianoTranscription(checkpoint_path=checkpoint_path, device=args.device,
+                                          batch_size=args.batch_size, cpu_fast=args.cpu_fast,
+                                          backend=args.backend)
+        fixtures = [(seconds,) + write_fixture(folder, seconds, args.sr, args.seed) for seconds in args.durations]
+        midi_path = os.path.join(folder, 'out.mid')
+
+        # 预热：首次前向包含内存分配与算子初始化
+        transcriptor.transcribe_file(fixtures[0][1], None, events=False)
+
+        results = [bench_one(transcriptor, path, events, seconds, midi_path, args.repeat)
+                   for seconds, path, events in fixtures]
+
+    print(f"模型: {args.checkpoint or f'随机初始化 (seed {args.seed})'}，{transcriptor.precision()}，"
+          f"batch_size {args.batch_size}")
+    header = f"{'时长':>6}" + ''.join(f"{column:>9}" for column, _ in STAGES) + \
+        f"{'合计':>9}{'RTF':>8}{'P':>8}{'R':>8}{'F1':>8}{'音符':>11}"
+    print(header)
+    for r in results:
+        print(f"{r['seconds']:>5g}s" + ''.join(f"{r['stages'][column]:>8.2f}s" for column, _ in STAGES) +
+              f"{r['wall_seconds']:>8.2f}s{r['rtf']:>8.3f}{r['precision']:>8.3f}{r['recall']:>8.3f}"
+              f"{r['f1']:>8.3f}{r['notes_est']:>6}/{r['notes_ref']:<4}")
+
+    report = {'checkpoint': args.checkpoint, 'seed': args.seed, 'precision': transcriptor.precision(),
+              'batch_size': args.batch_size, 'results': results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            problems = compare(results, json.load(f), args.max_f1_drop, args.max_slowdown)
+        for problem in problems:
+            print(f"退化: {problem}")
+        if problems:
+            sys.exit(1)
+        print("与基线相比未发现退化")
+
+
+if __name__ == "__main__":
+    main()
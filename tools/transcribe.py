@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""命令行音频转 MIDI：所有文件提交到同一个常驻模型服务，模型只在第一个任务加载一次。
+
+用法：
+    python tools/transcribe.py song1.mp3 song2.mp3 --output_dir out/
+    python tools/transcribe.py long.mp3 --stream --batch_size 4 --cuda
+    python tools/transcribe.py song.mp3 --no_pedal --pitch_margin 2   # 只需 .lrcp 时
+    python tools/transcribe.py song.mp3 --cache_dir cache/            # 再次转录同一文件只做后处理
+    python tools/transcribe.py live.mp3 --skip_silence                # 不对静音分段运行模型
+    python tools/transcribe.py long.mp3 --workers 8                   # 多核 CPU：分段分给 8 个进程并行推理
+    python tools/transcribe.py song.mp3 --profile trace.json          # 各阶段/各子模型耗时，chrome://tracing 打开
+"""
+import os
+import sys
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from libs.piano_transcription_inference.service import get_service
+from libs.piano_transcription_inference.cache import StageCache
+from libs.piano_transcription_inference.profiling import Profiler
+from utils.midi2lrcp import mappable_pitches
+
+
+def output_midi_path(audio_path, output_dir=None):
+    stem = os.path.splitext(os.path.basename(audio_path))[0]
+    return os.path.join(output_dir or os.path.dirname(audio_path), stem + ".mid")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="音频 -> MIDI 转录（常驻模型，多文件只加载一次）")
+    parser.add_argument('inputs', nargs='+', help='音频文件（mp3/wav 等）')
+    parser.add_argument('--output_dir', type=str, default=None, help='输出目录（默认与输入同目录）')
+    parser.add_argument('--cuda', action='store_true', help='可用时使用 CUDA')
+    parser.add_argument('--dtype', choices=['float32', 'float16', 'bfloat16', 'int8'], default='float32',
+                        help='模型精度；int8 为 CPU 快速模式（GRU/Linear 动态量化）')
+    parser.add_argument('--backend', choices=['torch', 'torchscript', 'onnxruntime'], default='torch',
+                        help='推理后端；torchscript/onnxruntime 首次使用时导出到模型旁并与 torch 结果校验')
+    parser.add_argument('--batch_size', type=str, default='auto', help='批大小，整数或 auto')
+    parser.add_argument('--stream', action='store_true', help='流式转录（长音频低内存）')
+    parser.add_argument('--overlap', type=float, default=None,
+                        help='相邻分段重叠比例（默认 0.5；如 0.1 分段数约减半，接缝处略差）')
+    parser.add_argument('--skip_silence', action='store_true',
+                        help='整段低于静音阈值（默认 -60 dBFS）的分段不运行模型，输出置零（片头片尾/曲间静音多时更快）')
+    parser.add_argument('--no_pedal', action='store_true', help='只转录音符，不加载、不运行踏板模型')
+    parser.add_argument('--pitch_margin', type=int, default=None,
+                        help='只后处理 NOTE_MAP 中可演奏的音高及上下各 N 个半音（默认处理全部 88 键）')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='CPU 多进程分片推理的进程数（每个进程加载一份模型，建议不超过物理核数；流式转录不适用）')
+    parser.add_argument('--cache_dir', type=str, default=None,
+                        help='缓存解码波形与模型输出的目录（按音频内容、模型与精度索引，超出上限时淘汰最久未用）')
+    parser.add_argument('--profile', type=str, default=None,
+                        help='记录解码、STFT、各子模型、GRU、后处理、MIDI 写出等阶段耗时并写入该文件')
+    parser.add_argument('--profile_format', choices=['chrome', 'json'], default='chrome',
+                        help='chrome 为 Chrome trace（chrome://tracing / Perfetto 打开），json 为耗时列表与汇总')
+    args = parser.parse_args()
+
+    device = 'cpu'
+    if args.cuda:
+        import torch
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    batch_size = args.batch_size if args.batch_size == 'auto' else int(args.batch_size)
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    cache = StageCache(args.cache_dir) if args.cache_dir else None
+    service = get_service()
+    profiler = None
+    if args.profile:
+        # 先加载模型（之后的任务复用同一个），以便给各子模型挂上计时钩子
+        transcriptor, _ = service.get_model(device, dtype=args.dtype, backend=args.backend,
+                                            pedal=not args.no_pedal, workers=args.workers, status_callback=print)
+        profiler = Profiler(transcriptor.model).start()
+    jobs = [service.submit(path, output_midi_path(path, args.output_dir), device=device, dtype=args.dtype,
+                           batch_size=batch_size, stream=args.stream, status_callback=print, backend=args.backend,
+                           overlap=args.overlap, pedal=not args.no_pedal,
+                           pitches=None if args.pitch_margin is None else mappable_pitches(args.pitch_margin),
+                           cache=cache, workers=args.workers, skip_silence=args.skip_silence)
+            for path in args.inputs]
+    print(f"已提交 {len(jobs)} 个任务，队列深度 {service.queue_depth()}")
+
+    failed = 0
+    for job in jobs:
+        try:
+            transcribed = job.result()
+            t = job.timing()
+            skipped = f"（跳过静音段 {t['skipped_fraction']:.0%}）" if t['skipped_fraction'] else ''
+            print(f"[完成] {job.audio_path} -> {job.midi_path}：{len(transcribed['est_note_events'])} 个音符；"
+                  f"排队 {t['wait_seconds']:.2f}s，加载 {t['load_seconds']:.2f}s，解码 {t['decode_seconds']:.2f}s，"
+                  f"推理 {t['infer_seconds']:.2f}s{'（缓存命中：' + t['cached'] + '）' if t['cached'] else ''}"
+                  f"{skipped}，合计 {t['total_seconds']:.2f}s；剩余队列 {service.queue_depth()}")
+        except Exception as e:
+            failed += 1
+            print(f"[失败] {job.audio_path}: {type(e).__name__}: {e}")
+            if job.traceback:
+                print(job.traceback)
+    if profiler:
+        profiler.stop()
+        profiler.save(args.profile, format=args.profile_format)
+        print(profiler.format_summary())
+        print(f"耗时记录已写入 {args.profile}")
+    sys.exit(2 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""音频 -> LRCP 一站式转换。
+
+原流程为：转录写出 .mid -> 播放器再读入 .mid -> 转为 LRCP 文本 -> 解析为事件，
+中间经过两次文件序列化，且每个音符都要构造一个 dict。这里转录得到的音符始终保持为
+numpy 数组，直接生成 LRCP 文本或可供播放器使用的事件序列；MIDI 仅在指定时额外写出。
+时间不再经过 MIDI tick 量化，与经由 .mid 的结果可能相差 1~2 毫秒。
+
+用法：
+    python utils/audio2lrcp.py song.mp3                          # 输出 song.lrcp
+    python utils/audio2lrcp.py song.mp3 --chords --midi song.mid --cuda
+"""
+import os
+import sys
+import argparse
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.midi_reader import NOTE_DTYPE
+from utils.midi2lrcp import midi_to_note_blocks, group_blocks, note_blocks_to_text, mappable_pitches
+from utils.parse import blocks_to_events
+
+
+def transcription_to_notes(est_on_off_note_vels, velocity_scale=128):
+    """转录结果 (notes, 4)：[起音秒, 止音秒, MIDI 音高, 力度 0~1] -> read_midi_notes 同格式的结构化数组，按起音排序。"""
+    est = np.asarray(est_on_off_note_vels, dtype=np.float64).reshape(-1, 4)
+    notes = np.zeros(len(est), dtype=NOTE_DTYPE)
+    notes['start'] = est[:, 0]
+    notes['end'] = est[:, 1]
+    notes['pitch'] = est[:, 2]
+    notes['velocity'] = np.clip(np.nan_to_num(est[:, 3]) * velocity_scale, 0, 127)
+    return notes[np.argsort(notes['start'], kind='stable')]
+
+
+def transcribe_notes(audio_path, device='cpu', backend='torch', dtype='float32', batch_size='auto',
+                     stream=False, pitches=None, pedal=False, midi_path=None, progress_callback=None,
+                     cache_dir=None, skip_silence=False):
+    """转录音频为音符数组（不构造逐音符 dict）。模型取自常驻转录服务，多次调用只加载一次。
+
+    pedal 只影响可选的 MIDI 输出（LRCP 不使用踏板），默认不加载踏板模型。
+    指定 cache_dir 时缓存解码波形与模型输出（非流式），同一音频再次转换只需后处理。
+    skip_silence 时整段静音的分段不运行模型（默认关闭）。
+    """
+    from libs.piano_transcription_inference import config
+    from libs.piano_transcription_inference.service import get_service
+
+    transcriptor, _ = get_service().get_model(device, dtype=dtype, backend=backend, pedal=pedal,
+                                              status_callback=print)
+    # 模型与服务中的任务共用，持有其锁，避免两个线程同时推理
+    with transcriptor.lock:
+        if stream:
+            from libs.piano_transcription_inference.streaming import stream_audio
+            transcribed = transcriptor.transcribe_stream(stream_audio(audio_path, sr=config.sample_rate), midi_path,
+                                                         gui_callback=progress_callback, batch_size=batch_size,
+                                                         pitches=pitches, events=False, skip_silence=skip_silence)
+        else:
+            from libs.piano_transcription_inference.cache import StageCache
+            cache = StageCache(cache_dir) if cache_dir else None
+            transcribed = transcriptor.transcribe_file(audio_path, midi_path, cache=cache,
+                                                       gui_callback=progress_callback, batch_size=batch_size,
+                                                       pitches=pitches, events=False, skip_silence=skip_silence)
+    return transcription_to_notes(transcribed['est_on_off_note_vels'])
+
+
+def audio_to_note_blocks(audio_path, chords=False, pitch_margin=0, **kwargs):
+    """音频 -> (start, end, token) 列表，kwargs 见 transcribe_notes。
+
+    不识别和弦时只对 NOTE_MAP 中的音高（及上下各 pitch_margin 个半音）做后处理；
+    识别和弦需要全部低音区音符，此时处理全部音高。
+    """
+    pitches = None if chords else mappable_pitches(pitch_margin)
+    notes = transcribe_notes(audio_path, pitches=pitches, **kwargs)
+    return midi_to_note_blocks(notes, chords=chords)
+
+
+def audio_to_lrcp_text(audio_path, chords=False, pitch_margin=0, **kwargs) -> str:
+    """音频 -> LRCP 文本（不落盘）。"""
+    return note_blocks_to_text(audio_to_note_blocks(audio_path, chords, pitch_margin, **kwargs))
+
+
+def audio_to_events(audio_path, chords=False, pitch_margin=0, multi=False, **kwargs):
+    """音频 -> 播放器事件序列，与解析 audio_to_lrcp_text 的结果相同，但不经过文本。"""
+    blocks = audio_to_note_blocks(audio_path, chords, pitch_margin, **kwargs)
+    return blocks_to_events(group_blocks(blocks), multi=multi)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('audio', type=str, help='音频文件（mp3/wav 等）')
+    parser.add_argument('--output_lrcp', type=str, default=None, help='输出 lrcp 路径（默认与音频同名）')
+    parser.add_argument('--midi', type=str, default=None, help='同时写出 MIDI（可选）')
+    parser.add_argument('--pedal', action='store_true', help='MIDI 中包含踏板（需加载踏板模型）')
+    parser.add_argument('--chords', action='store_true', help='识别伴奏中的 C/Dm/Em/F/G/Am/G7 和弦并输出和弦 token')
+    parser.add_argument('--pitch_margin', type=int, default=0, help='后处理 NOTE_MAP 音高上下各 N 个半音')
+    parser.add_argument('--cuda', action='store_true', help='可用时使用 CUDA')
+    parser.add_argument('--backend', choices=['torch', 'torchscript', 'onnxruntime'], default='torch')
+    parser.add_argument('--stream', action='store_true', help='流式转录（长音频低内存）')
+    parser.add_argument('--skip_silence', action='store_true', help='整段低于静音阈值的分段不运行模型，输出置零')
+    parser.add_argument('--cache_dir', type=str, default=None, help='缓存解码波形与模型输出的目录（默认不缓存）')
+    args = parser.parse_args()
+
+    device = 'cpu'
+    if args.cuda:
+        import torch
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+
+    text = audio_to_lrcp_text(args.audio, chords=args.chords, pitch_margin=args.pitch_margin, device=device,
+                              backend=args.backend, stream=args.stream, pedal=args.pedal, midi_path=args.midi,
+                              cache_dir=args.cache_dir, skip_silence=args.skip_silence)
+    output_lrcp = args.output_lrcp or os.path.splitext(args.audio)[0] + '.lrcp'
+    with open(output_lrcp, 'w', encoding='utf-8') as f:
+        f.write(text)
+    print(f"已生成: {output_lrcp}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,16 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import os
+import sys
 import argparse
-import pretty_midi
+import numpy as np
 
-# General MIDI percussion channel is 9 (10th), but many MIDIs put drums on channel 9.
-# 我们不强依赖通道，按常见打击乐音高映射到游戏按键名。
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.midi_reader import read_instrument_notes, note_tuples
+
+# General MIDI 打击乐通道为第 10 通道（0 起计为 9）。文件中存在该通道时只转换该通道，
+# 避免把旋律声部中 35~59 的音误映射为鼓；否则退回按常见打击乐音高映射全部音符。
 
 DRUM_NOTE_MAP = {
     # Hi-Hat
@@ -26,22 +32,114 @@ DRUM_NOTE_MAP = {
 }
 
 
+DRUM_TOKEN_ORDER = sorted(set(DRUM_NOTE_MAP.values()))
+# 音高 -> DRUM_TOKEN_ORDER 下标，未映射为 -1（供向量化处理使用）
+_PITCH_TO_TOKEN_ID = np.full(128, -1, dtype=np.int16)
+for _pitch, _tok in DRUM_NOTE_MAP.items():
+    _PITCH_TO_TOKEN_ID[_pitch] = DRUM_TOKEN_ORDER.index(_tok)
+
+
+# thin_drum_hits 报告中无法映射到鼓的音符
+UNMAPPED = "未映射"
+
+
 def note_to_token(pitch: int):
     return DRUM_NOTE_MAP.get(pitch)
 
 
-def midi_to_note_blocks(pm: pretty_midi.PrettyMIDI):
+def thin_drum_hits(notes, min_velocity=0, max_rate=None):
+    """稀疏鼓点，减少鬼音/密集踩镲造成的漏键。
+
+    1) 力度低于 min_velocity 的击打直接去掉（鬼音），对全部击打向量化处理；
+    2) max_rate 为每种鼓每秒最多击打次数（float 对所有鼓生效，dict 按 token 单独指定）：
+       同一种鼓按起音顺序，距上一个保留的击打不足 1/max_rate 秒的去掉（同时起音取力度最大的），
+       因此任意两次保留的击打间隔都不小于 1/max_rate 秒。是否保留取决于上一个保留的击打，
+       只能顺序判断：排序与分组向量化，循环只经过保留的击打，用 searchsorted 跳过其间的击打。
+
+    Args:
+      notes: read_midi_notes() 返回的结构化数组（需含 velocity 字段）
+      min_velocity: int
+      max_rate: None | float | dict(token -> float)
+
+    Returns:
+      (kept_notes, report)，report 为 {token: (保留数, 去除数)}；无法映射到鼓的音符
+        同样被去掉，计入 {UNMAPPED: (0, 个数)}
+    """
+    token_ids = _PITCH_TO_TOKEN_ID[notes['pitch']]
+    mapped = token_ids >= 0
+    keep = mapped & (notes['velocity'] >= min_velocity)
+
+    if max_rate:
+        rates = np.zeros(len(DRUM_TOKEN_ORDER))
+        if isinstance(max_rate, dict):
+            for tok, rate in max_rate.items():
+                rates[DRUM_TOKEN_ORDER.index(tok)] = rate
+        else:
+            rates[:] = max_rate
+        cand = np.flatnonzero(keep & (rates[np.maximum(token_ids, 0)] > 0))
+        if len(cand):
+            # 按 (鼓, 起音, 力度降序) 排序，每种鼓为连续一段，起音有序
+            order = np.lexsort((-notes['velocity'][cand].astype(np.int16), notes['start'][cand], token_ids[cand]))
+            cand = cand[order]
+            cand_tok = token_ids[cand]
+            starts = notes['start'][cand]
+            keep[cand] = False
+            bounds = np.searchsorted(cand_tok, np.arange(len(DRUM_TOKEN_ORDER) + 1))
+            for tok in np.flatnonzero(np.diff(bounds)):
+                bgn, end = int(bounds[tok]), int(bounds[tok + 1])
+                min_gap = 1.0 / rates[tok] - 1e-9
+                i = bgn
+                while i < end:
+                    # 保留 i，下一个保留的是起音不早于 starts[i] + min_gap 的第一个击打
+                    keep[cand[i]] = True
+                    i = bgn + int(np.searchsorted(starts[bgn:end], starts[i] + min_gap, side='left'))
+
+    kept_counts = np.bincount(token_ids[keep], minlength=len(DRUM_TOKEN_ORDER))
+    total_counts = np.bincount(token_ids[mapped], minlength=len(DRUM_TOKEN_ORDER))
+    report = {tok: (int(kept_counts[i]), int(total_counts[i] - kept_counts[i]))
+              for i, tok in enumerate(DRUM_TOKEN_ORDER) if total_counts[i]}
+    unmapped = int(len(notes) - mapped.sum())
+    if unmapped:
+        report[UNMAPPED] = (0, unmapped)
+    return notes[keep], report
+
+
+def format_thin_report(report) -> str:
+    lines = [f"{tok}: 保留 {kept}，去除 {removed}" for tok, (kept, removed) in report.items()]
+    kept_all = sum(k for k, _ in report.values())
+    removed_all = sum(r for _, r in report.values())
+    lines.append(f"合计: 保留 {kept_all}，去除 {removed_all}")
+    return "\n".join(lines)
+
+
+def parse_max_rate(text):
+    """解析 --max_rate：'12' 对全部鼓生效；'踩镲闭=8,军鼓=10' 按鼓指定。"""
+    if not text:
+        return None
+    if '=' not in text:
+        return float(text)
+    rates = {}
+    for item in text.split(','):
+        tok, rate = item.split('=')
+        tok = tok.strip()
+        if tok not in DRUM_TOKEN_ORDER:
+            raise ValueError(f"未知鼓 token: {tok}")
+        rates[tok] = float(rate)
+    return rates
+
+
+def midi_to_note_blocks(pm):
+    """pm 可为 read_midi_notes() 返回的音符数组，也兼容 pretty_midi.PrettyMIDI。"""
     blocks = []
-    for inst in pm.instruments:
-        for note in inst.notes:
-            tok = note_to_token(note.pitch)
-            if not tok:
-                continue
-            s = round(note.start, 3)
-            e = round(note.end, 3)
-            if e < s:
-                e = s
-            blocks.append((s, e, tok))
+    for start, end, pitch in note_tuples(pm):
+        tok = note_to_token(pitch)
+        if not tok:
+            continue
+        s = round(start, 3)
+        e = round(end, 3)
+        if e < s:
+            e = s
+        blocks.append((s, e, tok))
     return blocks
 
 
@@ -64,9 +162,12 @@ def format_time(t: float) -> str:
     return f"[{m:02d}:{s:06.3f}]"
 
 
-def midi_to_lrcd(midi_path: str, lrcd_path: str):
-    pm = pretty_midi.PrettyMIDI(midi_path)
-    blocks = midi_to_note_blocks(pm)
+def midi_to_lrcd(midi_path: str, lrcd_path: str, parts=None, min_velocity=0, max_rate=None):
+    notes = read_instrument_notes(midi_path, drum=True, parts=parts)
+    if min_velocity or max_rate:
+        notes, report = thin_drum_hits(notes, min_velocity, max_rate)
+        print(format_thin_report(report))
+    blocks = midi_to_note_blocks(notes)
     grouped = group_blocks(blocks)
     with open(lrcd_path, 'w', encoding='utf-8') as f:
         for s, e, toks in grouped:
@@ -78,9 +179,19 @@ def midi_to_lrcd(midi_path: str, lrcd_path: str):
     print(f"已生成: {lrcd_path}")
 
 
-def midi_to_lrcd_text(midi_path: str) -> str:
-    pm = pretty_midi.PrettyMIDI(midi_path)
-    blocks = midi_to_note_blocks(pm)
+def midi_to_lrcd_text(midi_path: str, parts=None, mid=None, min_velocity=0, max_rate=None) -> str:
+    """parts 为要转换的 (轨, 通道) 集合，默认优先 GM 打击乐通道；mid 为已解析的 mido.MidiFile。
+    min_velocity / max_rate 见 thin_drum_hits。
+    """
+    notes = read_instrument_notes(midi_path, drum=True, parts=parts, mid=mid)
+    if min_velocity or max_rate:
+        notes, _report = thin_drum_hits(notes, min_velocity, max_rate)
+    blocks = midi_to_note_blocks(notes)
+    return note_blocks_to_text(blocks)
+
+
+def note_blocks_to_text(blocks) -> str:
+    """将 (start, end, token) 列表分组并格式化为 LRCD 文本."""
     grouped = group_blocks(blocks)
     lines = []
     for s, e, toks in grouped:
@@ -95,5 +206,9 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--input_midi', type=str, required=True, help='需要转换的mid文件路径')
     parser.add_argument('--output_lrcd', type=str, required=True, help='转换后保存的lrcd文件路径')
+    parser.add_argument('--min_velocity', type=int, default=0, help='去掉力度低于该值的鬼音（0~127，0 为不过滤）')
+    parser.add_argument('--max_rate', type=str, default=None,
+                        help='每种鼓每秒最多击打次数，如 "12" 或 "踩镲闭=8,军鼓=10"')
     args = parser.parse_args()
-    midi_to_lrcd(args.input_midi, args.output_lrcd)
+    midi_to_lrcd(args.input_midi, args.output_lrcd, min_velocity=args.min_velocity,
+                 max_rate=parse_max_rate(args.max_rate))
@@ -1,5 +1,10 @@
+import os
+import sys
 import argparse
-import pretty_midi
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.midi_reader import read_instrument_notes, note_tuples
 
 # 音符到lrcp映射表（使用 C4=60 基准）
 NOTE_MAP = {
@@ -11,25 +16,91 @@ NOTE_MAP = {
     72: 'H1', 74: 'H2', 76: 'H3', 77: 'H4', 79: 'H5', 81: 'H6', 83: 'H7',
 }
 
+# 和弦 token -> 音级集合（pitch class, C=0），与 CHORD_MAP 的 z x c v b n m 对应
+CHORD_PITCH_CLASSES = {
+    "C": frozenset({0, 4, 7}),
+    "Dm": frozenset({2, 5, 9}),
+    "Em": frozenset({4, 7, 11}),
+    "F": frozenset({5, 9, 0}),
+    "G": frozenset({7, 11, 2}),
+    "Am": frozenset({9, 0, 4}),
+    "G7": frozenset({7, 11, 2, 5}),
+}
+_PITCH_CLASSES_TO_CHORD = {pcs: name for name, pcs in CHORD_PITCH_CLASSES.items()}
+
+# 和弦识别默认参数：起音相差不超过 window 秒的伴奏音视为同时按下；低于 split_pitch 的音视为伴奏
+CHORD_WINDOW = 0.05
+CHORD_SPLIT_PITCH = 60
+
 
-# 可选：和弦识别略（保留接口）
 def note_to_token(note):
     return NOTE_MAP.get(note, None)
 
 
-def midi_to_note_blocks(pm):
-    """返回 (start, end, token) 列表，保留延音."""
+def mappable_pitches(margin=0):
+    """NOTE_MAP 中可演奏的 MIDI 音高，外加上下各 margin 个半音（供之后移调使用）。"""
+    return sorted({pitch + d for pitch in NOTE_MAP for d in range(-margin, margin + 1)})
+
+
+def detect_chords(notes, window=CHORD_WINDOW, split_pitch=CHORD_SPLIT_PITCH):
+    """在伴奏声部中识别 CHORD_MAP 支持的和弦。
+
+    notes 为 (start, end, pitch) 列表。对低于 split_pitch 的音按起音排序，
+    以每个未被占用的音为窗口起点，收集 window 秒内起音的伴奏音，若其音级集合
+    恰好等于某个和弦（八度重复不影响），则整组替换为一个和弦 token。
+    返回 (chord_blocks, remaining_notes)，chord_blocks 为 (start, end, token)。
+    """
+    accomp = sorted((n for n in notes if n[2] < split_pitch), key=lambda n: n[0])
+    melody = [n for n in notes if n[2] >= split_pitch]
+
+    chord_blocks = []
+    remaining = []
+    i = 0
+    while i < len(accomp):
+        j = i + 1
+        while j < len(accomp) and accomp[j][0] - accomp[i][0] <= window:
+            j += 1
+        group = accomp[i:j]
+        chord = _PITCH_CLASSES_TO_CHORD.get(frozenset(p % 12 for _, _, p in group))
+        if chord:
+            # 和弦随最早松开的音一起释放，避免比原谱多延音
+            chord_blocks.append((group[0][0], min(e for _, e, _ in group), chord))
+            i = j
+        else:
+            remaining.append(accomp[i])
+            i += 1
+    return chord_blocks, melody + remaining
+
+
+def midi_to_note_blocks(pm, chords=False, chord_window=CHORD_WINDOW, chord_split=CHORD_SPLIT_PITCH):
+    """返回 (start, end, token) 列表，保留延音.
+
+    pm 可为 read_midi_notes() 返回的音符数组，也兼容 pretty_midi.PrettyMIDI。
+    chords=True 时先对伴奏做和弦识别，匹配到的音合并为单个和弦 token。
+    """
+    notes = note_tuples(pm)
+    chord_blocks = []
+    if chords:
+        chord_blocks, notes = detect_chords(notes, chord_window, chord_split)
+    return notes_to_note_blocks(notes, chord_blocks)
+
+
+def notes_to_note_blocks(notes, chord_blocks=()):
+    """(start, end, pitch) 列表转为 (start, end, token) 列表，chord_blocks 为
+    detect_chords 已识别的和弦（notes 应为其剩余的音），排在最前。"""
+    raw_blocks = list(chord_blocks)
+    for start, end, pitch in notes:
+        token = note_to_token(pitch)
+        if token:
+            raw_blocks.append((start, end, token))
+
     blocks = []
-    for inst in pm.instruments:
-        for note in inst.notes:
-            token = note_to_token(note.pitch)
-            if not token:
-                continue
-            start = round(note.start, 3)
-            end = round(note.end, 3)
-            if end < start:
-                end = start
-            blocks.append((start, end, token))
+    for start, end, token in raw_blocks:
+        start = round(start, 3)
+        end = round(end, 3)
+        if end < start:
+            end = start
+        blocks.append((start, end, token))
     return blocks
 
 
@@ -53,9 +124,9 @@ def format_time(t):
     return f"[{m:02d}:{s:06.3f}]"
 
 
-def midi_to_lrcp(midi_path, lrcp_path):
-    pm = pretty_midi.PrettyMIDI(midi_path)
-    blocks = midi_to_note_blocks(pm)
+def midi_to_lrcp(midi_path, lrcp_path, chords=False, parts=None):
+    notes = read_instrument_notes(midi_path, parts=parts)
+    blocks = midi_to_note_blocks(notes, chords=chords)
     grouped = group_blocks(blocks)
     with open(lrcp_path, 'w', encoding='utf-8') as f:
         for start, end, tokens in grouped:
@@ -68,12 +139,19 @@ def midi_to_lrcp(midi_path, lrcp_path):
     print(f"已生成: {lrcp_path}")
 
 
-def midi_to_lrcp_text(midi_path: str) -> str:
+def midi_to_lrcp_text(midi_path: str, chords: bool = False, parts=None, mid=None) -> str:
     """将 MIDI 文件转换为 LRCP 文本（不落盘，直接返回字符串）。
     保留原有 midi_to_lrcp(midi_path, lrcp_path) 以兼容脚本独立执行。
+    chords=True 时启用伴奏和弦识别（仅单人模式有意义，多人模式会去掉和弦）。
+    parts 为要转换的 (轨, 通道) 集合，默认排除 GM 打击乐通道；mid 为已解析的 mido.MidiFile。
     """
-    pm = pretty_midi.PrettyMIDI(midi_path)
-    blocks = midi_to_note_blocks(pm)
+    notes = read_instrument_notes(midi_path, parts=parts, mid=mid)
+    blocks = midi_to_note_blocks(notes, chords=chords)
+    return note_blocks_to_text(blocks)
+
+
+def note_blocks_to_text(blocks) -> str:
+    """将 (start, end, token) 列表分组并格式化为 LRCP 文本."""
     grouped = group_blocks(blocks)
     lines = []
     for start, end, tokens in grouped:
@@ -88,8 +166,9 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--input_midi', type=str, default='example/mid/卡农.mid', help='需要转换的mid文件路径')
     parser.add_argument('--output_lrcp', type=str, default='example/lrcp/卡农.lrcp', help='转换后保存的lrcp文件路径')
+    parser.add_argument('--chords', action='store_true', help='识别伴奏中的 C/Dm/Em/F/G/Am/G7 和弦并输出和弦 token')
     args = parser.parse_args()
 
     midi_file = args.input_midi
     lrcp_file = args.output_lrcp
-    midi_to_lrcp(midi_file, lrcp_file)
+    midi_to_lrcp(midi_file, lrcp_file, chords=args.chords)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""批量 MIDI -> LRCP/LRCD 转换（多进程）。
+
+用法示例：
+    python utils/midi_batch.py songs/ "packs/**/*.mid" --instrument piano --output_dir out/
+    python utils/midi_batch.py drums/ --instrument drum --workers 8
+
+- 输入可以是目录（递归查找 .mid/.midi）、通配符或单个文件；
+- 指定 --output_dir 时保留输入相对其目录（或通配符前的固定部分）的子目录结构，
+  不同输入映射到同一输出文件时报告冲突而不覆盖；
+- 输出比输入新时跳过（--force 强制重转）；
+- 结束后打印汇总并写出 CSV 报告（音符数、丢弃音符数、时长、转换耗时）。
+"""
+import argparse
+import csv
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.midi_reader import read_instrument_notes, note_tuples, notes_end_time
+from utils.midi2lrcd import parse_max_rate
+
+MIDI_EXTS = (".mid", ".midi")
+REPORT_FIELDS = ["input", "output", "status", "notes", "tokens", "dropped", "thinned", "duration", "seconds", "error"]
+
+
+def pattern_root(pattern):
+    """通配符中第一个含通配符的部分之前的目录，如 "packs/**/*.mid" -> "packs"。"""
+    parts = []
+    for part in os.path.normpath(pattern).split(os.sep):
+        if glob.has_magic(part):
+            break
+        parts.append(part)
+    return os.sep.join(parts) if parts else "."
+
+
+def collect_inputs(patterns):
+    """展开目录/通配符/文件为去重后的 MIDI 路径列表（保持输入顺序）。
+
+    返回 (paths, roots)：roots[path] 为该文件所属输入的根目录（目录本身、通配符前的
+    固定部分或单个文件所在目录），输出到 --output_dir 时保留相对根目录的子目录。
+    """
+    found = []
+    for pat in patterns:
+        if os.path.isdir(pat):
+            for root, _dirs, files in os.walk(pat):
+                for name in sorted(files):
+                    if name.lower().endswith(MIDI_EXTS):
+                        found.append((os.path.join(root, name), pat))
+        elif os.path.isfile(pat):
+            found.append((pat, os.path.dirname(pat)))
+        else:
+            found.extend((p, pattern_root(pat)) for p in sorted(glob.glob(pat, recursive=True))
+                         if p.lower().endswith(MIDI_EXTS))
+    seen = set()
+    out = []
+    roots = {}
+    for p, root in found:
+        key = os.path.abspath(p)
+        if key not in seen:
+            seen.add(key)
+            out.append(p)
+            roots[p] = root
+    return out, roots
+
+
+def output_path_for(midi_path, instrument, output_dir=None, root=None):
+    ext = ".lrcp" if instrument == "piano" else ".lrcd"
+    stem = os.path.splitext(os.path.basename(midi_path))[0]
+    if not output_dir:
+        return os.path.join(os.path.dirname(midi_path), stem + ext)
+    relative = "."
+    if root is not None:
+        relative = os.path.relpath(os.path.dirname(midi_path) or ".", root or ".")
+        if relative.startswith(".."):
+            relative = "."
+    return os.path.normpath(os.path.join(output_dir, relative, stem + ext))
+
+
+def is_up_to_date(midi_path, out_path):
+    return os.path.exists(out_path) and os.path.getmtime(out_path) >= os.path.getmtime(midi_path)
+
+
+def convert_one(midi_path, out_path, instrument="piano", chords=False, min_velocity=0, max_rate=None):
+    """子进程入口：转换单个文件并返回统计信息 dict。"""
+    t0 = time.perf_counter()
+    row = {"input": midi_path, "output": out_path, "status": "ok", "notes": 0, "tokens": 0,
+           "dropped": 0, "thinned": 0, "duration": 0.0, "seconds": 0.0, "error": ""}
+    try:
+        note_arr = read_instrument_notes(midi_path, drum=(instrument == "drum"))
+        notes = note_tuples(note_arr)
+        if instrument == "piano":
+            from utils import midi2lrcp as conv
+            chord_blocks, rest = conv.detect_chords(notes) if chords else ([], notes)
+            blocks = conv.notes_to_note_blocks(rest, chord_blocks)
+        else:
+            from utils import midi2lrcd as conv
+            rest = notes
+            if min_velocity or max_rate:
+                note_arr, report = conv.thin_drum_hits(note_arr, min_velocity, max_rate)
+                # 无法映射的音已计入 dropped
+                row["thinned"] = sum(removed for tok, (_kept, removed) in report.items() if tok != conv.UNMAPPED)
+            blocks = conv.midi_to_note_blocks(note_arr)
+        text = conv.note_blocks_to_text(blocks)
+
+        folder = os.path.dirname(out_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(out_path, "w", encoding="utf-8") as f:
+            f.write(text)
+
+        row["notes"] = len(notes)
+        row["tokens"] = len(blocks)
+        # 被和弦吸收的音不算丢弃；其余无法映射到游戏键位的音计为丢弃
+        row["dropped"] = sum(1 for _s, _e, p in rest if conv.note_to_token(p) is None)
+        row["duration"] = round(notes_end_time(note_arr), 3)
+    except Exception as e:
+        row["status"] = "failed"
+        row["error"] = f"{type(e).__name__}: {e}"
+    row["seconds"] = round(time.perf_counter() - t0, 4)
+    return row
+
+
+def run_batch(inputs, instrument="piano", output_dir=None, chords=False, workers=None, force=False,
+              progress=print, min_velocity=0, max_rate=None, roots=None):
+    """并行转换 inputs，返回每个文件的统计行（按输入顺序）。roots 见 collect_inputs。
+
+    多个输入映射到同一输出文件时，只转换第一个，其余记为失败并说明冲突。
+    """
+    rows = {}
+    jobs = []
+    owners = {}
+    for midi_path in inputs:
+        out_path = output_path_for(midi_path, instrument, output_dir, (roots or {}).get(midi_path))
+        owner = owners.setdefault(os.path.normcase(os.path.abspath(out_path)), midi_path)
+        if owner != midi_path:
+            rows[midi_path] = {"input": midi_path, "output": out_path, "status": "failed", "notes": "",
+                               "tokens": "", "dropped": "", "thinned": "", "duration": "", "seconds": 0.0,
+                               "error": f"输出文件与 {owner} 冲突"}
+        elif not force and is_up_to_date(midi_path, out_path):
+            rows[midi_path] = {"input": midi_path, "output": out_path, "status": "skipped", "notes": "",
+                               "tokens": "", "dropped": "", "thinned": "", "duration": "", "seconds": 0.0, "error": ""}
+        else:
+            jobs.append((midi_path, out_path))
+
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(convert_one, m, o, instrument, chords, min_velocity, max_rate): m for m, o in jobs}
+            for done, fut in enumerate(as_completed(futures), 1):
+                row = fut.result()
+                rows[futures[fut]] = row
+                if progress:
+                    progress(f"[{done}/{len(jobs)}] {row['status']:7s} {row['input']} ({row['seconds']:.2f}s)")
+    return [rows[m] for m in inputs]
+
+
+def write_report(rows, report_path):
+    folder = os.path.dirname(report_path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(report_path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def summarize(rows):
+    converted = [r for r in rows if r["status"] == "ok"]
+    skipped = sum(1 for r in rows if r["status"] == "skipped")
+    failed = sum(1 for r in rows if r["status"] == "failed")
+    notes = sum(r["notes"] for r in converted)
+    dropped = sum(r["dropped"] for r in converted)
+    duration = sum(r["duration"] for r in converted)
+    seconds = sum(r["seconds"] for r in converted)
+    return (f"共 {len(rows)} 个文件：转换 {len(converted)}，跳过 {skipped}，失败 {failed}；"
+            f"音符 {notes}（丢弃 {dropped}），乐曲总时长 {duration:.1f}s，转换耗时合计 {seconds:.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批量将 MIDI 转换为 .lrcp/.lrcd（多进程）")
+    parser.add_argument('inputs', nargs='+', help='MIDI 文件、目录或通配符（如 "songs/**/*.mid"）')
+    parser.add_argument('--instrument', choices=['piano', 'drum'], default='piano', help='目标乐器')
+    parser.add_argument('--output_dir', type=str, default=None, help='输出目录（默认与输入同目录）')
+    parser.add_argument('--chords', action='store_true', help='钢琴：识别伴奏和弦并输出和弦 token')
+    parser.add_argument('--min_velocity', type=int, default=0, help='架子鼓：去掉力度低于该值的鬼音')
+    parser.add_argument('--max_rate', type=str, default=None, help='架子鼓：每种鼓每秒最多击打次数，如 "12" 或 "踩镲闭=8"')
+    parser.add_argument('--workers', type=int, default=None, help='进程数（默认 CPU 核数）')
+    parser.add_argument('--force', action='store_true', help='忽略时间戳，全部重新转换')
+    parser.add_argument('--report', type=str, default=None, help='CSV 报告路径（默认 输出目录/convert_report.csv）')
+    args = parser.parse_args()
+
+    midi_files, input_roots = collect_inputs(args.inputs)
+    if not midi_files:
+        print("未找到任何 MIDI 文件")
+        sys.exit(1)
+
+    t_start = time.perf_counter()
+    results = run_batch(midi_files, instrument=args.instrument, output_dir=args.output_dir,
+                        chords=args.chords, workers=args.workers, force=args.force,
+                        min_velocity=args.min_velocity, max_rate=parse_max_rate(args.max_rate),
+                        roots=input_roots)
+    report = args.report or os.path.join(args.output_dir or os.getcwd(), "convert_report.csv")
+    write_report(results, report)
+    print(summarize(results))
+    print(f"总耗时 {time.perf_counter() - t_start:.2f}s，报告: {report}")
+    if any(r["status"] == "failed" for r in results):
+        sys.exit(2)
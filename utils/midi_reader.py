@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""基于 mido 的轻量 MIDI 音符读取器。
+
+pretty_midi 会为每个文件构建完整的 Instrument/Note 对象图，并生成覆盖到最后一个
+tick 的 tick->秒 数组；而谱面转换只需要每个音的 (start, end, pitch)。
+这里逐轨遍历一次消息，按节拍表增量换算时间，直接得到紧凑的 numpy 结构化数组。
+
+配对规则与 pretty_midi 保持一致：
+- 节拍表取自第 0 轨（type 0 文件即全部事件）；
+- 同一 (轨, 通道, 音高) 上，一个 note_off（或 velocity=0 的 note_on）关闭此前所有未关闭的音；
+- 与 note_off 同一 tick 开始的音保留（若同时关闭了更早的音），否则一并丢弃；
+- 直到文件结束仍未关闭的音丢弃。
+"""
+import numpy as np
+import mido
+
+DEFAULT_TEMPO = 500000  # 120 BPM（微秒/拍）
+GM_DRUM_CHANNEL = 9  # General MIDI 打击乐通道（第 10 通道，0 起计为 9）
+
+# 每个音：起止时间（秒）、音高、力度、所在轨、通道
+NOTE_DTYPE = np.dtype([
+    ('start', np.float64),
+    ('end', np.float64),
+    ('pitch', np.uint8),
+    ('velocity', np.uint8),
+    ('track', np.uint16),
+    ('channel', np.uint8),
+])
+
+
+def _tempo_map(mid):
+    """返回 (tick 数组, 该 tick 处已累计的秒数数组, 每 tick 秒数数组)。"""
+    ticks_per_beat = mid.ticks_per_beat
+    change_ticks = [0]
+    tempos = [DEFAULT_TEMPO]
+    tick = 0
+    for msg in mid.tracks[0] if mid.tracks else []:
+        tick += msg.time
+        if msg.type == 'set_tempo':
+            if tick == change_ticks[-1]:
+                tempos[-1] = msg.tempo
+            else:
+                change_ticks.append(tick)
+                tempos.append(msg.tempo)
+
+    scales = [t / (1e6 * ticks_per_beat) for t in tempos]
+    seconds = [0.0]
+    for i in range(1, len(change_ticks)):
+        seconds.append(seconds[-1] + (change_ticks[i] - change_ticks[i - 1]) * scales[i - 1])
+    return change_ticks, seconds, scales
+
+
+class _TickClock:
+    """在单条轨内按 tick 单调递增地换算秒数，节拍表指针只前进不回退。"""
+
+    def __init__(self, tempo_map):
+        self.ticks, self.seconds, self.scales = tempo_map
+        self.idx = 0
+
+    def reset(self):
+        self.idx = 0
+
+    def __call__(self, tick):
+        ticks = self.ticks
+        while self.idx + 1 < len(ticks) and ticks[self.idx + 1] <= tick:
+            self.idx += 1
+        return self.seconds[self.idx] + (tick - ticks[self.idx]) * self.scales[self.idx]
+
+
+def index_midi_tracks(midi_path, mid=None):
+    """第一遍扫描：按 (轨, 通道) 统计音符数与音域，不配对音符、不换算时间。
+
+    Returns:
+      parts: list of dict，按 (track, channel) 排序，例如
+        [{'track': 1, 'channel': 0, 'name': 'Piano', 'program': 0,
+          'notes': 512, 'min_pitch': 36, 'max_pitch': 84}, ...]
+    """
+    if mid is None:
+        mid = mido.MidiFile(midi_path)
+    parts = {}
+    for track_idx, track in enumerate(mid.tracks):
+        name = ''
+        programs = {}
+        for msg in track:
+            mtype = msg.type
+            if mtype == 'note_on':
+                if msg.velocity == 0:
+                    continue
+                info = parts.get((track_idx, msg.channel))
+                if info is None:
+                    info = parts[(track_idx, msg.channel)] = {
+                        'track': track_idx, 'channel': msg.channel, 'name': '', 'program': None,
+                        'notes': 0, 'min_pitch': msg.note, 'max_pitch': msg.note}
+                info['notes'] += 1
+                if msg.note < info['min_pitch']:
+                    info['min_pitch'] = msg.note
+                elif msg.note > info['max_pitch']:
+                    info['max_pitch'] = msg.note
+            elif mtype == 'track_name' and not name:
+                name = msg.name.strip()
+            elif mtype == 'program_change' and msg.channel not in programs:
+                programs[msg.channel] = msg.program
+        for (t, ch), info in parts.items():
+            if t == track_idx:
+                info['name'] = name
+                info['program'] = programs.get(ch)
+    return [parts[k] for k in sorted(parts)]
+
+
+def default_parts(index, drum=False):
+    """默认选中的 (轨, 通道)：
+    - 钢琴：排除 GM 打击乐通道；
+    - 架子鼓：存在 GM 打击乐通道时只取该通道，避免把旋律音（35~59）误映射为鼓；否则全部保留。
+    """
+    drum_parts = {(p['track'], p['channel']) for p in index if p['channel'] == GM_DRUM_CHANNEL}
+    if drum:
+        return drum_parts or {(p['track'], p['channel']) for p in index}
+    return {(p['track'], p['channel']) for p in index} - drum_parts
+
+
+def read_midi_notes(midi_path, mid=None, parts=None) -> np.ndarray:
+    """读取 MIDI 文件中的音符。
+
+    Args:
+      midi_path: str，MIDI 文件路径
+      mid: 可选，已解析的 mido.MidiFile（避免重复解析）
+      parts: 可选，只解码这些 (track, channel)；未选中的轨整条跳过
+
+    Returns:
+      notes: NOTE_DTYPE 结构化数组，按 (start, pitch) 排序
+    """
+    if mid is None:
+        mid = mido.MidiFile(midi_path)
+    clock = _TickClock(_tempo_map(mid))
+    if parts is not None:
+        parts = set(parts)
+        wanted_tracks = {t for t, _ch in parts}
+
+    rows = []
+    for track_idx, track in enumerate(mid.tracks):
+        if parts is not None and track_idx not in wanted_tracks:
+            continue
+        clock.reset()
+        open_notes = {}  # (channel, pitch) -> [(start_tick, start_seconds, velocity), ...]
+        tick = 0
+        for msg in track:
+            tick += msg.time
+            mtype = msg.type
+            if mtype != 'note_on' and mtype != 'note_off':
+                continue
+            if parts is not None and (track_idx, msg.channel) not in parts:
+                continue
+            if mtype == 'note_on' and msg.velocity > 0:
+                open_notes.setdefault((msg.channel, msg.note), []).append((tick, clock(tick), msg.velocity))
+            else:
+                key = (msg.channel, msg.note)
+                pending = open_notes.get(key)
+                if not pending:
+                    continue
+                to_close = [p for p in pending if p[0] != tick]
+                to_keep = [p for p in pending if p[0] == tick]
+                if to_close and to_keep:
+                    open_notes[key] = to_keep
+                else:
+                    del open_notes[key]
+                end = clock(tick)
+                for _start_tick, start, velocity in to_close:
+                    rows.append((start, end, msg.note, velocity, track_idx, msg.channel))
+
+    notes = np.array(rows, dtype=NOTE_DTYPE)
+    if len(notes):
+        notes = notes[np.lexsort((notes['pitch'], notes['start']))]
+    return notes
+
+
+def read_instrument_notes(midi_path, drum=False, parts=None, mid=None) -> np.ndarray:
+    """按乐器读取音符：未指定 parts 时使用 default_parts 的默认轨道/通道选择。"""
+    if mid is None:
+        mid = mido.MidiFile(midi_path)
+    if parts is None:
+        parts = default_parts(index_midi_tracks(midi_path, mid=mid), drum=drum)
+    return read_midi_notes(midi_path, mid=mid, parts=parts)
+
+
+def notes_end_time(notes) -> float:
+    return float(notes['end'].max()) if len(notes) else 0.0
+
+
+def note_tuples(source):
+    """统一为 (start, end, pitch) 元组列表；source 可为 read_midi_notes 的结果或 pretty_midi.PrettyMIDI。"""
+    if hasattr(source, 'instruments'):
+        return [(n.start, n.end, n.pitch) for inst in source.instruments for n in inst.notes]
+    return list(zip(source['start'].tolist(), source['end'].tolist(), source['pitch'].tolist()))
+
+
+_PITCH_NAMES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+
+
+def pitch_name(pitch: int) -> str:
+    """MIDI 音高 -> 音名（C4=60）。"""
+    return f"{_PITCH_NAMES[pitch % 12]}{pitch // 12 - 1}"
@@ -11,6 +11,20 @@ def _ts_match_to_seconds(m: re.Match) -> float:
     return mm * 60 + ss + ms / 1000.0
 
 
+def token_to_key(tok: str) -> str:
+    """钢琴 token（L/M/H 单音或和弦）-> 按键。"""
+    if tok[0] in ("L", "M", "H"):
+        octave = tok[0]
+        num = tok[1]
+        if octave == "L":
+            return LOW_MAP[num]
+        elif octave == "M":
+            return MID_MAP[num]
+        else:
+            return HIGH_MAP[num]
+    return CHORD_MAP[tok]
+
+
 def parse_line(line: str, multi: bool = False) -> List[Event]:
     """解析一行：
     钢琴：
@@ -44,18 +58,7 @@ def parse_line(line: str, multi: bool = False) -> List[Event]:
     if piano_tokens and not drum_tokens:
         # 钢琴行
         valid_tokens = piano_tokens
-        for tok in valid_tokens:
-            if tok[0] in ("L", "M", "H"):
-                octave = tok[0]
-                num = tok[1]
-                if octave == "L":
-                    keys.append(LOW_MAP[num])
-                elif octave == "M":
-                    keys.append(MID_MAP[num])
-                else:
-                    keys.append(HIGH_MAP[num])
-            else:
-                keys.append(CHORD_MAP[tok])
+        keys = [token_to_key(tok) for tok in valid_tokens]
     elif drum_tokens and not piano_tokens:
         # 架子鼓行
         valid_tokens = drum_tokens
@@ -98,6 +101,22 @@ def parse_score(text: str, multi: bool = False) -> List[Event]:
     return events
 
 
+def blocks_to_events(grouped, multi: bool = False) -> List[Event]:
+    """由 group_blocks 的 (start, end, tokens) 直接构造钢琴事件，省去格式化为文本再逐行正则解析。
+    结果与 parse_score(note_blocks_to_text(blocks), multi) 相同（时间精度到毫秒）。"""
+    events: List[Event] = []
+    for start, end, tokens in grouped:
+        keys = [token_to_key(tok) for tok in tokens]
+        if abs(end - start) < 1e-6 or end < start:
+            end = start  # 单时间戳：tap
+        if multi:
+            events.append(Event(start=start, end=end, keys=keys, raw_tokens=list(tokens)))
+        else:
+            events.append(Event(start=start, end=end, keys=keys))
+    events.sort(key=lambda e: e.start)
+    return events
+
+
 # 预处理：去和弦 + 多音展开并应用偏移
 # 对于架子鼓（没有和弦），raw_tokens 里不会出现 CHORD_TOKENS，逻辑同样适用。
 def preprocess(events: List[Event], offsets_ms: List[int]) -> List[SimpleEvent]: